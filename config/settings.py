@@ -43,6 +43,7 @@ MIDDLEWARE = [
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "users.middleware.RolesMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -60,6 +61,7 @@ TEMPLATES = [
                 "django.template.context_processors.request",
                 "django.contrib.auth.context_processors.auth",
                 "django.contrib.messages.context_processors.messages",
+                "users.context_processors.roles",
             ],
         },
     },
@@ -116,13 +118,53 @@ FILE_UPLOAD_MAX_MEMORY_SIZE = 2 * 1024 * 1024  # max 2 MB
 # Работа с почтой
 EMAIL_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
 EMAIL_HOST = os.getenv("EMAIL_HOST")
-EMAIL_PORT = os.getenv("EMAIL_PORT", 587)
-EMAIL_USE_TLS = os.getenv("EMAIL_USE_TLS", "True")
-EMAIL_USE_SSL = os.getenv("EMAIL_USE_SSL", "False")
+EMAIL_PORT = int(os.getenv("EMAIL_PORT", 587))
+EMAIL_USE_TLS = os.getenv("EMAIL_USE_TLS", "True") == "True"
+EMAIL_USE_SSL = os.getenv("EMAIL_USE_SSL", "False") == "True"
 EMAIL_HOST_USER = os.getenv("EMAIL_HOST_USER")
 EMAIL_HOST_PASSWORD = os.getenv("EMAIL_HOST_PASSWORD")
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 
+# Отправка рассылок
+MAILING_BATCH_SIZE = int(os.getenv("MAILING_BATCH_SIZE", 100))  # Писем в одной пачке через одно SMTP-соединение
+MAILING_FETCH_SIZE = int(os.getenv("MAILING_FETCH_SIZE", 2000))  # Получателей, читаемых из БД за один запрос
+MAILING_ENGINE = os.getenv("MAILING_ENGINE", "sync")  # "sync" - бэкенд Django, "async" - пул asyncio-сессий
+MAILING_ASYNC_CONNECTIONS = int(os.getenv("MAILING_ASYNC_CONNECTIONS", 10))  # Одновременных SMTP-сессий
+# Подбор числа одновременных отправок движка async по времени ответа сервера и временным отказам (AIMD):
+# от MAILING_CONCURRENCY_MIN до MAILING_ASYNC_CONNECTIONS
+MAILING_CONCURRENCY_ADAPTIVE = os.getenv("MAILING_CONCURRENCY_ADAPTIVE", "True") == "True"
+MAILING_CONCURRENCY_MIN = int(os.getenv("MAILING_CONCURRENCY_MIN", 2))
+MAILING_CONCURRENCY_LATENCY_TOLERANCE = float(os.getenv("MAILING_CONCURRENCY_LATENCY_TOLERANCE", 2))  # Рост ответа
+MAILING_CONCURRENCY_DECREASE = float(os.getenv("MAILING_CONCURRENCY_DECREASE", 0.7))  # Множитель при перегрузке
+MAILING_CONCURRENCY_DEFERRAL_TOLERANCE = float(os.getenv("MAILING_CONCURRENCY_DEFERRAL_TOLERANCE", 0.1))  # Доля 4xx
+MAILING_DOMAIN_CONNECTIONS = int(os.getenv("MAILING_DOMAIN_CONNECTIONS", 0))  # Сессий на один домен, 0 - без предела
+MAILING_RCPT_PER_TRANSACTION = int(os.getenv("MAILING_RCPT_PER_TRANSACTION", 1))  # Получателей в одной транзакции
+MAILING_ATTEMPTS_FLUSH_SIZE = int(os.getenv("MAILING_ATTEMPTS_FLUSH_SIZE", 500))  # Попыток в одном bulk_create
+MAILING_ATTEMPTS_FLUSH_INTERVAL = float(os.getenv("MAILING_ATTEMPTS_FLUSH_INTERVAL", 2))  # Секунд между записями
+# Ограничение скорости отправки (писем в секунду, 0 - без ограничения), общее для всех процессов через кэш
+MAILING_RATE_PER_HOST = float(os.getenv("MAILING_RATE_PER_HOST", 0))  # На SMTP-хост EMAIL_HOST
+MAILING_BURST_PER_HOST = int(os.getenv("MAILING_BURST_PER_HOST", 50))  # Писем, которые можно отправить залпом
+MAILING_RATE_PER_OWNER = float(os.getenv("MAILING_RATE_PER_OWNER", 0))  # На владельца рассылок
+MAILING_BURST_PER_OWNER = int(os.getenv("MAILING_BURST_PER_OWNER", 50))
+MAILING_RATE_RESERVE = int(os.getenv("MAILING_RATE_RESERVE", 10))  # Токенов, забираемых из кэша за одно обращение
+MAILING_RATE_THROTTLE_PAUSE = float(os.getenv("MAILING_RATE_THROTTLE_PAUSE", 5))  # Пауза после ответа 421/451, с
+# Повторная отправка писем, не ушедших из-за временной ошибки (ответ 4xx, обрыв или таймаут соединения)
+MAILING_RETRY_MAX_ATTEMPTS = int(os.getenv("MAILING_RETRY_MAX_ATTEMPTS", 5))  # Попыток на получателя, включая первую
+MAILING_RETRY_BASE_DELAY = float(os.getenv("MAILING_RETRY_BASE_DELAY", 60))  # Пауза перед первым повтором, с
+MAILING_RETRY_MAX_DELAY = float(os.getenv("MAILING_RETRY_MAX_DELAY", 3600))  # Верхняя граница паузы, с
+MAILING_RETRY_LEASE = float(os.getenv("MAILING_RETRY_LEASE", 600))  # Срок захвата писем обработчиком повторов, с
+# Рассылку отправляет один процесс: он захватывает её на столько секунд и продлевает захват после каждой пачки
+MAILING_LEASE_TIMEOUT = float(os.getenv("MAILING_LEASE_TIMEOUT", 600))
+# Выключатель SMTP-сервера: после стольких неудачных подключений подряд отправка приостанавливается на COOLDOWN секунд
+MAILING_BREAKER_THRESHOLD = int(os.getenv("MAILING_BREAKER_THRESHOLD", 5))
+MAILING_BREAKER_COOLDOWN = float(os.getenv("MAILING_BREAKER_COOLDOWN", 60))
+# Планировщик отложенных рассылок (./manage.py run_scheduler)
+MAILING_SCHEDULER_REFRESH = float(os.getenv("MAILING_SCHEDULER_REFRESH", 1))  # Секунд между чтениями расписания
+MAILING_SCHEDULER_LOOKAHEAD = float(os.getenv("MAILING_SCHEDULER_LOOKAHEAD", 300))  # Окно расписания в памяти, с
+# Архив попыток отправки (./manage.py compact_attempts)
+MAILING_ATTEMPTS_RETENTION_DAYS = int(os.getenv("MAILING_ATTEMPTS_RETENTION_DAYS", 90))  # Дней в рабочей таблице
+MAILING_ARCHIVE_BATCH_SIZE = int(os.getenv("MAILING_ARCHIVE_BATCH_SIZE", 1000))  # Попыток в одной транзакции переноса
+
 # Создаём папки для логов, если их нет
 os.makedirs(os.path.join(BASE_DIR, "users/logs"), exist_ok=True)
 os.makedirs(os.path.join(BASE_DIR, "postpilot/logs"), exist_ok=True)
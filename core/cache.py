@@ -0,0 +1,127 @@
+"""
+Кэш результатов запросов к объектам владельцев (cache-aside).
+Результат запроса (список объектов или список pk) кэшируется по ключу из области (id владельца или "all" для
+запросов без фильтра по владельцу), модели и формы запроса (хэш SQL с параметрами), в который входят версии
+таблиц запроса в этой области: основной и присоединённых (select_related, фильтры по связям).
+Изменение объекта (post_save, post_delete, m2m_changed или явный вызов invalidate_owner после массовых операций)
+после фиксации транзакции увеличивает версию его модели у владельца и в области "all": прежние результаты,
+читавшие эту модель, больше не читаются и истекают сами через RESULT_TIMEOUT секунд, а результаты по другим
+моделям остаются в кэше.
+"""
+
+import hashlib
+import time
+
+from django.apps import apps
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+# Ключ версии модели в области (область, модель) и ключ результата (область, модель, хэш запроса и версий)
+VERSION_KEY = "core:results:{}:{}:version"
+RESULT_KEY = "core:results:{}:{}:{}"
+# Сколько секунд хранится результат
+RESULT_TIMEOUT = 15 * 60
+# Область запросов без фильтра по владельцу (менеджеры видят все объекты)
+ALL = "all"
+
+
+def get_versions(owner_id, labels: list) -> list:
+    """Текущие версии моделей labels в области владельца owner_id (None - область "all")."""
+    scope = owner_id if owner_id is not None else ALL
+    keys = [VERSION_KEY.format(scope, label) for label in labels]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # Начальная версия - текущее время: если ключ версии вытеснен из кэша, прежние результаты не оживут
+            cache.add(key, time.time_ns(), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def invalidate_owner(owner_id, *models):
+    """
+    Делает устаревшими закэшированные результаты владельца owner_id и области "all", читавшие модели models.
+    Версии увеличиваются после фиксации текущей транзакции, чтобы запрос, выполненный до фиксации, не закэшировал
+    старые данные под новой версией.
+    """
+    labels = [model._meta.label_lower for model in models]
+    transaction.on_commit(lambda: _bump(owner_id, labels))
+
+
+def _bump(owner_id, labels: list):
+    for scope in {owner_id, ALL}:
+        for label in labels:
+            key = VERSION_KEY.format(scope, label)
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.add(key, time.time_ns(), None)
+
+
+def _query_labels(queryset) -> list:
+    """Модели таблиц, которые читает запрос (после компиляции SQL в alias_map есть и присоединённые таблицы)."""
+    tables = {model._meta.db_table: model._meta.label_lower for model in apps.get_models(include_auto_created=True)}
+    labels = {tables[join.table_name] for join in queryset.query.alias_map.values() if join.table_name in tables}
+    return sorted(labels | {queryset.model._meta.label_lower})
+
+
+def result_key(queryset, owner_id=None, kind: str = "objects") -> str:
+    """Ключ результата запроса queryset в области владельца owner_id. kind - что кэшируется (pk или объекты)."""
+    sql, params = queryset.query.sql_with_params()
+    labels = _query_labels(queryset)
+    versions = get_versions(owner_id, labels)
+    shape = hashlib.md5(f"{kind}:{sql}:{params!r}:{list(zip(labels, versions))!r}".encode()).hexdigest()
+    scope = owner_id if owner_id is not None else ALL
+    return RESULT_KEY.format(scope, queryset.model._meta.label_lower, shape)
+
+
+def cached_pks(queryset, owner_id=None) -> list:
+    """Список pk объектов запроса queryset: из кэша или из БД (с сохранением в кэш)."""
+    key = result_key(queryset, owner_id, "pks")
+    pks = cache.get(key)
+    if pks is None:
+        pks = list(queryset.values_list("pk", flat=True))
+        cache.set(key, pks, RESULT_TIMEOUT)
+    return pks
+
+
+def cached_objects(queryset, owner_id=None) -> list:
+    """Список объектов запроса queryset (вместе с select_related): из кэша или из БД (с сохранением в кэш)."""
+    key = result_key(queryset, owner_id)
+    objects = cache.get(key)
+    if objects is None:
+        objects = list(queryset)
+        cache.set(key, objects, RESULT_TIMEOUT)
+    return objects
+
+
+def invalidate_instance(sender, instance, action: str = "post_save", model=None, **kwargs):
+    """
+    Обработчик post_save, post_delete и m2m_changed: делает устаревшими результаты владельца объекта, читавшие его
+    модель (для m2m_changed - и промежуточную таблицу, и модель другой стороны связи, для post_delete - и модели,
+    объекты которых удалены каскадно).
+    """
+    if action.startswith("pre_"):
+        return
+    models = {type(instance), sender} | ({model} if model is not None else set())
+    if kwargs.get("signal") is post_delete:
+        # Вместе с объектом каскадно удалены связанные объекты, в том числе без своих обработчиков
+        models.update(relation.related_model for relation in type(instance)._meta.related_objects)
+    # У объектов без поля владельца (пользователь) владелец - сам объект
+    invalidate_owner(getattr(instance, "owner_id", instance.pk), *models)
+
+
+def connect_invalidation(*models):
+    """
+    Подключает сброс кэша результатов при изменении объектов моделей models и их связей многие-ко-многим.
+    Для моделей, которые удаляются и создаются массово (попытки отправки), обработчики не подключаются: сигнал
+    post_delete отключает быстрое каскадное удаление, и кэш у них сбрасывается явно (invalidate_owner).
+    """
+    for model in models:
+        post_save.connect(invalidate_instance, sender=model, dispatch_uid=f"core.cache:save:{model._meta.label}")
+        post_delete.connect(invalidate_instance, sender=model, dispatch_uid=f"core.cache:delete:{model._meta.label}")
+        for field in model._meta.local_many_to_many:
+            m2m_changed.connect(
+                invalidate_instance, sender=field.remote_field.through, dispatch_uid=f"core.cache:m2m:{field}"
+            )
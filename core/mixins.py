@@ -1,6 +1,9 @@
 from django import forms
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
-from django.core.cache import cache
+from django.http import Http404
+
+from core.cache import cached_objects
+from users.roles import is_manager
 
 
 class StyledFormMixin:
@@ -38,12 +41,17 @@ class OwnerRequiredMixin(LoginRequiredMixin):
 
     def get_queryset(self):
         """Возвращает только объекты, принадлежащие текущему пользователю."""
-        query_set = cache.get("query_set")
+        return super().get_queryset().filter(**{self.owner_field: self.request.user})
+
+    def get_object(self, queryset=None):
+        """Возвращает объект текущего пользователя по pk из URL. Объект читается через кэш результатов."""
+        if queryset is not None or self.pk_url_kwarg not in self.kwargs:
+            return super().get_object(queryset)
 
-        if not query_set:
-            query_set = super().get_queryset()
-            cache.set("query_set", query_set, 60 * 15)  # 15 минут кэширования
-        return query_set.filter(**{self.owner_field: self.request.user})
+        objects = cached_objects(self.get_queryset().filter(pk=self.kwargs[self.pk_url_kwarg]), self.request.user.pk)
+        if not objects:
+            raise Http404("Объект не найден.")
+        return objects[0]
 
     def form_valid(self, form):
         """Дополнительная обработка перед сохранением формы. При создании объекта автоматически
@@ -66,8 +74,7 @@ class IsManagerOrOwnerListMixin(UserPassesTestMixin):
 
     def test_func(self):
         """Разрешает доступ менеджерам и владельцам."""
-        user = self.request.user
-        return user.groups.filter(name="Менеджеры").exists() or user.is_authenticated
+        return is_manager(self.request) or self.request.user.is_authenticated
 
     def get_queryset(self):
         """Ограничивает видимость объектов по владельцу."""
@@ -75,7 +82,15 @@ class IsManagerOrOwnerListMixin(UserPassesTestMixin):
 
         query_set = super().get_queryset()
 
-        if user.groups.filter(name="Менеджеры").exists():
+        if is_manager(self.request):
+            self.cache_owner_id = None  # Область кэша результатов "all"
             return query_set  # Менеджеры видят все
 
+        self.cache_owner_id = user.pk
         return query_set.filter(**{self.owner_field: user})  # Владельцы видят только свои
+
+    def get_context_data(self, *, object_list=None, **kwargs):
+        """Список объектов читается через кэш результатов."""
+        if object_list is None:
+            object_list = cached_objects(self.object_list, self.cache_owner_id)
+        return super().get_context_data(object_list=object_list, **kwargs)
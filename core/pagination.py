@@ -0,0 +1,81 @@
+"""
+Keyset-пагинация (по курсору) для списков.
+Страница - это page_size объектов, следующих в порядке сортировки за курсором: значением поля сортировки и pk
+последнего объекта предыдущей страницы. Запрос страницы - это условие "после курсора" и LIMIT по индексу
+(поле сортировки, pk), без OFFSET, поэтому любая страница стоит столько же, сколько первая.
+"""
+
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import F, Q
+from django.http import Http404
+
+
+class KeysetPaginationMixin:
+    """
+    Миксин keyset-пагинации для ListView. Объекты сортируются по убыванию keyset_field (пустые значения - первыми),
+    при равных значениях - по убыванию pk. Если keyset_field не задан, сортировка только по pk.
+    В контекст добавляются next_cursor (курсор следующей страницы или None) и is_first_page.
+    Ставится в списке базовых классов перед миксинами, которые фильтруют запрос.
+    """
+
+    keyset_field = None
+    page_size = 50
+    cursor_kwarg = "after"
+
+    def get_queryset(self):
+        """Возвращает запрос одной страницы: объекты после курсора, на один больше page_size (признак продолжения)."""
+        queryset = super().get_queryset()
+
+        if self.keyset_field:
+            queryset = queryset.order_by(F(self.keyset_field).desc(nulls_first=True), "-pk")
+        else:
+            queryset = queryset.order_by("-pk")
+
+        cursor = self.request.GET.get(self.cursor_kwarg)
+        if cursor:
+            queryset = queryset.filter(self.after_cursor(queryset.model, cursor))
+
+        return queryset[: self.page_size + 1]
+
+    def after_cursor(self, model, cursor: str) -> Q:
+        """Условие "после курсора" в порядке сортировки."""
+        try:
+            value, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            pk = model._meta.pk.to_python(pk)
+            if self.keyset_field:
+                value = model._meta.get_field(self.keyset_field).to_python(value)
+        except (ValueError, TypeError, ValidationError):
+            raise Http404("Неверный курсор страницы.")
+
+        if not self.keyset_field:
+            return Q(pk__lt=pk)
+
+        field = self.keyset_field
+        if value is None:
+            # Пустые значения идут первыми: после них - остальные пустые с меньшим pk и все непустые
+            return Q(**{f"{field}__isnull": True, "pk__lt": pk}) | Q(**{f"{field}__isnull": False})
+        # Избыточное условие field <= value - граница диапазона индекса (поле сортировки, pk): без него OR двух
+        # условий PostgreSQL проверяет фильтром, читая индекс с начала
+        return Q(**{f"{field}__lte": value}) & (Q(**{f"{field}__lt": value}) | Q(**{field: value, "pk__lt": pk}))
+
+    def make_cursor(self, obj) -> str:
+        """Курсор, указывающий на объект obj (следующая страница начнётся после него)."""
+        value = getattr(obj, self.keyset_field) if self.keyset_field else None
+        if hasattr(value, "isoformat"):
+            value = value.isoformat()  # С микросекундами: курсор должен совпадать со значением в БД точно
+        return base64.urlsafe_b64encode(json.dumps([value, obj.pk]).encode()).decode()
+
+    def get_context_data(self, **kwargs):
+        """Отрезает лишний объект страницы и добавляет в контекст курсор следующей страницы."""
+        context = super().get_context_data(**kwargs)
+
+        objects = list(context["object_list"])
+        page = objects[: self.page_size]
+        context["object_list"] = page
+        context[self.get_context_object_name(page)] = page
+        context["next_cursor"] = self.make_cursor(page[-1]) if len(objects) > self.page_size else None
+        context["is_first_page"] = not self.request.GET.get(self.cursor_kwarg)
+        return context
@@ -0,0 +1,67 @@
+"""
+Проверка количества запросов к БД в тестах.
+QueryBudget считает запросы в блоке кода и падает, если их больше заявленного бюджета. QueryBudgetMixin для
+TestCase добавляет проверки бюджета запроса страницы и постоянства числа запросов при росте данных (признак
+отсутствия N+1).
+"""
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryBudget(CaptureQueriesContext):
+    """
+    Контекстный менеджер: считает запросы к БД в блоке (count, captured_queries) и выбрасывает AssertionError
+    со списком запросов, если их больше budget.
+    """
+
+    def __init__(self, budget: int, using: str = DEFAULT_DB_ALIAS, label: str = "Блок"):
+        super().__init__(connections[using])
+        self.budget = budget
+        self.label = label
+
+    @property
+    def count(self) -> int:
+        return len(self)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        super().__exit__(exc_type, exc_value, traceback)
+        if exc_type is None and self.count > self.budget:
+            raise AssertionError(
+                f"{self.label}: {self.count} запросов к БД при бюджете {self.budget}:\n" + self.describe()
+            )
+
+    def describe(self) -> str:
+        """Пронумерованный список выполненных запросов."""
+        return "\n".join(f"{number}. {query['sql']}" for number, query in enumerate(self.captured_queries, 1))
+
+
+class QueryBudgetMixin:
+    """Проверки количества запросов для django.test.TestCase (нужен self.client)."""
+
+    def assertQueryBudget(self, budget: int, label: str = "Блок") -> QueryBudget:
+        """Контекстный менеджер: блок должен выполнить не больше budget запросов."""
+        return QueryBudget(budget, label=label)
+
+    def assertPageBudget(self, url: str, budget: int, status_code: int = 200, **params) -> QueryBudget:
+        """Запрашивает страницу url и проверяет код ответа и бюджет запросов. Возвращает счётчик запросов."""
+        with QueryBudget(budget, label=url) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status_code)
+        return queries
+
+    def assertConstantQueries(self, url: str, grow, **params):
+        """
+        Проверяет, что число запросов страницы url не растёт вместе с данными: запрашивает страницу, вызывает
+        grow() (добавляет данные) и запрашивает страницу снова.
+        """
+        with QueryBudget(float("inf"), label=url) as before:
+            self.client.get(url, params)
+        grow()
+        with QueryBudget(float("inf"), label=url) as after:
+            self.client.get(url, params)
+
+        if after.count != before.count:
+            raise AssertionError(
+                f"{url}: число запросов выросло с ростом данных: {before.count} -> {after.count}:\n" + after.describe()
+            )
@@ -1,6 +1,17 @@
 from django.contrib import admin
 
-from .models import SendAttempt, Mailing, Message, Recipient
+from core.cache import invalidate_owner
+
+from .models import (
+    Delivery,
+    SendAttempt,
+    SendAttemptArchive,
+    SendAttemptSummary,
+    Mailing,
+    MailingJob,
+    Message,
+    Recipient,
+)
 
 
 @admin.register(Recipient)
@@ -28,3 +39,42 @@ class SendAttempAdmin(admin.ModelAdmin):
     list_display = ("attempt_at", "status", "response", "mailing")
     list_filter = ("status", "attempt_at")
     search_fields = ("user__username", "mailing")
+
+    # Сигналы сброса кэша результатов у попыток не подключены (postpilot.apps) - сбрасываем его здесь
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        invalidate_owner(obj.owner_id, SendAttempt)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        invalidate_owner(obj.owner_id, SendAttempt)
+
+    def delete_queryset(self, request, queryset):
+        owner_ids = set(queryset.values_list("owner_id", flat=True))
+        super().delete_queryset(request, queryset)
+        for owner_id in owner_ids:
+            invalidate_owner(owner_id, SendAttempt)
+
+
+@admin.register(SendAttemptArchive)
+class SendAttemptArchiveAdmin(admin.ModelAdmin):
+    list_display = ("mailing", "month", "seq", "attempts", "first_attempt_at", "last_attempt_at", "owner")
+    list_filter = ("month",)
+    exclude = ("data",)
+
+
+@admin.register(SendAttemptSummary)
+class SendAttemptSummaryAdmin(admin.ModelAdmin):
+    list_display = ("mailing", "attempts", "successful", "failed", "first_attempt_at", "last_attempt_at", "owner")
+
+
+@admin.register(MailingJob)
+class MailingJobAdmin(admin.ModelAdmin):
+    list_display = ("mailing", "status", "created_at", "run_after", "started_at", "finished_at", "worker")
+    list_filter = ("status", "created_at")
+
+
+@admin.register(Delivery)
+class DeliveryAdmin(admin.ModelAdmin):
+    list_display = ("mailing", "recipient", "status", "attempts", "next_attempt_at", "updated_at")
+    list_filter = ("status",)
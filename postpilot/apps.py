@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class PostpilotConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "postpilot"
+
+    def ready(self):
+        """
+        Подключает сброс кэша результатов (core.cache) при изменении объектов приложения. Попытки отправки
+        записываются через postpilot.attempts и удаляются каскадно вместе с рассылкой - кэш у них сбрасывается явно.
+        """
+        from core.cache import connect_invalidation
+        from postpilot.models import Mailing, Message, Recipient
+
+        connect_invalidation(Recipient, Message, Mailing)
@@ -0,0 +1,165 @@
+"""
+Архив попыток отправки.
+Попытки старше срока хранения переносятся из рабочей таблицы send_attempts пачками по batch_size строк: попытки
+пачки сжимаются (JSON + zlib) в новые строки архива - части по рассылке и месяцу не больше batch_size попыток, -
+итоги рассылки увеличиваются в сводке, а перенесённые строки удаляются. Уже записанные части не перечитываются
+и не сжимаются заново, поэтому перенос линеен по числу попыток. Каждая пачка переносится в одной транзакции,
+поэтому прерванный перенос ничего не теряет и не дублирует. Рабочая таблица остаётся маленькой, история читается
+из архива (archived_attempts), а счётчики главной страницы учитывают сводку.
+"""
+
+import heapq
+import json
+import zlib
+from collections import defaultdict
+from datetime import date, datetime
+from itertools import groupby
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils.timezone import localtime
+
+from core.cache import invalidate_owner
+from postpilot.models import Mailing, SendAttempt, SendAttemptArchive, SendAttemptSummary
+
+# Поля попытки, которые хранятся в архиве
+ARCHIVE_FIELDS = ["id", "attempt_at", "status", "response", "recipient_id"]
+
+
+def pack(rows: list) -> bytes:
+    """Сжимает попытки rows (словари с полями ARCHIVE_FIELDS) для поля data архива."""
+    values = [[row[field] for field in ARCHIVE_FIELDS] for row in rows]
+    return zlib.compress(json.dumps(values, default=datetime.isoformat).encode())
+
+
+def unpack(data: bytes) -> list:
+    """Распаковывает попытки из поля data архива: словари с полями ARCHIVE_FIELDS."""
+    rows = [dict(zip(ARCHIVE_FIELDS, values)) for values in json.loads(zlib.decompress(data))]
+    for row in rows:
+        row["attempt_at"] = datetime.fromisoformat(row["attempt_at"])
+    return rows
+
+
+def archived_attempts(mailing: Mailing, month: date = None):
+    """
+    Архивные попытки рассылки (за месяц month или все) в порядке времени. Части одного месяца, перенесённые
+    параллельно, могут перекрываться по времени, поэтому попытки месяца сливаются из всех его частей.
+    """
+    archives = mailing.attempt_archives.order_by("month", "seq")
+    if month is not None:
+        archives = archives.filter(month=month.replace(day=1))
+
+    for _, chunks in groupby(archives.iterator(), key=lambda archive: archive.month):
+        parts = [unpack(chunk.data) for chunk in chunks]
+        yield from heapq.merge(*parts, key=lambda row: (row["attempt_at"], row["id"]))
+
+
+def archive_batch(cutoff: datetime, batch_size: int) -> int:
+    """
+    Переносит в архив одну пачку попыток (не больше batch_size), сделанных раньше cutoff: самые старые попытки,
+    которые не переносит другой процесс. Возвращает количество перенесённых попыток.
+    """
+    with transaction.atomic():
+        rows = list(
+            SendAttempt.objects.filter(attempt_at__lt=cutoff)
+            .order_by("attempt_at", "pk")
+            .select_for_update(skip_locked=True)
+            .values("mailing_id", "owner_id", *ARCHIVE_FIELDS)[:batch_size]
+        )
+        if not rows:
+            return 0
+
+        months = defaultdict(list)
+        mailings = defaultdict(list)
+        for row in rows:
+            month = localtime(row["attempt_at"]).date().replace(day=1)
+            months[(row["mailing_id"], month)].append(row)
+            mailings[(row["mailing_id"], row["owner_id"])].append(row)
+
+        _add_to_archives(months)
+        _add_to_summaries(mailings)
+
+        _delete_attempts([row["id"] for row in rows])
+        for owner_id in {row["owner_id"] for row in rows}:
+            invalidate_owner(owner_id, SendAttempt)
+
+    return len(rows)
+
+
+def _delete_attempts(pks: list):
+    """
+    Удаляет перенесённые попытки одним DELETE. QuerySet.delete() здесь не подходит: он читает удаляемые строки
+    и отправляет post_delete по каждой (сброс кэша владельца), а попытки ни на что не ссылаются извне - кэш
+    результатов владельцев archive_batch сбрасывает сам, один раз на пачку.
+    """
+    table = connection.ops.quote_name(SendAttempt._meta.db_table)
+    column = connection.ops.quote_name(SendAttempt._meta.pk.column)
+    placeholders = ", ".join(["%s"] * len(pks))
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {table} WHERE {column} IN ({placeholders})", pks)
+
+
+def _add_to_archives(months: dict):
+    """
+    Записывает попытки пачки новыми частями архива. months - попытки по (id рассылки, месяц) в порядке времени.
+    Номер части - id её первой попытки: попытка переносится один раз, поэтому параллельные переносы не конфликтуют
+    и не блокируют друг друга.
+    """
+    SendAttemptArchive.objects.bulk_create(
+        SendAttemptArchive(
+            mailing_id=mailing_id,
+            owner_id=group[0]["owner_id"],
+            month=month,
+            seq=min(row["id"] for row in group),
+            first_attempt_at=group[0]["attempt_at"],
+            last_attempt_at=group[-1]["attempt_at"],
+            attempts=len(group),
+            data=pack(group),
+        )
+        for (mailing_id, month), group in months.items()
+    )
+
+
+def _add_to_summaries(mailings: dict):
+    """Добавляет попытки к итогам рассылок. mailings - попытки по (id рассылки, id владельца) в порядке времени."""
+    # Строки итогов создаются заранее и блокируются, чтобы параллельные переносы не потеряли приращения
+    SendAttemptSummary.objects.bulk_create(
+        [SendAttemptSummary(mailing_id=mailing_id, owner_id=owner_id) for mailing_id, owner_id in mailings],
+        ignore_conflicts=True,
+    )
+    rows = {mailing_id: group for (mailing_id, _), group in mailings.items()}
+    summaries = list(SendAttemptSummary.objects.select_for_update().filter(mailing_id__in=rows))
+
+    for summary in summaries:
+        group = rows[summary.mailing_id]
+        successful = sum(row["status"] == "successfully" for row in group)
+        summary.attempts += len(group)
+        summary.successful += successful
+        summary.failed += len(group) - successful
+        summary.first_attempt_at = min(filter(None, [summary.first_attempt_at, group[0]["attempt_at"]]))
+        summary.last_attempt_at = max(filter(None, [summary.last_attempt_at, group[-1]["attempt_at"]]))
+
+    SendAttemptSummary.objects.bulk_update(
+        summaries, ["attempts", "successful", "failed", "first_attempt_at", "last_attempt_at"]
+    )
+
+
+def archive_attempts(cutoff: datetime, batch_size: int = None, max_batches: int = 0, report=None) -> int:
+    """
+    Переносит в архив попытки, сделанные раньше cutoff, пачками по batch_size (по умолчанию
+    MAILING_ARCHIVE_BATCH_SIZE). max_batches - предел количества пачек за вызов (0 - пока есть что переносить).
+    report - функция вывода сообщений о ходе переноса. Возвращает количество перенесённых попыток.
+    """
+    batch_size = batch_size or settings.MAILING_ARCHIVE_BATCH_SIZE
+    archived = batches = 0
+
+    while not max_batches or batches < max_batches:
+        count = archive_batch(cutoff, batch_size)
+        if not count:
+            break
+        archived += count
+        batches += 1
+        if report:
+            report(f"Пачка {batches}: в архив перенесено {count} попыток (всего {archived}).")
+
+    return archived
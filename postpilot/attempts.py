@@ -0,0 +1,62 @@
+"""
+Буферизованная запись попыток отправки.
+Вместо отдельного INSERT на каждое письмо попытки накапливаются в памяти и сохраняются одним bulk_create,
+когда буфер заполнен или с прошлой записи прошло заданное время.
+Обработчики сигналов сброса кэша результатов у попыток не подключены (postpilot.apps): попытки записываются
+только через этот модуль, который сбрасывает кэш сам.
+"""
+
+import time
+
+from django.conf import settings
+
+from core.cache import invalidate_owner
+from postpilot.models import SendAttempt
+
+
+class AttemptWriter:
+    """
+    Буфер попыток отправки. Используется как контекстный менеджер: при выходе из блока (в том числе по ошибке)
+    оставшиеся в буфере попытки сохраняются.
+    Дата попытки (attempt_at, auto_now_add) проставляется в момент записи буфера, поэтому может отставать
+    от фактического времени отправки не больше чем на flush_interval.
+    """
+
+    def __init__(self, flush_size: int = None, flush_interval: float = None):
+        self.flush_size = flush_size or settings.MAILING_ATTEMPTS_FLUSH_SIZE
+        self.flush_interval = (
+            flush_interval if flush_interval is not None else settings.MAILING_ATTEMPTS_FLUSH_INTERVAL
+        )
+        self.written = 0
+        self._buffer = []
+        self._flushed_at = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+    def add(self, **fields):
+        """Добавляет попытку в буфер. Буфер записывается в БД при достижении порога по размеру или времени."""
+        self._buffer.append(SendAttempt(**fields))
+
+        if len(self._buffer) >= self.flush_size or time.monotonic() - self._flushed_at >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Сохраняет все накопленные попытки одним запросом."""
+        if self._buffer:
+            SendAttempt.objects.bulk_create(self._buffer, batch_size=self.flush_size)
+            for owner_id in {attempt.owner_id for attempt in self._buffer}:
+                invalidate_owner(owner_id, SendAttempt)  # Один сброс на владельца пачки, а не на каждую попытку
+            self.written += len(self._buffer)
+            self._buffer = []
+        self._flushed_at = time.monotonic()
+
+
+def create_attempt(**fields) -> SendAttempt:
+    """Сохраняет одну попытку (например, запись об остановке рассылки) и сбрасывает кэш результатов владельца."""
+    attempt = SendAttempt.objects.create(**fields)
+    invalidate_owner(attempt.owner_id, SendAttempt)
+    return attempt
@@ -0,0 +1,110 @@
+"""
+Автоматический выключатель (circuit breaker) для SMTP-сервера.
+Состояние хранится в кэше Django и общее для всех процессов-обработчиков. После MAILING_BREAKER_THRESHOLD
+неудачных подряд попыток подключиться к серверу выключатель размыкается: в течение MAILING_BREAKER_COOLDOWN секунд
+отправка сразу завершается ошибкой RelayUnavailable, не дожидаясь таймаута подключения. Затем одному процессу
+разрешается пробное подключение: если оно удалось, выключатель замыкается, если нет - снова размыкается.
+"""
+
+import logging
+import smtplib
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+
+class RelayUnavailable(Exception):
+    """SMTP-сервер недоступен. retry_after - через сколько секунд имеет смысл попробовать снова."""
+
+    def __init__(self, message: str, retry_after: float):
+        # Оба аргумента передаются в Exception.args: исключение из процесса пула передаётся родителю через pickle
+        super().__init__(message, retry_after)
+        self.message = message
+        self.retry_after = retry_after
+
+    def __str__(self):
+        return self.message
+
+
+def is_connection_error(error: Exception) -> bool:
+    """
+    Ошибка ли это подключения к серверу (сеть, таймаут, сервер оборвал соединение). Ответы сервера
+    (например, неверный пароль) ошибками подключения не считаются - они не проходят сами собой.
+    """
+    if isinstance(error, smtplib.SMTPException):
+        return isinstance(error, (smtplib.SMTPConnectError, smtplib.SMTPServerDisconnected))
+    return isinstance(error, OSError)
+
+
+class CircuitBreaker:
+    """Выключатель для одного SMTP-сервера, состояние - в ключах кэша с префиксом key."""
+
+    def __init__(self, key: str, threshold: int, cooldown: float):
+        self.key = key
+        self.threshold = max(1, threshold)
+        self.cooldown = cooldown
+        self.failures_key = f"{key}:failures"
+        self.opened_key = f"{key}:opened_until"
+        self.probe_key = f"{key}:probe"
+
+    def check(self):
+        """Выбрасывает RelayUnavailable, если выключатель разомкнут и время ожидания ещё не истекло."""
+        opened_until = cache.get(self.opened_key)
+        if opened_until is not None and opened_until > time.time():
+            raise RelayUnavailable(
+                f"SMTP-сервер недоступен, отправка приостановлена на {opened_until - time.time():.0f} с.",
+                opened_until - time.time(),
+            )
+
+    @contextmanager
+    def guard(self):
+        """
+        Оборачивает подключение к серверу. Если выключатель разомкнут, подключение не выполняется. Ошибка
+        подключения учитывается и превращается в RelayUnavailable, успешное подключение замыкает выключатель.
+        """
+        self.check()
+        if cache.get(self.opened_key) is not None and not cache.add(self.probe_key, 1, self.cooldown):
+            raise RelayUnavailable("SMTP-сервер недоступен, выполняется пробное подключение.", self.cooldown)
+
+        try:
+            yield
+        except Exception as e:
+            if not is_connection_error(e):
+                cache.delete(self.probe_key)
+                raise
+            self.record_failure()
+            raise RelayUnavailable(f"SMTP-сервер недоступен: {e!r}", self.cooldown) from e
+
+        self.record_success()
+
+    def record_failure(self):
+        """Учитывает неудачное подключение. Размыкает выключатель, если неудач подряд набралось threshold."""
+        cache.add(self.failures_key, 0, None)
+        failures = cache.incr(self.failures_key)
+
+        if failures >= self.threshold:
+            cache.set(self.opened_key, time.time() + self.cooldown, None)
+            cache.delete(self.probe_key)
+            logger.warning(
+                f"SMTP-сервер недоступен ({failures} неудачных подключений подряд), "
+                f"отправка приостановлена на {self.cooldown:.0f} с."
+            )
+
+    def record_success(self):
+        """Учитывает успешное подключение: сбрасывает счётчик неудач и замыкает выключатель."""
+        if cache.get(self.failures_key) or cache.get(self.opened_key) is not None:
+            cache.delete_many([self.failures_key, self.opened_key, self.probe_key])
+            logger.info("SMTP-сервер снова доступен, отправка возобновлена.")
+
+
+def build_circuit_breaker() -> CircuitBreaker:
+    """Собирает выключатель для SMTP-сервера EMAIL_HOST по настройкам."""
+    return CircuitBreaker(
+        f"postpilot:breaker:{settings.EMAIL_HOST}",
+        settings.MAILING_BREAKER_THRESHOLD,
+        settings.MAILING_BREAKER_COOLDOWN,
+    )
@@ -0,0 +1,136 @@
+"""
+Адаптивное управление числом одновременных отправок (AIMD - additive increase, multiplicative decrease).
+Пока SMTP-сервер отвечает быстро и без временных отказов, предел одновременных транзакций растёт: до первой
+перегрузки - на единицу за каждую транзакцию (быстрый старт), затем - на единицу за каждое "окно" отправок.
+Если доля временных отказов (4xx, таймауты) превысила MAILING_CONCURRENCY_DEFERRAL_TOLERANCE или время ответа
+превысило базовое (наименьшее сглаженное) в MAILING_CONCURRENCY_LATENCY_TOLERANCE раз, предел умножается
+на MAILING_CONCURRENCY_DECREASE. Единичные отказы, не связанные с нагрузкой, предел не снижают.
+Текущие значения публикуются в кэш (ключ metrics_key).
+"""
+
+import asyncio
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# Вес последнего замера в скользящих средних времени ответа и доли временных отказов
+LATENCY_SMOOTHING = 0.2
+DEFERRAL_SMOOTHING = 0.02
+# Насколько подрастает базовое время ответа за транзакцию, если предел уже минимальный, а сервер всё равно
+# отвечает медленно: значит, сервер стал медленнее для всех, и базовое время должно за ним последовать
+BASELINE_DRIFT = 0.01
+# Сколько секунд хранятся метрики в кэше после последней публикации
+METRICS_TIMEOUT = 3600
+
+
+class AIMDController:
+    """
+    Предел числа одновременных транзакций от minimum до maximum. Перед транзакцией нужно получить место
+    (acquire), после - вернуть его с результатом (release).
+    """
+
+    def __init__(self, minimum: int, maximum: int, metrics_key: str = None):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.metrics_key = metrics_key
+        self.in_flight = 0
+        self.latency = None  # Скользящее среднее времени ответа, с
+        self.baseline = None  # Наименьшее сглаженное время ответа, с
+        self.deferral_rate = 0.0  # Сглаженная доля временных отказов
+        self.increases = 0
+        self.decreases = 0
+        self._decreased_at = 0.0
+        self._changed = None
+        self.limit = float(self.minimum)
+
+    async def acquire(self) -> float:
+        """Ждёт свободного места под транзакцию. Возвращает момент получения места (передаётся в release)."""
+        if self._changed is None:
+            self._changed = asyncio.Condition()
+
+        async with self._changed:
+            await self._changed.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        return time.monotonic()
+
+    async def release(self, acquired_at: float, latency: float = None, deferred: bool = False):
+        """
+        Возвращает место и учитывает результат транзакции: latency - время ответа сервера (None - транзакция
+        не выполнялась), deferred - сервер временно отказал или соединение оборвалось.
+        """
+        async with self._changed:
+            self.in_flight -= 1
+            if latency is not None:
+                self._observe(acquired_at, latency, deferred)
+            self._changed.notify_all()
+
+    def snapshot(self) -> dict:
+        """Текущие значения для метрик."""
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "minimum": self.minimum,
+            "maximum": self.maximum,
+            "latency_ms": round(self.latency * 1000, 2) if self.latency is not None else None,
+            "baseline_ms": round(self.baseline * 1000, 2) if self.baseline is not None else None,
+            "deferral_rate": round(self.deferral_rate, 3),
+            "increases": self.increases,
+            "decreases": self.decreases,
+        }
+
+    def publish(self):
+        """Сохраняет метрики в кэш."""
+        if self.metrics_key:
+            cache.set(self.metrics_key, self.snapshot(), METRICS_TIMEOUT)
+
+    def _observe(self, acquired_at: float, latency: float, deferred: bool):
+        self.latency = _smooth(self.latency, latency, LATENCY_SMOOTHING)
+        self.deferral_rate = _smooth(self.deferral_rate, 1.0 if deferred else 0.0, DEFERRAL_SMOOTHING)
+        if self.baseline is None or self.latency < self.baseline:
+            self.baseline = self.latency
+        elif self.limit <= self.minimum:
+            self.baseline *= 1 + BASELINE_DRIFT
+
+        congested = (
+            self.deferral_rate > settings.MAILING_CONCURRENCY_DEFERRAL_TOLERANCE
+            or self.latency > self.baseline * settings.MAILING_CONCURRENCY_LATENCY_TOLERANCE
+        )
+
+        if not congested:
+            if self.limit < self.maximum:
+                step = 1 if not self.decreases else 1 / self.limit
+                self.limit = min(self.maximum, self.limit + step)
+                self.increases += 1
+            return
+
+        # На перегрузку реагируем один раз: транзакции, начатые до последнего снижения, предел больше не снижают
+        if acquired_at <= self._decreased_at:
+            return
+        self.limit = max(self.minimum, self.limit * settings.MAILING_CONCURRENCY_DECREASE)
+        self.decreases += 1
+        self._decreased_at = time.monotonic()
+        logger.info(f"Сервер перегружен, предел одновременных отправок снижен до {self.limit:.1f}.")
+
+
+def _smooth(average: float | None, value: float, weight: float) -> float:
+    """Экспоненциальное скользящее среднее."""
+    return value if average is None else weight * value + (1 - weight) * average
+
+
+def build_concurrency_controller() -> AIMDController | None:
+    """
+    Собирает регулятор для движка async по настройкам. Если MAILING_CONCURRENCY_ADAPTIVE выключен, возвращает
+    None - тогда работают все MAILING_ASYNC_CONNECTIONS сессий пула.
+    """
+    if not settings.MAILING_CONCURRENCY_ADAPTIVE:
+        return None
+
+    return AIMDController(
+        settings.MAILING_CONCURRENCY_MIN,
+        settings.MAILING_ASYNC_CONNECTIONS,
+        metrics_key=f"postpilot:concurrency:{settings.EMAIL_HOST}",
+    )
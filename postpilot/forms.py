@@ -99,11 +99,15 @@ class MailingForm(StyledFormMixin, forms.ModelForm):
         fields = "__all__"
         labels = {
             "first_sent_at": "Дата и время первой отправки",
+            "scheduled_at": "Запланировать отправку на",
             "sent_completed_at": "Дата и время окончания отправки",
             "status": "Статус",
             "message": "Сообщение",
             "recipients": "Получатели",
         }
+        widgets = {
+            "scheduled_at": forms.DateTimeInput(attrs={"type": "datetime-local"}, format="%Y-%m-%dT%H:%M"),
+        }
 
     def clean_dates(self):
         cleaned_data = super().clean()
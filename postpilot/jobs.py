@@ -0,0 +1,316 @@
+"""
+Очередь заданий на отправку рассылок, хранящаяся в БД.
+View только ставит задание в очередь, а отправку выполняют отдельные процессы-обработчики
+(./manage.py run_mailing_worker). Несколько обработчиков могут разбирать очередь одновременно:
+задание захватывается через SELECT ... FOR UPDATE SKIP LOCKED, поэтому одно задание достаётся ровно одному из них.
+На PostgreSQL обработчики ждут новых заданий через LISTEN/NOTIFY и берут их сразу после постановки в очередь,
+на остальных СУБД - опрашивают очередь с заданным интервалом.
+Задание обработчика, убитого посреди отправки (SIGKILL, OOM), возвращается в очередь, когда истекает захват его
+рассылки (postpilot.leases): живой обработчик продлевает захват после каждой пачки писем.
+"""
+
+import logging
+import os
+import select
+import signal
+import smtplib
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail.backends.smtp import EmailBackend as SMTPEmailBackend
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Q
+from django.db.utils import Error as DatabaseError
+from django.utils.timezone import now
+
+from postpilot.breaker import RelayUnavailable
+from postpilot.leases import MailingBusy
+from postpilot.models import Mailing, MailingJob
+from postpilot.services import (
+    DeliveryCancelled,
+    DeliveryInterrupted,
+    retry_deliveries,
+    send_mailing,
+    shutdown_requested,
+)
+
+logger = logging.getLogger(__name__)
+
+# Канал PostgreSQL, в который приходят уведомления о новых заданиях
+NOTIFY_CHANNEL = "postpilot_mailing_jobs"
+# Статусы незавершённого задания: у рассылки не больше одного такого задания (ограничение mailing_jobs_one_active)
+ACTIVE_STATUSES = ("queued", "running")
+
+
+def enqueue_mailing(mailing: Mailing) -> MailingJob:
+    """
+    Ставит рассылку в очередь на отправку. Если по рассылке уже есть незавершённое задание,
+    новое не создаётся - возвращается существующее. Задание пропавшего обработчика сначала возвращается в очередь.
+    """
+    requeue_stale_jobs(mailing)
+
+    while True:
+        job = MailingJob.objects.filter(mailing=mailing, status__in=ACTIVE_STATUSES).first()
+        if job is not None:
+            logger.info(f"Рассылка {mailing.id} уже в очереди (задание {job.id}).")
+            return job
+
+        try:
+            with transaction.atomic():
+                job = MailingJob.objects.create(mailing=mailing)
+        except IntegrityError:
+            continue  # Задание только что создал параллельный запрос - возвращаем его
+        break
+
+    notify_workers()
+    logger.info(f"Рассылка {mailing.id} поставлена в очередь (задание {job.id}).")
+    return job
+
+
+def notify_workers():
+    """
+    Будит обработчики, ждущие новых заданий (NOTIFY). Уведомление доставляется после фиксации транзакции.
+    На СУБД, отличных от PostgreSQL, ничего не делает - обработчики увидят задание при следующем опросе.
+    """
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_notify(%s, '')", [NOTIFY_CHANNEL])
+
+
+def requeue_stale_jobs(mailing: Mailing = None) -> int:
+    """
+    Возвращает в очередь выполняемые задания пропавших обработчиков (всех или только рассылки mailing): задание
+    выполняется дольше MAILING_LEASE_TIMEOUT секунд, а захват его рассылки истёк (или так и не был взят).
+    Возвращает количество возвращённых заданий.
+    """
+    current = now()
+    stale = MailingJob.objects.filter(
+        status="running", started_at__lt=current - timedelta(seconds=settings.MAILING_LEASE_TIMEOUT)
+    ).exclude(mailing__lease_until__gte=current)
+    if mailing is not None:
+        stale = stale.filter(mailing=mailing)
+
+    count = stale.update(status="queued", started_at=None, worker="", error="Обработчик задания пропал.")
+    if count:
+        logger.warning(f"Возвращено в очередь заданий пропавших обработчиков: {count}.")
+    return count
+
+
+def claim_job(worker: str) -> MailingJob | None:
+    """
+    Захватывает самое старое задание из очереди и помечает его как выполняемое. Отложенные задания (run_after
+    в будущем) пропускаются.
+    Строки, заблокированные другими обработчиками, пропускаются (SKIP LOCKED), поэтому обработчики не ждут
+    друг друга. Возвращает None, если очередь пуста.
+    """
+    with transaction.atomic():
+        job = (
+            MailingJob.objects.select_for_update(skip_locked=True, of=("self",))
+            .filter(Q(run_after__isnull=True) | Q(run_after__lte=now()), status="queued")
+            .order_by("created_at", "pk")
+            .first()
+        )
+        if job is None:
+            return None
+
+        job.status = "running"
+        job.started_at = now()
+        job.worker = worker
+        job.save(update_fields=["status", "started_at", "worker"])
+
+    return job
+
+
+def run_job(job: MailingJob, smtp_connection=None):
+    """
+    Выполняет задание: отправляет рассылку и фиксирует результат выполнения задания.
+    smtp_connection - необязательное открытое соединение бэкенда почты, через которое отправлять письма.
+    Если отправку прервала остановка процесса, задание возвращается в очередь. Если SMTP-сервер недоступен,
+    задание возвращается в очередь и откладывается до момента, когда имеет смысл попробовать снова.
+    Если рассылку уже отправляет другой процесс (MailingBusy), задание завершается: рассылку допишет тот процесс.
+    Если пользователь остановил рассылку, пока задание ждало в очереди (в том числе вернувшись в неё после
+    прерывания), задание завершается без отправки.
+    """
+    try:
+        send_mailing(job.mailing, connection=smtp_connection, holder=job.worker)
+        job.status = "done"
+        job.error = ""  # Ошибка прошлого запуска (отложенного или прерванного) больше не актуальна
+
+    except (MailingBusy, DeliveryCancelled) as e:
+        logger.info(f"Задание {job.id}: {e}")
+        job.status = "done"
+        job.error = str(e)
+
+    except DeliveryInterrupted:
+        job.status = "queued"
+        job.started_at = None
+        job.worker = ""
+        job.save(update_fields=["status", "started_at", "worker"])
+        logger.info(f"Задание {job.id} возвращено в очередь.")
+        return
+
+    except RelayUnavailable as e:
+        job.status = "queued"
+        job.started_at = None
+        job.worker = ""
+        job.run_after = now() + timedelta(seconds=e.retry_after)
+        job.error = str(e)
+        job.save(update_fields=["status", "started_at", "worker", "run_after", "error"])
+        logger.warning(f"Задание {job.id} отложено до {job.run_after}: {e}")
+        return
+
+    except Exception as e:
+        logger.exception(f"Ошибка при выполнении задания {job.id}: {e}")
+        job.status = "failed"
+        job.error = str(e)
+
+    job.finished_at = now()
+    job.save(update_fields=["status", "finished_at", "error"])
+
+
+class JobListener:
+    """
+    Ожидание новых заданий. На PostgreSQL соединение с БД подписывается на канал NOTIFY_CHANNEL (LISTEN), и
+    ожидание заканчивается, как только приходит уведомление; на остальных СУБД это просто пауза.
+    Ожидание также прерывает wakeup() - его можно вызывать из обработчика сигнала.
+    """
+
+    def __init__(self):
+        self._listening = None
+        self._wakeup_read, self._wakeup_write = os.pipe()
+        os.set_blocking(self._wakeup_write, False)
+
+    def wait(self, timeout: float) -> bool:
+        """Ждёт уведомления не дольше timeout секунд. Возвращает True, если ожидание прервано уведомлением."""
+        sources = [self._wakeup_read]
+        raw_connection = self._listen()
+        if raw_connection is not None:
+            sources.append(raw_connection)
+
+        ready, _, _ = select.select(sources, [], [], timeout)
+
+        if self._wakeup_read in ready:
+            os.read(self._wakeup_read, 1024)
+        if raw_connection is not None and raw_connection in ready:
+            with connection.wrap_database_errors:
+                raw_connection.poll()
+            raw_connection.notifies.clear()
+        return bool(ready)
+
+    def wakeup(self):
+        """Прерывает текущее ожидание."""
+        try:
+            os.write(self._wakeup_write, b"\0")
+        except BlockingIOError:
+            pass  # Канал уже содержит непрочитанный сигнал пробуждения
+
+    def close(self):
+        os.close(self._wakeup_read)
+        os.close(self._wakeup_write)
+
+    def _listen(self):
+        """Подписывается на канал уведомлений. Если соединение с БД было переоткрыто, подписка повторяется."""
+        if connection.vendor != "postgresql":
+            return None
+
+        connection.ensure_connection()
+        raw_connection = connection.connection
+        if raw_connection is not self._listening:
+            with connection.cursor() as cursor:
+                cursor.execute(f"LISTEN {NOTIFY_CHANNEL}")
+            self._listening = raw_connection
+        return raw_connection
+
+
+class JobWorker:
+    """
+    Цикл обработчика очереди: захватывает и выполняет задания, а когда очередь пуста - повторяет отложенные
+    письма и ждёт новых заданий (JobListener). По SIGTERM/SIGINT обработчик дописывает текущую пачку писем,
+    возвращает задание в очередь и завершается.
+    smtp_connection - необязательное соединение бэкенда почты, которое держится открытым между заданиями.
+    report - необязательная функция для вывода сообщений о ходе работы.
+    """
+
+    def __init__(self, name: str, poll_interval: float, retries: bool = True, smtp_connection=None, report=None):
+        self.name = name
+        self.poll_interval = poll_interval
+        self.retries = retries
+        self.smtp_connection = smtp_connection
+        self.report = report or logger.info
+        self.listener = JobListener()
+
+    def run(self, once: bool = False):
+        """Обрабатывает очередь, пока не будет запрошена остановка (или, если once, пока очередь не опустеет)."""
+        shutdown_requested.clear()
+        handlers = {signum: signal.signal(signum, self._on_signal) for signum in (signal.SIGTERM, signal.SIGINT)}
+
+        try:
+            while not shutdown_requested.is_set():
+                try:
+                    worked = self._step()
+                except DeliveryInterrupted:
+                    break
+                except RelayUnavailable as e:
+                    # Повторы отложенных писем ждут, пока SMTP-сервер снова станет доступен
+                    logger.warning(f"Обработчик {self.name}: {e}")
+                    worked = False
+                except DatabaseError as e:
+                    # Соединение с БД потеряно - закрываем его, при следующем запросе Django откроет новое
+                    logger.exception(f"Ошибка БД в обработчике {self.name}: {e}")
+                    connection.close()
+                    worked = False
+
+                if worked:
+                    continue
+                if once:
+                    break
+                self.listener.wait(self.poll_interval)
+
+        finally:
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+            self.listener.close()
+
+    def _step(self) -> bool:
+        """Выполняет одно задание или одну порцию повторов. Возвращает False, если работы не было."""
+        job = claim_job(self.name)
+
+        if job is None:
+            if requeue_stale_jobs():
+                return True
+            if not self.retries:
+                return False
+            self._keep_alive()
+            retried = retry_deliveries(connection=self.smtp_connection)
+            if retried["sent"] or retried["failed"]:
+                self.report(f"Повторная отправка: успешно {retried['sent']}, ошибок {retried['failed']}.")
+                return True
+            return False
+
+        self.report(f"Задание {job.id}: отправка рассылки {job.mailing_id}.")
+        self._keep_alive()
+        run_job(job, self.smtp_connection)
+        self.report(f"Задание {job.id} завершено со статусом '{job.status}'.")
+        if job.status == "queued":
+            raise DeliveryInterrupted(f"Задание {job.id} прервано остановкой обработчика.")
+        return True
+
+    def _keep_alive(self):
+        """
+        Проверяет, что удерживаемое SMTP-соединение живо (NOOP). Если сервер его закрыл, соединение закрывается -
+        отправка откроет его заново (через выключатель SMTP-сервера).
+        """
+        if not isinstance(self.smtp_connection, SMTPEmailBackend) or self.smtp_connection.connection is None:
+            return
+        try:
+            alive = self.smtp_connection.connection.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            alive = False
+        if not alive:
+            self.smtp_connection.close()
+
+    def _on_signal(self, signum, frame):
+        """Обработчик SIGTERM/SIGINT: отправка прервётся после текущей пачки, ожидание - сразу."""
+        logger.info(f"Обработчик {self.name} получил сигнал {signum}, завершение работы.")
+        shutdown_requested.set()
+        self.listener.wakeup()
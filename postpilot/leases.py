@@ -0,0 +1,78 @@
+"""
+Захват рассылки процессом отправки.
+Рассылку одновременно отправляет только один процесс: перед отправкой он захватывает её условным UPDATE (в
+claimed_by записывается имя процесса, в lease_until - срок захвата) и продлевает срок после пачек писем. Другие
+процессы (обработчик очереди, демон, ./manage.py send_mailing по cron) не берут рассылку, пока срок не истёк, поэтому
+работающая рассылка отличается от рассылки упавшего процесса: её продолжит первый процесс, запущенный после истечения
+срока MAILING_LEASE_TIMEOUT.
+"""
+
+import os
+import socket
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.timezone import now
+
+from postpilot.models import Mailing
+
+
+class MailingBusy(Exception):
+    """Рассылку отправляет другой процесс."""
+
+
+def runner_name() -> str:
+    """Имя текущего процесса отправки: хост и pid."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class MailingLease:
+    """
+    Захват рассылки mailing_id процессом holder (по умолчанию - текущим процессом). Процессы пула, отправляющие
+    части рассылки, захваченной родителем, только продлевают захват с именем родителя.
+    """
+
+    def __init__(self, mailing_id: int, holder: str = None, timeout: float = None):
+        self.mailing_id = mailing_id
+        self.holder = holder or runner_name()
+        self.timeout = timeout if timeout is not None else settings.MAILING_LEASE_TIMEOUT
+        self.renewed_at = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def acquire(self):
+        """Захватывает рассылку, если она свободна, захвачена этим же процессом или срок захвата истёк."""
+        current = now()
+        claimed = Mailing.objects.filter(
+            Q(claimed_by="") | Q(claimed_by=self.holder) | Q(lease_until__lt=current), pk=self.mailing_id
+        ).update(claimed_by=self.holder, lease_until=current + timedelta(seconds=self.timeout))
+        if not claimed:
+            raise MailingBusy(f"Рассылку {self.mailing_id} отправляет другой процесс.")
+        self.renewed_at = time.monotonic()
+
+    def renew(self):
+        """
+        Продлевает срок захвата (в БД - не чаще раза в четверть срока). Если рассылку перехватил другой процесс
+        (срок истёк, пока этот процесс стоял), выбрасывает MailingBusy - отправку нужно прекратить.
+        """
+        if self.renewed_at is not None and time.monotonic() - self.renewed_at < self.timeout / 4:
+            return
+
+        renewed = Mailing.objects.filter(pk=self.mailing_id, claimed_by=self.holder).update(
+            lease_until=now() + timedelta(seconds=self.timeout)
+        )
+        if not renewed:
+            raise MailingBusy(f"Рассылку {self.mailing_id} перехватил другой процесс.")
+        self.renewed_at = time.monotonic()
+
+    def release(self):
+        """Отпускает рассылку, если она всё ещё захвачена этим процессом."""
+        Mailing.objects.filter(pk=self.mailing_id, claimed_by=self.holder).update(claimed_by="", lease_until=None)
+        self.renewed_at = None
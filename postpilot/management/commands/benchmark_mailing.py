@@ -0,0 +1,165 @@
+import resource
+import time
+import uuid
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+
+from postpilot.models import Mailing, Message, Recipient
+from postpilot.services import send_mailing
+from postpilot.smtp_sink import SMTPSink
+from users.models import CustomUser
+
+BENCHMARK_USER_EMAIL = "benchmark@postpilot.local"
+
+
+class QueryCounter:
+    """Обёртка выполнения запросов к БД, подсчитывающая их количество."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def percentile(values: list, percent: float) -> float:
+    """Возвращает перцентиль percent (0-100) отсортированного списка values."""
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, round(percent / 100 * len(values)) - 1))
+    return values[index]
+
+
+class Command(BaseCommand):
+    """
+    Кастомная команда замера скорости отправки рассылки.
+    """
+
+    help = "Замер скорости отправки рассылки через локальный SMTP-сервер-заглушку"
+
+    def add_arguments(self, parser):
+        """Добавляет аргументы команды.
+        Пример использования: ./manage.py benchmark_mailing --recipients 10000 --latency 5 --engine async"""
+
+        parser.add_argument("--recipients", type=int, default=1000, help="Количество получателей")
+        parser.add_argument("--latency", type=float, default=0.0, help="Задержка ответа заглушки на письмо, мс")
+        parser.add_argument("--failure-rate", type=float, default=0.0, help="Доля отклоняемых писем (0-1)")
+        parser.add_argument("--engine", choices=["sync", "async"], default="sync", help="Движок отправки")
+        parser.add_argument("--connections", type=int, default=10, help="SMTP-сессий для движка async")
+        parser.add_argument(
+            "--fixed-concurrency", action="store_true", help="Не подбирать число одновременных отправок (AIMD)"
+        )
+        parser.add_argument(
+            "--capacity", type=int, default=0, help="Писем, которые заглушка обрабатывает одновременно (0 - все)"
+        )
+        parser.add_argument("--batch-size", type=int, default=100, help="Писем в одной пачке")
+        parser.add_argument("--domains", type=int, default=1, help="На сколько доменов распределить получателей")
+        parser.add_argument(
+            "--rcpt-per-transaction", type=int, default=1, help="Получателей в одной SMTP-транзакции (движок async)"
+        )
+        parser.add_argument("--keep", action="store_true", help="Не удалять созданные для замера данные")
+
+    def handle(self, *args, **options):
+        """Обработчик команды."""
+        mailing = self._seed(options["recipients"], options["domains"])
+        self.stdout.write(f"Создана рассылка {mailing.id} на {options['recipients']} получателей.")
+
+        latencies = []
+        queries = QueryCounter()
+
+        concurrency = None
+        sink = SMTPSink(
+            latency=options["latency"] / 1000,
+            failure_rate=options["failure_rate"],
+            seed=0,
+            capacity=options["capacity"],
+        )
+        with sink:
+            with override_settings(
+                EMAIL_BACKEND="django.core.mail.backends.smtp.EmailBackend",
+                EMAIL_HOST=sink.host,
+                EMAIL_PORT=sink.port,
+                EMAIL_USE_TLS=False,
+                EMAIL_USE_SSL=False,
+                EMAIL_HOST_USER="",
+                EMAIL_HOST_PASSWORD="",
+                DEFAULT_FROM_EMAIL=BENCHMARK_USER_EMAIL,
+                MAILING_ENGINE=options["engine"],
+                MAILING_ASYNC_CONNECTIONS=options["connections"],
+                MAILING_CONCURRENCY_ADAPTIVE=not options["fixed_concurrency"],
+                MAILING_BATCH_SIZE=options["batch_size"],
+                MAILING_RCPT_PER_TRANSACTION=options["rcpt_per_transaction"],
+            ):
+                started_at = time.perf_counter()
+                with connection.execute_wrapper(queries):
+                    counters = send_mailing(mailing, latencies=latencies)
+                elapsed = time.perf_counter() - started_at
+                concurrency = cache.get(f"postpilot:concurrency:{sink.host}")
+
+        latencies.sort()
+        total = counters["sent"] + counters["failed"]
+        peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # В Linux ru_maxrss в КБ
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Движок: {options['engine']}. Писем: {total} (успешно {counters['sent']}, "
+                f"ошибок {counters['failed']}) за {elapsed:.2f} с.\n"
+                f"Скорость: {total / elapsed if elapsed > 0 else 0:.1f} писем/с.\n"
+                f"Время отправки письма: p50 {percentile(latencies, 50) * 1000:.2f} мс, "
+                f"p99 {percentile(latencies, 99) * 1000:.2f} мс.\n"
+                f"Запросов к БД: {queries.count} ({queries.count / total if total else 0:.2f} на письмо).\n"
+                f"Пиковый RSS: {peak_rss_mb:.1f} МБ. SMTP-сессий открыто: {sink.sessions}, "
+                f"транзакций: {sink.transactions}."
+            )
+        )
+        if options["engine"] == "async" and concurrency:
+            self.stdout.write(
+                f"Одновременных отправок: {concurrency['limit']} (от {concurrency['minimum']} до "
+                f"{concurrency['maximum']}), снижений {concurrency['decreases']}, "
+                f"время ответа {concurrency['latency_ms']} мс (среднее {concurrency['baseline_ms']} мс)."
+            )
+
+        if not options["keep"]:
+            self._cleanup(mailing)
+
+    def _seed(self, count: int, domains: int = 1) -> Mailing:
+        """
+        Создаёт сообщение, count получателей (адреса равномерно распределены по domains доменам) и рассылку на них
+        от служебного пользователя замеров.
+        """
+        owner, _ = CustomUser.objects.get_or_create(
+            email=BENCHMARK_USER_EMAIL, defaults={"username": "benchmark", "is_active": False}
+        )
+        run_id = uuid.uuid4().hex[:8]
+
+        message = Message.objects.create(
+            subject=f"Benchmark {run_id}",
+            body_text="Тестовое письмо для замера скорости отправки.\n" * 20,
+            owner=owner,
+        )
+        recipients = Recipient.objects.bulk_create(
+            [
+                Recipient(email=f"bench-{run_id}-{i}@d{i % max(1, domains)}.example.com", owner=owner)
+                for i in range(count)
+            ],
+            batch_size=5000,
+        )
+        mailing = Mailing.objects.create(message=message, owner=owner)
+        Mailing.recipients.through.objects.bulk_create(
+            [Mailing.recipients.through(mailing_id=mailing.id, recipient_id=r.pk) for r in recipients],
+            batch_size=5000,
+        )
+        return Mailing.objects.select_related("message").get(pk=mailing.pk)
+
+    def _cleanup(self, mailing: Mailing):
+        """Удаляет данные, созданные для замера."""
+        recipient_ids = list(mailing.recipients.values_list("pk", flat=True))
+        message = mailing.message
+        mailing.delete()
+        message.delete()
+        Recipient.objects.filter(pk__in=recipient_ids).delete()
+        self.stdout.write("Данные замера удалены.")
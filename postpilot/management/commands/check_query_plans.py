@@ -0,0 +1,172 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import QuerySet
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.views.generic.list import MultipleObjectMixin
+
+from core.pagination import KeysetPaginationMixin
+from postpilot.models import Mailing, Message, Recipient, SendAttempt
+from postpilot.stats import dashboard_stats, welcome_stats
+from postpilot.views import HomeView, MailingListView, MessageListView, RecipientListView, SendAttemptListView
+from users.models import CustomUser
+from users.roles import MANAGERS_GROUP
+
+# Кэш отключён: проверяются запросы к БД, а не чтение из кэша
+NO_CACHE = {"default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}}
+
+# Узел плана PostgreSQL с последовательным чтением таблицы
+SEQ_SCAN = re.compile(r"Seq Scan on (\w+)")
+# Условие индекса в плане PostgreSQL, ограничивающее столбец сверху (условие курсора страницы)
+INDEX_COND = r"Index Cond: .*\b{}\b <=? "
+
+
+class Command(BaseCommand):
+    """
+    Кастомная команда проверки планов запросов.
+    """
+
+    help = (
+        "Проверка планов запросов счётчиков, главной страницы и списков (EXPLAIN): таблицы должны читаться по индексам"
+    )
+
+    def add_arguments(self, parser):
+        """Добавляет аргументы команды.
+        Пример использования: ./manage.py check_query_plans --owner 3
+        Полные планы запросов: ./manage.py check_query_plans -v 2"""
+
+        parser.add_argument(
+            "--owner", type=int, help="ID владельца, запросы которого проверять (по умолчанию - первый)"
+        )
+        parser.add_argument(
+            "--allow-seqscan",
+            action="store_true",
+            help="Не запрещать PostgreSQL последовательное чтение (план как на текущем объёме данных)",
+        )
+
+    def handle(self, *args, **options):
+        """Обработчик команды."""
+        if connection.vendor != "postgresql":
+            raise CommandError(f"Проверка планов поддерживается только для PostgreSQL, а не {connection.vendor}.")
+
+        owners = CustomUser.objects.order_by("pk")
+        owner = owners.filter(pk=options["owner"]).first() if options["owner"] else owners.first()
+        if owner is None:
+            raise CommandError("Нет пользователя, запросы которого можно проверить.")
+
+        tables = {model._meta.db_table for model in (Mailing, Message, Recipient, SendAttempt)}
+        failures = 0
+
+        with transaction.atomic(), override_settings(CACHES=NO_CACHE):
+            if not options["allow_seqscan"]:
+                # На маленьких таблицах последовательное чтение дешевле индекса, и планировщик выбирает его.
+                # Запрет показывает, есть ли у запроса подходящий индекс - его планировщик выберет на больших таблицах
+                with connection.cursor() as cursor:
+                    cursor.execute("SET LOCAL enable_seqscan = off")
+
+            for label, run, column in self._workload(owner):
+                with CaptureQueriesContext(connection) as queries:
+                    run()
+
+                for query in queries.captured_queries:
+                    plan = self._explain(query["sql"])
+                    scans = sorted({match for line in plan for match in SEQ_SCAN.findall(line)} & tables)
+                    # Условие курсора должно быть границей диапазона индекса, а не фильтром прочитанных строк
+                    filtered = (
+                        column is not None
+                        and f'"{column}" <' in query["sql"]
+                        and not any(re.search(INDEX_COND.format(column), line) for line in plan)
+                    )
+                    if scans:
+                        failures += 1
+                        self.stdout.write(self.style.ERROR(f"{label}: последовательное чтение {', '.join(scans)}"))
+                    elif filtered:
+                        failures += 1
+                        self.stdout.write(self.style.ERROR(f"{label}: условие курсора по {column} - не Index Cond"))
+                    else:
+                        self.stdout.write(self.style.SUCCESS(f"{label}: индекс"))
+
+                    if scans or filtered or options["verbosity"] > 1:
+                        self.stdout.write(f"  {query['sql']}")
+                        self.stdout.write("\n".join(f"    {line}" for line in plan))
+
+        if failures:
+            raise CommandError(f"Запросов с последовательным чтением таблиц или фильтром курсора: {failures}.")
+        self.stdout.write(self.style.SUCCESS("Все проверенные запросы читают таблицы по индексам."))
+
+    def _workload(self, owner: CustomUser) -> list:
+        """
+        Проверяемые запросы - для владельца и для менеджера: названия, функции, которые их выполняют, и столбец
+        условия курсора (для следующих страниц списков с keyset-пагинацией, иначе None).
+        """
+        mailing = Mailing.objects.filter(owner=owner).order_by("pk").first()
+        workload = [("Счётчики страницы приветствия", welcome_stats, None)]
+
+        for scope, roles in ((f"владелец {owner.pk}", frozenset()), ("менеджер", frozenset({MANAGERS_GROUP}))):
+            request = RequestFactory().get("/")
+            request.user = owner
+            request.roles = roles  # Роли не читаются из БД: проверяются только запросы страниц
+
+            workload.append(
+                (f"Счётчики ({scope})", lambda roles=roles: dashboard_stats(None if roles else owner), None)
+            )
+            for view_class in (HomeView, MailingListView, MessageListView, RecipientListView, SendAttemptListView):
+                workload.append(
+                    (f"{view_class.__name__} ({scope})", lambda v=view_class, r=request: self._render(v, r), None)
+                )
+
+                cursor = self._cursor(view_class, request) if issubclass(view_class, KeysetPaginationMixin) else None
+                if cursor is not None:
+                    page_request = RequestFactory().get("/", {view_class.cursor_kwarg: cursor})
+                    page_request.user, page_request.roles = owner, roles
+                    model = view_class.model._meta
+                    column = model.get_field(view_class.keyset_field).column if view_class.keyset_field else None
+                    workload.append(
+                        (
+                            f"{view_class.__name__}, следующая страница ({scope})",
+                            lambda v=view_class, r=page_request: self._render(v, r),
+                            column or model.pk.column,
+                        )
+                    )
+
+        if mailing is not None:
+            workload.append(
+                (
+                    f"Попытки отправки рассылки {mailing.pk}",
+                    lambda: list(SendAttempt.objects.filter(mailing=mailing).order_by("-attempt_at")[:50]),
+                    None,
+                )
+            )
+        return workload
+
+    @staticmethod
+    def _cursor(view_class, request):
+        """
+        Курсор следующей страницы списка view_class: после первого объекта первой страницы с непустым полем
+        сортировки (курсор по пустому значению не ограничивает поле сверху). None - таких объектов нет.
+        """
+        view = view_class()
+        view.setup(request)
+        field = view.keyset_field
+        objects = [obj for obj in view.get_queryset() if not field or getattr(obj, field) is not None]
+        return view.make_cursor(objects[0]) if objects else None
+
+    @staticmethod
+    def _render(view_class, request):
+        """Выполняет запросы страницы: контекст представления со всеми его списками (без шаблона)."""
+        view = view_class()
+        view.setup(request)
+        if isinstance(view, MultipleObjectMixin):
+            view.object_list = view.get_queryset()
+        for value in view.get_context_data().values():
+            if isinstance(value, QuerySet):
+                list(value)
+
+    @staticmethod
+    def _explain(sql: str) -> list:
+        """План запроса sql - список строк."""
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN {sql}")
+            return [row[0] for row in cursor.fetchall()]
@@ -0,0 +1,48 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils.timezone import now
+
+from postpilot.archive import archive_attempts
+from postpilot.models import SendAttempt
+
+
+class Command(BaseCommand):
+    """
+    Кастомная команда переноса старых попыток отправки в архив.
+    """
+
+    help = "Перенос попыток отправки старше срока хранения в сжатый архив с итогами по рассылкам"
+
+    def add_arguments(self, parser):
+        """Добавляет аргументы команды.
+        Пример использования: ./manage.py compact_attempts --days 90 --batch-size 1000
+        Сколько попыток будет перенесено: ./manage.py compact_attempts --dry-run"""
+
+        parser.add_argument("--days", type=int, help="Сколько дней попытки хранятся в рабочей таблице")
+        parser.add_argument("--batch-size", type=int, help="Попыток, переносимых в архив за одну транзакцию")
+        parser.add_argument(
+            "--max-batches", type=int, default=0, help="Сколько пачек перенести за запуск (0 - все старые попытки)"
+        )
+        parser.add_argument(
+            "--dry-run", action="store_true", help="Только посчитать попытки, которые будут перенесены"
+        )
+
+    def handle(self, *args, **options):
+        """Обработчик команды."""
+        days = options["days"] if options["days"] is not None else settings.MAILING_ATTEMPTS_RETENTION_DAYS
+        cutoff = now() - timedelta(days=days)
+
+        if options["dry_run"]:
+            count = SendAttempt.objects.filter(attempt_at__lt=cutoff).count()
+            self.stdout.write(f"Попыток старше {days} дней (до {cutoff:%Y-%m-%d %H:%M}): {count}.")
+            return
+
+        archived = archive_attempts(
+            cutoff,
+            batch_size=options["batch_size"],
+            max_batches=options["max_batches"],
+            report=self.stdout.write if options["verbosity"] > 1 else None,
+        )
+        self.stdout.write(self.style.SUCCESS(f"В архив перенесено попыток старше {days} дней: {archived}."))
@@ -0,0 +1,48 @@
+import os
+import socket
+
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+
+from postpilot.jobs import JobWorker
+
+
+class Command(BaseCommand):
+    """
+    Кастомная команда запуска обработчика очереди рассылок.
+    """
+
+    help = "Обработка очереди заданий на отправку рассылок"
+
+    def add_arguments(self, parser):
+        """Добавляет аргументы команды.
+        Пример использования: ./manage.py run_mailing_worker --poll-interval 5"""
+
+        parser.add_argument(
+            "--poll-interval", type=float, default=2.0, help="Пауза между опросами пустой очереди, секунд"
+        )
+        parser.add_argument("--once", action="store_true", help="Обработать очередь и завершиться")
+        parser.add_argument(
+            "--no-retries", action="store_true", help="Не повторять отправку отложенных писем (только очередь)"
+        )
+
+    def handle(self, *args, **options):
+        """Обработчик команды."""
+        name = f"{socket.gethostname()}:{os.getpid()}"
+        self.stdout.write(self.style.SUCCESS(f"Обработчик {name} запущен."))
+
+        # SMTP-соединение открывается при первом письме и остаётся открытым между заданиями
+        smtp_connection = get_connection(fail_silently=False)
+        worker = JobWorker(
+            name,
+            poll_interval=options["poll_interval"],
+            retries=not options["no_retries"],
+            smtp_connection=smtp_connection,
+            report=self.stdout.write,
+        )
+        try:
+            worker.run(once=options["once"])
+        finally:
+            smtp_connection.close()
+
+        self.stdout.write(self.style.SUCCESS(f"Обработчик {name} остановлен."))
@@ -0,0 +1,60 @@
+import logging
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.utils import Error as DatabaseError
+
+from postpilot.scheduler import MailingScheduler
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    Кастомная команда запуска планировщика отложенных рассылок.
+    """
+
+    help = "Постановка в очередь рассылок, время отправки которых наступило"
+
+    def add_arguments(self, parser):
+        """Добавляет аргументы команды.
+        Пример использования: ./manage.py run_scheduler --refresh-interval 1 --lookahead 300"""
+
+        parser.add_argument("--refresh-interval", type=float, help="Пауза между обновлениями расписания из БД, секунд")
+        parser.add_argument("--lookahead", type=float, help="На сколько секунд вперёд загружать расписание")
+
+    def handle(self, *args, **options):
+        """
+        Обработчик команды. По SIGTERM/SIGINT планировщик завершается, не дожидаясь конца паузы. Ошибка БД
+        не останавливает планировщик: он ждёт refresh_interval и перечитывает расписание.
+        """
+        scheduler = MailingScheduler(lookahead=options["lookahead"], refresh_interval=options["refresh_interval"])
+        self.stopped = threading.Event()
+        handlers = {signum: signal.signal(signum, self._on_signal) for signum in (signal.SIGTERM, signal.SIGINT)}
+        self.stdout.write(self.style.SUCCESS("Планировщик рассылок запущен."))
+
+        try:
+            while not self.stopped.is_set():
+                try:
+                    for mailing_id in scheduler.tick():
+                        self.stdout.write(f"Рассылка {mailing_id} поставлена в очередь.")
+                except DatabaseError as e:
+                    # Соединение с БД потеряно - закрываем его, при следующем запросе Django откроет новое.
+                    # Рассылка, которую не успели поставить в очередь, вернётся в кучу при обновлении расписания
+                    logger.exception(f"Ошибка БД в планировщике рассылок: {e}")
+                    connection.close()
+                    scheduler.refreshed_at = None
+                    self.stopped.wait(scheduler.refresh_interval)
+                    continue
+                self.stopped.wait(scheduler.seconds_until_next())
+        finally:
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+
+        self.stdout.write(self.style.SUCCESS("Планировщик рассылок остановлен."))
+
+    def _on_signal(self, signum, frame):
+        """Обработчик SIGTERM/SIGINT: пауза прерывается, и планировщик завершается после текущего шага."""
+        self.stopped.set()
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from postpilot.smtp_sink import SMTPSink
+
+
+class Command(BaseCommand):
+    """
+    Кастомная команда запуска локального SMTP-сервера-заглушки.
+    """
+
+    help = "Запуск локального SMTP-сервера, который принимает письма и никуда их не отправляет"
+
+    def add_arguments(self, parser):
+        """Добавляет аргументы команды.
+        Пример использования: ./manage.py run_smtp_sink --port 8025 --latency 20 --failure-rate 0.01"""
+
+        parser.add_argument("--host", default="127.0.0.1", help="Адрес сервера")
+        parser.add_argument("--port", type=int, default=8025, help="Порт сервера")
+        parser.add_argument("--latency", type=float, default=0.0, help="Задержка ответа на письмо, мс")
+        parser.add_argument("--failure-rate", type=float, default=0.0, help="Доля отклоняемых писем (0-1)")
+        parser.add_argument("--capacity", type=int, default=0, help="Писем, обрабатываемых одновременно (0 - все)")
+
+    def handle(self, *args, **options):
+        """Обработчик команды."""
+        sink = SMTPSink(
+            host=options["host"],
+            port=options["port"],
+            latency=options["latency"] / 1000,
+            failure_rate=options["failure_rate"],
+            capacity=options["capacity"],
+        )
+        self.stdout.write(self.style.SUCCESS(f"SMTP-заглушка слушает {options['host']}:{options['port']}."))
+
+        try:
+            sink.serve_forever()
+        except KeyboardInterrupt:
+            self.stdout.write(f"Принято писем: {sink.received}, отклонено: {sink.rejected}.")
@@ -1,7 +1,58 @@
-from django.core.mail import send_mail
+import multiprocessing
+import os
+import socket
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing.util import Finalize
+
+from django.core.mail import get_connection
 from django.core.management.base import BaseCommand
+from django.db import connections
 
+from postpilot.breaker import RelayUnavailable
+from postpilot.jobs import JobWorker
+from postpilot.leases import MailingBusy, MailingLease, runner_name
 from postpilot.models import Mailing
+from postpilot.progress import start_progress
+from postpilot.services import (
+    DeliveryCancelled,
+    complete_mailing,
+    deliver_range,
+    delivery_totals,
+    open_connection,
+    prepare_deliveries,
+    recipient_chunks,
+    record_cancellation,
+    resume_mailing,
+    start_mailing,
+)
+
+# SMTP-соединение процесса-обработчика пула. Открывается один раз на процесс и переиспользуется всеми его частями.
+_worker_connection = None
+
+
+def _init_worker():
+    """Инициализация процесса пула: открывает собственное SMTP-соединение процесса (через выключатель SMTP-сервера).
+    Если сервер недоступен, соединение остаётся закрытым, а части рассылки будут отложены.
+    Соединение с БД каждый процесс открывает сам при первом запросе."""
+    global _worker_connection
+
+    _worker_connection = get_connection(fail_silently=False)
+    Finalize(None, _worker_connection.close, exitpriority=10)
+    try:
+        open_connection(_worker_connection)
+    except RelayUnavailable:
+        pass
+
+
+def _send_chunk(mailing_id: int, first_pk: int, last_pk: int, holder: str) -> tuple:
+    """
+    Отправляет одну часть рассылки в процессе пула. Рассылку захватил родительский процесс holder - процесс пула
+    только продлевает его захват. Возвращает id рассылки и счётчики отправки.
+    """
+    mailing = Mailing.objects.select_related("message").get(pk=mailing_id)
+    lease = MailingLease(mailing_id, holder)
+    return mailing_id, deliver_range(mailing, first_pk, last_pk, connection=_worker_connection, lease=lease)
 
 
 class Command(BaseCommand):
@@ -11,31 +62,227 @@ class Command(BaseCommand):
 
     help = "Отправка всех активных рассылок"
 
-    def handle(self, *args, **kwargs):
+    def handle(self, *args, **options):
         """Обработчик команды."""
-        mailings = Mailing.objects.filter(status="started")
+        if options["daemon"]:
+            return self._run_daemon(options)
+
+        mailings = Mailing.objects.filter(status="started").select_related("message")
+        if options["mailing_id"]:
+            mailings = Mailing.objects.filter(pk=options["mailing_id"]).select_related("message")
 
-        if not mailings.exists():
+        mailings = list(mailings)
+        if not mailings:
             self.stdout.write(self.style.WARNING("Нет активных рассылок."))
             return
 
+        # Рассылки, которые уже отправляет другой процесс (обработчик очереди, демон), пропускаем
+        holder = runner_name()
+        leases = {}
+        for mailing in mailings:
+            lease = MailingLease(mailing.pk, holder)
+            try:
+                lease.acquire()
+            except MailingBusy as e:
+                self.stdout.write(self.style.WARNING(str(e)))
+                continue
+            leases[mailing.pk] = lease
+            mailing.refresh_from_db(fields=["status"])
+
+        mailings = [mailing for mailing in mailings if mailing.pk in leases]
+        try:
+            self._send(mailings, leases, options)
+        finally:
+            for lease in leases.values():
+                lease.release()
+
+    def _send(self, mailings: list, leases: dict, options: dict):
+        """Отправляет захваченные рассылки mailings (leases - захваты по id рассылки) и выводит итоги."""
+        # Делим каждую рассылку на части, чтобы большие рассылки тоже распределялись по процессам.
+        # Прерванные рассылки продолжаются: в части попадают только получатели, которым письмо ещё не отправлено
+        tasks = []
+        before = {}
         for mailing in mailings:
-            recipients = mailing.recipients.all()
-            recipient_list = [recipient.email for recipient in recipients]
-
-            if recipient_list:
-                send_mail(
-                    subject=mailing.message.subject,
-                    message=mailing.message.body_text,
-                    from_email="no-reply@example.com",
-                    recipient_list=recipient_list,
+            if options["mailing_id"]:
+                resume_mailing(mailing)  # Рассылка запущена явно - прежний запрос остановки снимается
+            prepare_deliveries(mailing)
+            if mailing.status != "started":
+                start_mailing(mailing)
+            before[mailing.id] = delivery_totals(mailing)
+            start_progress(mailing, before[mailing.id])
+            chunks = recipient_chunks(mailing, options["chunk_size"])
+            if not chunks:
+                self.stdout.write(self.style.WARNING(f"У рассылки {mailing.id} нет получателей, ожидающих отправки."))
+            tasks.extend((mailing.id, first_pk, last_pk) for first_pk, last_pk in chunks)
+
+        started_at = time.monotonic()
+        self.deferred = 0  # Части, отложенные из-за недоступности SMTP-сервера
+        if options["workers"] > 1:
+            results, cancelled = self._run_in_pool(tasks, options["workers"], leases)
+        else:
+            results, cancelled = self._run_in_process(tasks, leases)
+        elapsed = time.monotonic() - started_at
+
+        # Подводим итоги по каждой рассылке
+        totals = {"sent": 0, "failed": 0}
+        for mailing in mailings:
+            if mailing.id in cancelled:
+                # Счётчики прерванной части не вернулись из deliver_range - считаем итоги по журналу доставки
+                results[mailing.id] = record_cancellation(mailing, before[mailing.id])
+            counters = results.get(mailing.id, {"sent": 0, "failed": 0})
+            # Пользователь мог остановить рассылку во время отправки - статус 'broken' не перезаписываем
+            mailing.refresh_from_db(fields=["status"])
+            if mailing.status == "started":
+                complete_mailing(mailing)
+            totals["sent"] += counters["sent"]
+            totals["failed"] += counters["failed"]
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"Рассылка {mailing.id}: отправлено {counters['sent']}, ошибок {counters['failed']}."
                 )
-                self.stdout.write(self.style.SUCCESS(f"Рассылка {mailing.id} успешно отправлена."))
+            )
+
+        total = totals["sent"] + totals["failed"]
+        rate = total / elapsed if elapsed > 0 else 0.0
+        summary = (
+            f"Писем: {total} (успешно {totals['sent']}, ошибок {totals['failed']}) за {elapsed:.2f} с - "
+            f"{rate:.1f} писем/с, процессов: {options['workers']}."
+        )
+        if self.deferred:
+            self.stdout.write(
+                self.style.WARNING(
+                    f"Отправка не завершена: {self.deferred} частей рассылок отложено до следующего запуска "
+                    f"(SMTP-сервер недоступен). {summary}"
+                )
+            )
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Все активные рассылки отправлены. {summary}"))
+
+    def _run_daemon(self, options: dict):
+        """
+        Постоянно работающий процесс: обрабатывает очередь заданий (как run_mailing_worker), не тратя время на
+        запуск Django и установку соединений при каждом запуске. Соединения с БД и SMTP-сервером открываются
+        один раз и остаются открытыми, новые задания берутся сразу после постановки в очередь (LISTEN/NOTIFY
+        на PostgreSQL, иначе - опрос раз в --poll-interval секунд). По SIGTERM текущая пачка писем дописывается,
+        задание возвращается в очередь, и процесс завершается. Если SMTP-сервер недоступен, процесс всё равно
+        запускается: задания откладываются, пока сервер не станет доступен.
+        """
+        name = f"{socket.gethostname()}:{os.getpid()}"
+        smtp_connection = get_connection(fail_silently=False)
+        try:
+            open_connection(smtp_connection)
+        except RelayUnavailable as e:
+            self.stdout.write(self.style.WARNING(f"{e} Соединение будет открыто при отправке."))
+        self.stdout.write(self.style.SUCCESS(f"Процесс отправки {name} запущен в режиме демона."))
+
+        try:
+            JobWorker(
+                name, poll_interval=options["poll_interval"], smtp_connection=smtp_connection, report=self.stdout.write
+            ).run()
+        finally:
+            smtp_connection.close()
+
+        self.stdout.write(self.style.SUCCESS(f"Процесс отправки {name} остановлен."))
+
+    def _run_in_process(self, tasks: list, leases: dict) -> tuple:
+        """
+        Последовательная отправка всех частей в текущем процессе через одно SMTP-соединение. Соединение открывается
+        через выключатель SMTP-сервера при отправке первой части; если сервер недоступен, оставшиеся части
+        откладываются до следующего запуска.
+        Возвращает счётчики по рассылкам и id рассылок, остановленных пользователем.
+        """
+        results = {}
+        cancelled = set()
+        skipped = set()
+        connection = get_connection(fail_silently=False)
+        try:
+            for index, (mailing_id, first_pk, last_pk) in enumerate(tasks):
+                if mailing_id in cancelled or mailing_id in skipped:
+                    continue
+                mailing = Mailing.objects.select_related("message").get(pk=mailing_id)
+                try:
+                    counters = deliver_range(
+                        mailing, first_pk, last_pk, connection=connection, lease=leases[mailing_id]
+                    )
+                except DeliveryCancelled as e:
+                    self.stdout.write(self.style.WARNING(str(e)))
+                    cancelled.add(mailing_id)
+                    continue
+                except MailingBusy as e:
+                    self.stdout.write(self.style.WARNING(str(e)))
+                    skipped.add(mailing_id)
+                    continue
+                except RelayUnavailable as e:
+                    self.stdout.write(self.style.WARNING(f"Отправка отложена до следующего запуска: {e}"))
+                    self.deferred = sum(task[0] not in cancelled and task[0] not in skipped for task in tasks[index:])
+                    break
+                self._merge(results, mailing_id, counters)
+        finally:
+            connection.close()
+        return results, cancelled
+
+    def _run_in_pool(self, tasks: list, workers: int, leases: dict) -> tuple:
+        """
+        Параллельная отправка частей в пуле процессов.
+        Возвращает счётчики по рассылкам и id рассылок, остановленных пользователем.
+        """
+        results = {}
+        cancelled = set()
+
+        # Процессы создаются через fork, поэтому соединения с БД родителя закрываем заранее -
+        # иначе дочерние процессы унаследуют общий сокет
+        connections.close_all()
+
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("fork"), initializer=_init_worker
+        ) as executor:
+            futures = {executor.submit(_send_chunk, *task, leases[task[0]].holder): task[0] for task in tasks}
+            for future in as_completed(futures):
+                try:
+                    mailing_id, counters = future.result()
+                except DeliveryCancelled as e:
+                    if futures[future] not in cancelled:
+                        self.stdout.write(self.style.WARNING(str(e)))
+                    cancelled.add(futures[future])
+                    continue
+                except MailingBusy as e:
+                    self.stdout.write(self.style.WARNING(str(e)))
+                    continue
+                except RelayUnavailable as e:
+                    self.stdout.write(self.style.WARNING(f"Часть рассылки отложена до следующего запуска: {e}"))
+                    self.deferred += 1
+                    continue
+                except Exception as e:
+                    self.stdout.write(self.style.ERROR(f"Ошибка при отправке части рассылки: {e}"))
+                    continue
+                self._merge(results, mailing_id, counters)
+
+        return results, cancelled
 
-        self.stdout.write(self.style.SUCCESS("Все активные рассылки отправлены."))
+    @staticmethod
+    def _merge(results: dict, mailing_id: int, counters: dict):
+        """Суммирует счётчики отправки части в итог по рассылке."""
+        totals = results.setdefault(mailing_id, {"sent": 0, "failed": 0})
+        totals["sent"] += counters["sent"]
+        totals["failed"] += counters["failed"]
 
     def add_arguments(self, parser):
         """Позволяет отправить рассылку только для конкретного ID.
-        Пример использования: ./manage.py send_mailing 3"""
+        Пример использования: ./manage.py send_mailing 3
+        Параллельная отправка в 4 процессах: ./manage.py send_mailing --workers 4
+        Постоянно работающий процесс, отправляющий рассылки из очереди: ./manage.py send_mailing --daemon"""
 
         parser.add_argument("mailing_id", nargs="?", type=int, help="ID рассылки")
+        parser.add_argument("--workers", type=int, default=1, help="Количество процессов отправки")
+        parser.add_argument(
+            "--chunk-size", type=int, default=1000, help="Количество получателей в одной части рассылки"
+        )
+        parser.add_argument(
+            "--daemon", action="store_true", help="Работать постоянно, отправляя рассылки из очереди заданий"
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=5.0,
+            help="Режим демона: пауза между опросами очереди, если уведомления не пришли, секунд",
+        )
@@ -0,0 +1,25 @@
+# Generated by Django 5.1.5 on 2026-10-17 15:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("postpilot", "0008_alter_mailing_owner_alter_message_owner_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="sendattempt",
+            name="recipient",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                to="postpilot.recipient",
+                verbose_name="Получатель",
+            ),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.1.5 on 2026-10-17 15:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("postpilot", "0009_sendattempt_recipient"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MailingJob",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("queued", "В очереди"),
+                            ("running", "Выполняется"),
+                            ("done", "Выполнено"),
+                            ("failed", "Ошибка"),
+                        ],
+                        default="queued",
+                        max_length=7,
+                        verbose_name="Статус задания",
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True, verbose_name="Дата постановки в очередь")),
+                ("started_at", models.DateTimeField(blank=True, null=True, verbose_name="Дата начала выполнения")),
+                ("finished_at", models.DateTimeField(blank=True, null=True, verbose_name="Дата окончания выполнения")),
+                ("worker", models.CharField(blank=True, max_length=100, verbose_name="Обработчик")),
+                ("error", models.TextField(blank=True, verbose_name="Ошибка")),
+                (
+                    "mailing",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="jobs",
+                        to="postpilot.mailing",
+                        verbose_name="Рассылка",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Задание на отправку",
+                "verbose_name_plural": "Задания на отправку",
+                "db_table": "mailing_jobs",
+                "ordering": ["created_at"],
+                "indexes": [models.Index(fields=["status", "created_at"], name="mailing_jobs_status_created")],
+            },
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.1.5 on 2026-10-17 15:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("postpilot", "0010_mailingjob"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Delivery",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[("pending", "Ожидает отправки"), ("sent", "Отправлено"), ("failed", "Ошибка")],
+                        default="pending",
+                        max_length=7,
+                        verbose_name="Статус доставки",
+                    ),
+                ),
+                ("updated_at", models.DateTimeField(auto_now=True, verbose_name="Дата изменения")),
+                (
+                    "mailing",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="deliveries",
+                        to="postpilot.mailing",
+                        verbose_name="Рассылка",
+                    ),
+                ),
+                (
+                    "recipient",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="postpilot.recipient",
+                        verbose_name="Получатель",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Доставка",
+                "verbose_name_plural": "Доставки",
+                "db_table": "deliveries",
+                "indexes": [
+                    models.Index(fields=["mailing", "status", "recipient"], name="deliveries_mailing_status_rcpt")
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("mailing", "recipient"), name="deliveries_mailing_recipient_unique"
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.1.5 on 2026-10-17 15:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("postpilot", "0011_delivery"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="delivery",
+            name="attempts",
+            field=models.PositiveSmallIntegerField(default=0, verbose_name="Попыток отправки"),
+        ),
+        migrations.AddField(
+            model_name="delivery",
+            name="last_error",
+            field=models.TextField(blank=True, default="", verbose_name="Последняя ошибка"),
+        ),
+        migrations.AddField(
+            model_name="delivery",
+            name="next_attempt_at",
+            field=models.DateTimeField(blank=True, null=True, verbose_name="Дата следующей попытки"),
+        ),
+        migrations.AlterField(
+            model_name="delivery",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("pending", "Ожидает отправки"),
+                    ("sent", "Отправлено"),
+                    ("deferred", "Ожидает повтора"),
+                    ("failed", "Ошибка"),
+                ],
+                default="pending",
+                max_length=8,
+                verbose_name="Статус доставки",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="delivery",
+            index=models.Index(fields=["status", "next_attempt_at"], name="deliveries_status_next_attempt"),
+        ),
+    ]
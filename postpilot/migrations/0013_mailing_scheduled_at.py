@@ -0,0 +1,24 @@
+# Generated by Django 5.1.5 on 2026-10-17 15:51
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("postpilot", "0012_delivery_retry"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="mailing",
+            name="scheduled_at",
+            field=models.DateTimeField(blank=True, null=True, verbose_name="Дата запланированной отправки"),
+        ),
+        migrations.AddIndex(
+            model_name="mailing",
+            index=models.Index(fields=["status", "scheduled_at"], name="mailings_status_scheduled"),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.5 on 2026-10-17 16:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("postpilot", "0013_mailing_scheduled_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="mailingjob",
+            name="run_after",
+            field=models.DateTimeField(blank=True, null=True, verbose_name="Не выполнять до"),
+        ),
+    ]
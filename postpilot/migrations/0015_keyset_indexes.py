@@ -0,0 +1,46 @@
+# Generated by Django 5.1.5 on 2026-10-17 16:19
+
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Индексы больших таблиц строятся без блокировки записи (CREATE INDEX CONCURRENTLY), вне транзакции
+    atomic = False
+
+    dependencies = [
+        ("postpilot", "0014_mailingjob_run_after"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="mailing",
+            index=models.Index(fields=["-sent_completed_at", "-id"], name="mailings_keyset"),
+        ),
+        AddIndexConcurrently(
+            model_name="mailing",
+            index=models.Index(fields=["owner", "-sent_completed_at", "-id"], name="mailings_owner_keyset"),
+        ),
+        AddIndexConcurrently(
+            model_name="message",
+            index=models.Index(fields=["-created_at", "-id"], name="messages_keyset"),
+        ),
+        AddIndexConcurrently(
+            model_name="message",
+            index=models.Index(fields=["owner", "-created_at", "-id"], name="messages_owner_keyset"),
+        ),
+        AddIndexConcurrently(
+            model_name="recipient",
+            index=models.Index(fields=["owner", "-id"], name="recipients_owner_keyset"),
+        ),
+        AddIndexConcurrently(
+            model_name="sendattempt",
+            index=models.Index(fields=["-attempt_at", "-id"], name="send_attempts_keyset"),
+        ),
+        AddIndexConcurrently(
+            model_name="sendattempt",
+            index=models.Index(fields=["owner", "-attempt_at", "-id"], name="send_attempts_owner_keyset"),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.1.5 on 2026-10-17 16:23
+
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Индексы больших таблиц строятся без блокировки записи (CREATE INDEX CONCURRENTLY), вне транзакции
+    atomic = False
+
+    dependencies = [
+        ("postpilot", "0015_keyset_indexes"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="mailing",
+            index=models.Index(fields=["owner", "status"], name="mailings_owner_status"),
+        ),
+        AddIndexConcurrently(
+            model_name="mailing",
+            index=models.Index(
+                condition=models.Q(("status", "started")),
+                fields=["owner", "-sent_completed_at", "-id"],
+                name="mailings_started",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="sendattempt",
+            index=models.Index(fields=["owner", "status"], name="send_attempts_owner_status"),
+        ),
+        AddIndexConcurrently(
+            model_name="sendattempt",
+            index=models.Index(fields=["mailing", "-attempt_at"], name="send_attempts_mailing_time"),
+        ),
+    ]
@@ -0,0 +1,87 @@
+# Generated by Django 5.1.5 on 2026-10-17 16:26
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("postpilot", "0016_owner_status_indexes"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SendAttemptSummary",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("attempts", models.PositiveIntegerField(default=0, verbose_name="Попыток")),
+                ("successful", models.PositiveIntegerField(default=0, verbose_name="Успешных")),
+                ("failed", models.PositiveIntegerField(default=0, verbose_name="Неудачных")),
+                ("first_attempt_at", models.DateTimeField(blank=True, null=True, verbose_name="Первая попытка")),
+                ("last_attempt_at", models.DateTimeField(blank=True, null=True, verbose_name="Последняя попытка")),
+                (
+                    "mailing",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="attempt_summary",
+                        to="postpilot.mailing",
+                        verbose_name="Рассылка",
+                    ),
+                ),
+                (
+                    "owner",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="Владелец",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Итоги архивных попыток",
+                "verbose_name_plural": "Итоги архивных попыток",
+                "db_table": "send_attempt_summaries",
+            },
+        ),
+        migrations.CreateModel(
+            name="SendAttemptArchive",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("month", models.DateField(verbose_name="Месяц")),
+                ("first_attempt_at", models.DateTimeField(verbose_name="Первая попытка")),
+                ("last_attempt_at", models.DateTimeField(verbose_name="Последняя попытка")),
+                ("attempts", models.PositiveIntegerField(verbose_name="Попыток")),
+                ("data", models.BinaryField(verbose_name="Попытки")),
+                (
+                    "mailing",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="attempt_archives",
+                        to="postpilot.mailing",
+                        verbose_name="Рассылка",
+                    ),
+                ),
+                (
+                    "owner",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="Владелец",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Архив попыток отправки",
+                "verbose_name_plural": "Архив попыток отправки",
+                "db_table": "send_attempt_archives",
+                "ordering": ["-last_attempt_at"],
+                "indexes": [
+                    models.Index(fields=["mailing", "month"], name="attempt_archives_mailing_month"),
+                    models.Index(fields=["owner", "month"], name="attempt_archives_owner_month"),
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.1.5 on 2026-10-17 18:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("postpilot", "0017_attempt_archive"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="mailing",
+            name="claimed_by",
+            field=models.CharField(
+                blank=True, default="", editable=False, max_length=100, verbose_name="Отправляющий процесс"
+            ),
+        ),
+        migrations.AddField(
+            model_name="mailing",
+            name="lease_until",
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name="Захвачена до"),
+        ),
+    ]
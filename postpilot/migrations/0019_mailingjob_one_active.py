@@ -0,0 +1,37 @@
+# Generated by Django 5.1.5 on 2026-10-17 18:20
+
+from django.db import migrations, models
+
+
+def fail_duplicate_jobs(apps, schema_editor):
+    """Оставляет у каждой рассылки одно (самое старое) незавершённое задание, остальные завершает с ошибкой."""
+    MailingJob = apps.get_model("postpilot", "MailingJob")
+    active = MailingJob.objects.filter(status__in=["queued", "running"]).order_by("mailing_id", "created_at", "pk")
+
+    kept = set()
+    duplicates = []
+    for pk, mailing_id in active.values_list("pk", "mailing_id"):
+        if mailing_id in kept:
+            duplicates.append(pk)
+        kept.add(mailing_id)
+
+    MailingJob.objects.filter(pk__in=duplicates).update(status="failed", error="Повторное задание рассылки.")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("postpilot", "0018_mailing_lease"),
+    ]
+
+    operations = [
+        migrations.RunPython(fail_duplicate_jobs, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="mailingjob",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("status__in", ["queued", "running"])),
+                fields=("mailing",),
+                name="mailing_jobs_one_active",
+            ),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.1.5 on 2026-10-17 18:41
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Индекс большой таблицы строится без блокировки записи (CREATE INDEX CONCURRENTLY), вне транзакции
+    atomic = False
+
+    dependencies = [
+        ("postpilot", "0019_mailingjob_one_active"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="sendattempt",
+            index=models.Index(fields=["status", "id"], name="send_attempts_status"),
+        ),
+    ]
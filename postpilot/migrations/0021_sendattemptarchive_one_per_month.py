@@ -0,0 +1,52 @@
+# Generated by Django 5.1.5 on 2026-10-17 18:40
+
+import json
+import zlib
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def merge_archives(apps, schema_editor):
+    """Объединяет строки архива одной рассылки за один месяц (по строке на пачку переноса) в одну строку."""
+    SendAttemptArchive = apps.get_model("postpilot", "SendAttemptArchive")
+    duplicates = (
+        SendAttemptArchive.objects.values("mailing_id", "month")
+        .annotate(rows=models.Count("pk"))
+        .filter(rows__gt=1)
+        .order_by()
+    )
+
+    for key in duplicates.iterator():
+        archives = list(SendAttemptArchive.objects.filter(mailing_id=key["mailing_id"], month=key["month"]))
+        # Попытки хранятся списками [id, attempt_at, ...] (postpilot.archive.ARCHIVE_FIELDS)
+        values = [row for archive in archives for row in json.loads(zlib.decompress(archive.data))]
+        values.sort(key=lambda row: (row[1], row[0]))
+
+        kept, *merged = archives
+        kept.attempts = len(values)
+        kept.first_attempt_at = min(archive.first_attempt_at for archive in archives)
+        kept.last_attempt_at = max(archive.last_attempt_at for archive in archives)
+        kept.data = zlib.compress(json.dumps(values).encode())
+        kept.save(update_fields=["attempts", "first_attempt_at", "last_attempt_at", "data"])
+        SendAttemptArchive.objects.filter(pk__in=[archive.pk for archive in merged]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("postpilot", "0020_sendattempt_status_index"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_archives, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name="sendattemptarchive",
+            name="attempt_archives_mailing_month",
+        ),
+        migrations.AddConstraint(
+            model_name="sendattemptarchive",
+            constraint=models.UniqueConstraint(fields=("mailing", "month"), name="attempt_archives_mailing_month"),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.1.5 on 2026-10-17 21:10
+
+import json
+import zlib
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def number_archives(apps, schema_editor):
+    """Номер части существующих строк архива (по строке на рассылку и месяц) - id их первой попытки."""
+    SendAttemptArchive = apps.get_model("postpilot", "SendAttemptArchive")
+    for archive in SendAttemptArchive.objects.only("pk", "data").iterator():
+        # Попытки хранятся списками [id, attempt_at, ...] (postpilot.archive.ARCHIVE_FIELDS)
+        values = json.loads(zlib.decompress(archive.data))
+        archive.seq = min((row[0] for row in values), default=0)
+        archive.save(update_fields=["seq"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("postpilot", "0021_sendattemptarchive_one_per_month"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="sendattemptarchive",
+            name="seq",
+            field=models.PositiveBigIntegerField(default=0, verbose_name="Часть"),
+            preserve_default=False,
+        ),
+        migrations.RunPython(number_archives, migrations.RunPython.noop),
+        migrations.RemoveConstraint(
+            model_name="sendattemptarchive",
+            name="attempt_archives_mailing_month",
+        ),
+        migrations.AddConstraint(
+            model_name="sendattemptarchive",
+            constraint=models.UniqueConstraint(
+                fields=("mailing", "month", "seq"), name="attempt_archives_mailing_month_seq"
+            ),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models import Q
 
 
 # -- Recipient model --
@@ -22,6 +23,9 @@ class Recipient(models.Model):
         db_table = "recipients"
         verbose_name = "Получатель"
         verbose_name_plural = "Получатели"
+        indexes = [
+            models.Index(fields=["owner", "-id"], name="recipients_owner_keyset"),
+        ]
 
 
 # -- Message model --
@@ -46,6 +50,10 @@ class Message(models.Model):
         verbose_name = "Сообщение"
         verbose_name_plural = "Сообщения"
         ordering = ["-created_at"]
+        indexes = [
+            models.Index(fields=["-created_at", "-id"], name="messages_keyset"),
+            models.Index(fields=["owner", "-created_at", "-id"], name="messages_owner_keyset"),
+        ]
 
 
 # -- Mailing model --
@@ -60,6 +68,9 @@ class Mailing(models.Model):
     ]
 
     first_sent_at = models.DateTimeField("Дата первой отправки", blank=True, null=True)
+    scheduled_at = models.DateTimeField(
+        "Дата запланированной отправки", blank=True, null=True
+    )  # Сбрасывается, когда планировщик ставит рассылку в очередь (./manage.py run_scheduler)
     sent_completed_at = models.DateTimeField(
         "Дата завершения отправки", blank=True, null=True, auto_now=True
     )  # Используем auto_now=True в sent_completed_at, т.к. поле всегда обновляется при завершении
@@ -67,6 +78,9 @@ class Mailing(models.Model):
     message = models.ForeignKey(Message, on_delete=models.CASCADE, verbose_name="Сообщение")
     recipients = models.ManyToManyField(Recipient, verbose_name="Получатели")
     owner = models.ForeignKey("users.CustomUser", on_delete=models.CASCADE, verbose_name="Владелец", default=2)
+    # Процесс, который отправляет рассылку, и срок его захвата (postpilot.leases)
+    claimed_by = models.CharField("Отправляющий процесс", max_length=100, blank=True, default="", editable=False)
+    lease_until = models.DateTimeField("Захвачена до", blank=True, null=True, editable=False)
 
     def __str__(self):
         """Возвращает строковое представление объекта 'Рассылка'."""
@@ -82,6 +96,17 @@ class Mailing(models.Model):
         verbose_name = "Рассылка"
         verbose_name_plural = "Рассылки"
         ordering = ["-sent_completed_at"]
+        indexes = [
+            models.Index(fields=["status", "scheduled_at"], name="mailings_status_scheduled"),
+            models.Index(fields=["-sent_completed_at", "-id"], name="mailings_keyset"),
+            models.Index(fields=["owner", "-sent_completed_at", "-id"], name="mailings_owner_keyset"),
+            # Счётчики рассылок владельца по статусам
+            models.Index(fields=["owner", "status"], name="mailings_owner_status"),
+            # Активные рассылки (их немного, поэтому индекс маленький): счётчик и список на главной странице
+            models.Index(
+                fields=["owner", "-sent_completed_at", "-id"], condition=Q(status="started"), name="mailings_started"
+            ),
+        ]
 
         permissions = [
             ("disable_mailing", "Can disable mailings"),
@@ -101,6 +126,9 @@ class SendAttempt(models.Model):
     status = models.CharField("Статус отправки", max_length=12, choices=STATUS_CHOICES, default="failed")
     response = models.TextField("Ответ сервера", blank=True)
     mailing = models.ForeignKey(Mailing, on_delete=models.CASCADE, verbose_name="Рассылка")
+    recipient = models.ForeignKey(
+        Recipient, on_delete=models.SET_NULL, verbose_name="Получатель", blank=True, null=True
+    )  # Пусто для попыток уровня всей рассылки (нет получателей, ошибка соединения)
     owner = models.ForeignKey("users.CustomUser", on_delete=models.CASCADE, verbose_name="Владелец", default=2)
 
     def __str__(self):
@@ -117,3 +145,166 @@ class SendAttempt(models.Model):
         verbose_name = "Попытка отправки"
         verbose_name_plural = "Попытки отправки"
         ordering = ["-attempt_at"]
+        indexes = [
+            models.Index(fields=["-attempt_at", "-id"], name="send_attempts_keyset"),
+            models.Index(fields=["owner", "-attempt_at", "-id"], name="send_attempts_owner_keyset"),
+            # Счётчики попыток владельца по статусам (читаются только из индекса)
+            models.Index(fields=["owner", "status"], name="send_attempts_owner_status"),
+            # Счётчики всех попыток по статусам (менеджеры): читаются только из индекса, без чтения таблицы
+            models.Index(fields=["status", "id"], name="send_attempts_status"),
+            # Попытки отправки рассылки по времени
+            models.Index(fields=["mailing", "-attempt_at"], name="send_attempts_mailing_time"),
+        ]
+
+
+# -- SendAttemptArchive model --
+class SendAttemptArchive(models.Model):
+    """Класс архива попыток отправки. Модель 'Архив попыток отправки'. Одна строка - часть сжатых попыток рассылки
+    за один месяц, перенесённая из рабочей таблицы одной пачкой (./manage.py compact_attempts)."""
+
+    mailing = models.ForeignKey(
+        Mailing, on_delete=models.CASCADE, verbose_name="Рассылка", related_name="attempt_archives"
+    )
+    owner = models.ForeignKey("users.CustomUser", on_delete=models.CASCADE, verbose_name="Владелец")
+    month = models.DateField("Месяц")  # Первое число месяца попыток
+    seq = models.PositiveBigIntegerField("Часть")  # id первой попытки части: порядок частей месяца
+    first_attempt_at = models.DateTimeField("Первая попытка")
+    last_attempt_at = models.DateTimeField("Последняя попытка")
+    attempts = models.PositiveIntegerField("Попыток")
+    data = models.BinaryField("Попытки")  # JSON, сжатый zlib (postpilot.archive)
+
+    def __str__(self):
+        """Возвращает строковое представление объекта 'Архив попыток отправки'."""
+        return f"{self.mailing_id}: {self.month:%Y-%m} ({self.attempts})"
+
+    class Meta:
+        """
+        Класс метаданных 'Архив попыток отправки'.
+        """
+
+        db_table = "send_attempt_archives"
+        verbose_name = "Архив попыток отправки"
+        verbose_name_plural = "Архив попыток отправки"
+        ordering = ["-last_attempt_at"]
+        indexes = [
+            models.Index(fields=["owner", "month"], name="attempt_archives_owner_month"),
+        ]
+        constraints = [
+            # Части архива рассылки по месяцам (postpilot.archive); индекс ограничения служит и для чтения
+            models.UniqueConstraint(fields=["mailing", "month", "seq"], name="attempt_archives_mailing_month_seq"),
+        ]
+
+
+# -- SendAttemptSummary model --
+class SendAttemptSummary(models.Model):
+    """Класс итогов архивных попыток отправки рассылки. Модель 'Итоги архивных попыток'."""
+
+    mailing = models.OneToOneField(
+        Mailing, on_delete=models.CASCADE, verbose_name="Рассылка", related_name="attempt_summary"
+    )
+    owner = models.ForeignKey("users.CustomUser", on_delete=models.CASCADE, verbose_name="Владелец")
+    attempts = models.PositiveIntegerField("Попыток", default=0)
+    successful = models.PositiveIntegerField("Успешных", default=0)
+    failed = models.PositiveIntegerField("Неудачных", default=0)
+    first_attempt_at = models.DateTimeField("Первая попытка", blank=True, null=True)
+    last_attempt_at = models.DateTimeField("Последняя попытка", blank=True, null=True)
+
+    def __str__(self):
+        """Возвращает строковое представление объекта 'Итоги архивных попыток'."""
+        return f"{self.mailing_id}: {self.successful}/{self.attempts}"
+
+    class Meta:
+        """
+        Класс метаданных 'Итоги архивных попыток'.
+        """
+
+        db_table = "send_attempt_summaries"
+        verbose_name = "Итоги архивных попыток"
+        verbose_name_plural = "Итоги архивных попыток"
+
+
+# -- MailingJob model --
+class MailingJob(models.Model):
+    """Класс задания на отправку рассылки. Модель 'Задание очереди отправки'."""
+
+    STATUS_CHOICES = [
+        ("queued", "В очереди"),
+        ("running", "Выполняется"),
+        ("done", "Выполнено"),
+        ("failed", "Ошибка"),
+    ]
+
+    mailing = models.ForeignKey(Mailing, on_delete=models.CASCADE, verbose_name="Рассылка", related_name="jobs")
+    status = models.CharField("Статус задания", max_length=7, default="queued", choices=STATUS_CHOICES)
+    created_at = models.DateTimeField("Дата постановки в очередь", auto_now_add=True)
+    started_at = models.DateTimeField("Дата начала выполнения", blank=True, null=True)
+    finished_at = models.DateTimeField("Дата окончания выполнения", blank=True, null=True)
+    worker = models.CharField("Обработчик", max_length=100, blank=True)
+    error = models.TextField("Ошибка", blank=True)
+    # Пока SMTP-сервер недоступен, задание откладывается до этого времени
+    run_after = models.DateTimeField("Не выполнять до", blank=True, null=True)
+
+    def __str__(self):
+        """Возвращает строковое представление объекта 'Задание очереди отправки'."""
+        return f"{self.mailing_id}: {self.status}"
+
+    class Meta:
+        """
+        Класс метаданных 'Задание очереди отправки'.
+        """
+
+        db_table = "mailing_jobs"
+        verbose_name = "Задание на отправку"
+        verbose_name_plural = "Задания на отправку"
+        ordering = ["created_at"]
+        constraints = [
+            # У рассылки не больше одного незавершённого задания
+            models.UniqueConstraint(
+                fields=["mailing"], condition=Q(status__in=["queued", "running"]), name="mailing_jobs_one_active"
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["status", "created_at"], name="mailing_jobs_status_created"),
+        ]
+
+
+# -- Delivery model --
+class Delivery(models.Model):
+    """Класс доставки письма рассылки одному получателю. Модель 'Доставка'. Журнал доставки позволяет продолжить
+    прерванную рассылку с первого получателя, которому письмо ещё не отправлено, и повторить отправку тем,
+    кому письмо не ушло из-за временной ошибки."""
+
+    STATUS_CHOICES = [
+        ("pending", "Ожидает отправки"),
+        ("sent", "Отправлено"),
+        ("deferred", "Ожидает повтора"),
+        ("failed", "Ошибка"),
+    ]
+
+    mailing = models.ForeignKey(Mailing, on_delete=models.CASCADE, verbose_name="Рассылка", related_name="deliveries")
+    recipient = models.ForeignKey(Recipient, on_delete=models.CASCADE, verbose_name="Получатель")
+    status = models.CharField("Статус доставки", max_length=8, default="pending", choices=STATUS_CHOICES)
+    attempts = models.PositiveSmallIntegerField("Попыток отправки", default=0)
+    next_attempt_at = models.DateTimeField("Дата следующей попытки", null=True, blank=True)
+    last_error = models.TextField("Последняя ошибка", blank=True, default="")
+    updated_at = models.DateTimeField("Дата изменения", auto_now=True)
+
+    def __str__(self):
+        """Возвращает строковое представление объекта 'Доставка'."""
+        return f"{self.mailing_id} -> {self.recipient_id}: {self.status}"
+
+    class Meta:
+        """
+        Класс метаданных 'Доставка'.
+        """
+
+        db_table = "deliveries"
+        verbose_name = "Доставка"
+        verbose_name_plural = "Доставки"
+        constraints = [
+            models.UniqueConstraint(fields=["mailing", "recipient"], name="deliveries_mailing_recipient_unique"),
+        ]
+        indexes = [
+            models.Index(fields=["mailing", "status", "recipient"], name="deliveries_mailing_status_rcpt"),
+            models.Index(fields=["status", "next_attempt_at"], name="deliveries_status_next_attempt"),
+        ]
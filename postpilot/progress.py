@@ -0,0 +1,91 @@
+"""
+Прогресс отправки рассылок.
+Во время отправки счётчики отправленных, неудачных и отложенных писем рассылки увеличиваются в кэше после каждой
+пачки (cache.incr, поэтому счётчики общие для всех процессов, отправляющих рассылку). Скорость отправки считается
+по посекундным счётчикам за последние RATE_WINDOW секунд. Страница прогресса (JSON, её опрашивает список
+рассылок) читает только кэш и не обращается к БД.
+"""
+
+import time
+
+from django.core.cache import cache
+
+from postpilot.models import Mailing
+
+# Ключ кэша с прогрессом рассылки и время его хранения после последнего обновления, с
+PROGRESS_KEY = "postpilot:progress:{}"
+PROGRESS_TIMEOUT = 24 * 3600
+# За сколько последних полных секунд считается скорость отправки
+RATE_WINDOW = 5
+
+
+def start_progress(mailing: Mailing, totals: dict):
+    """Записывает прогресс рассылки в начале отправки по итогам журнала доставки (totals - delivery_totals)."""
+    key = PROGRESS_KEY.format(mailing.pk)
+    cache.set_many(
+        {
+            f"{key}:owner": mailing.owner_id,
+            f"{key}:status": mailing.status,
+            f"{key}:total": sum(totals.values()),
+            f"{key}:sent": totals["sent"],
+            f"{key}:failed": totals["failed"],
+            f"{key}:deferred": totals["deferred"],
+        },
+        PROGRESS_TIMEOUT,
+    )
+
+
+def publish_status(mailing: Mailing):
+    """Обновляет статус рассылки в прогрессе (если прогресс рассылки есть в кэше)."""
+    key = PROGRESS_KEY.format(mailing.pk)
+    if cache.get(f"{key}:total") is not None:
+        cache.set(f"{key}:status", mailing.status, PROGRESS_TIMEOUT)
+
+
+def record_progress(mailing_id: int, sent: int = 0, failed: int = 0, deferred: int = 0):
+    """
+    Учитывает результаты отправки пачки: сколько писем отправлено, не отправлено и отложено на повтор.
+    Если прогресса рассылки нет в кэше (например, истёк), ничего не делает.
+    """
+    counts = {"sent": sent, "failed": failed, "deferred": deferred}
+
+    key = PROGRESS_KEY.format(mailing_id)
+    try:
+        for name, count in counts.items():
+            if count:
+                cache.incr(f"{key}:{name}", count)
+    except ValueError:
+        return
+
+    second = f"{key}:second:{int(time.time())}"
+    cache.add(second, 0, RATE_WINDOW * 2)
+    cache.incr(second, sent + failed + deferred)
+
+
+def retry_progress(mailing_id: int, count: int):
+    """Учитывает, что count отложенных писем рассылки снова отправляются (их результат учтёт record_progress)."""
+    try:
+        cache.decr(f"{PROGRESS_KEY.format(mailing_id)}:deferred", count)
+    except ValueError:
+        pass
+
+
+def get_progress(mailing_id: int) -> dict | None:
+    """
+    Прогресс рассылки: статус, всего писем, отправлено, ошибок, ожидают повтора, осталось и скорость (писем/с).
+    Одно чтение из кэша. Возвращает None, если прогресса рассылки в кэше нет.
+    """
+    key = PROGRESS_KEY.format(mailing_id)
+    current = int(time.time())
+    seconds = [f"{key}:second:{second}" for second in range(current - RATE_WINDOW, current)]
+    names = ["owner", "status", "total", "sent", "failed", "deferred"]
+
+    values = cache.get_many([f"{key}:{name}" for name in names] + seconds)
+    if f"{key}:total" not in values:
+        return None
+
+    progress = {name: values.get(f"{key}:{name}", 0) for name in names}
+    progress["mailing"] = mailing_id
+    progress["remaining"] = max(0, progress["total"] - progress["sent"] - progress["failed"])
+    progress["rate"] = round(sum(values.get(second, 0) for second in seconds) / RATE_WINDOW, 1)
+    return progress
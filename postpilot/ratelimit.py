@@ -0,0 +1,183 @@
+"""
+Ограничение скорости отправки писем (token bucket).
+Состояние корзин хранится в кэше Django, поэтому лимит общий для всех процессов-обработчиков.
+Есть корзина на SMTP-хост (MAILING_RATE_PER_HOST) и, при необходимости, на владельца рассылки
+(MAILING_RATE_PER_OWNER). Когда сервер отвечает 421/451 (просит притормозить), корзина хоста уходит в минус
+и все обработчики делают паузу.
+"""
+
+import asyncio
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# Коды ответа, которыми SMTP-сервер сообщает, что отправитель превысил допустимую скорость
+THROTTLE_CODES = (421, 451)
+
+
+class TokenBucket:
+    """
+    Корзина токенов в кэше: rate токенов в секунду, не больше burst токенов в запасе.
+    Состояние (количество токенов, время обновления) изменяется под коротким замком в кэше (cache.add),
+    чтобы процессы не перезаписывали изменения друг друга.
+    """
+
+    lock_timeout = 1  # Секунд: замок освобождается сам, если процесс упал, не отпустив его
+
+    def __init__(self, key: str, rate: float, burst: int):
+        self.key = key
+        self.rate = rate
+        self.burst = max(1, burst)
+
+    def take(self, tokens: int) -> float:
+        """
+        Пытается забрать tokens токенов. Возвращает 0, если токены получены, иначе - сколько секунд нужно
+        подождать до их появления.
+        """
+        with self._lock():
+            now = time.time()
+            available, updated_at = cache.get(self.key, (self.burst, now))
+            available = min(self.burst, available + (now - updated_at) * self.rate)
+
+            if available >= tokens:
+                cache.set(self.key, (available - tokens, now), None)
+                return 0.0
+
+            cache.set(self.key, (available, now), None)
+            return (tokens - available) / self.rate
+
+    def pause(self, seconds: float):
+        """Опустошает корзину так, чтобы новые токены появились не раньше чем через seconds секунд."""
+        with self._lock():
+            cache.set(self.key, (-seconds * self.rate, time.time()), None)
+
+    def _lock(self):
+        return _CacheLock(f"{self.key}:lock", self.lock_timeout)
+
+
+class _CacheLock:
+    """Замок в кэше на основе атомарного cache.add. Если замок не удаётся взять за timeout, работа продолжается
+    без него: лучше на мгновение превысить лимит, чем остановить отправку."""
+
+    def __init__(self, key: str, timeout: float):
+        self.key = key
+        self.timeout = timeout
+        self.acquired = False
+
+    def __enter__(self):
+        deadline = time.monotonic() + self.timeout
+        while not cache.add(self.key, 1, self.timeout):
+            if time.monotonic() >= deadline:
+                return self
+            time.sleep(0.001)
+        self.acquired = True
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.acquired:
+            cache.delete(self.key)
+
+
+class RateLimiter:
+    """
+    Ограничитель скорости отправки одной рассылки: письмо уходит, только когда получен токен из каждой корзины.
+    Токены забираются из кэша порциями по reserve штук и раздаются локально, чтобы не обращаться к кэшу
+    на каждое письмо.
+    """
+
+    def __init__(self, buckets: list, host_bucket: TokenBucket = None, reserve: int = None):
+        self.buckets = buckets
+        self.host_bucket = host_bucket
+        self.reserve = reserve or settings.MAILING_RATE_RESERVE
+        self._tokens = {bucket.key: 0 for bucket in buckets}
+        self._async_lock = None
+
+    def reserve_one(self) -> float:
+        """Забирает токен на одно письмо. Возвращает 0 или время ожидания в секундах, если токенов пока нет."""
+        for bucket in self.buckets:
+            if self._tokens[bucket.key] > 0:
+                continue
+
+            wait = bucket.take(min(self.reserve, bucket.burst))
+            if wait:
+                # Порцию сразу не дают - пробуем взять хотя бы один токен
+                wait = bucket.take(1)
+                if wait:
+                    return wait
+                self._tokens[bucket.key] = 1
+            else:
+                self._tokens[bucket.key] = min(self.reserve, bucket.burst)
+
+        for bucket in self.buckets:
+            self._tokens[bucket.key] -= 1
+        return 0.0
+
+    def wait(self):
+        """Блокирует выполнение, пока не будет получен токен на одно письмо."""
+        while wait := self.reserve_one():
+            time.sleep(wait)
+
+    async def wait_async(self):
+        """
+        То же, что wait, для сессий asyncio. Пока есть токены, полученные заранее, токен выдаётся сразу; обращения
+        к кэшу (замок корзины, чтение и запись её состояния) выполняются в отдельном потоке, а ожидание токенов -
+        через asyncio.sleep, поэтому цикл событий и остальные сессии не блокируются. Сессии получают токены
+        по очереди, чтобы не обращаться к кэшу одновременно.
+        """
+        if self._async_lock is None:
+            self._async_lock = asyncio.Lock()
+
+        async with self._async_lock:
+            if self._take_reserved():
+                return
+            while wait := await asyncio.to_thread(self.reserve_one):
+                await asyncio.sleep(wait)
+
+    def _take_reserved(self) -> bool:
+        """Выдаёт токен из полученных заранее, без обращения к кэшу. Возвращает False, если их не хватает."""
+        if not all(count > 0 for count in self._tokens.values()):
+            return False
+        for key in self._tokens:
+            self._tokens[key] -= 1
+        return True
+
+    def throttled(self, code: int):
+        """Реакция на ответ сервера: при 421/451 приостанавливает отправку на SMTP-хост во всех процессах."""
+        if code in THROTTLE_CODES and self.host_bucket is not None:
+            logger.warning(f"SMTP-сервер ограничивает скорость (код {code}), пауза отправки.")
+            self.host_bucket.pause(settings.MAILING_RATE_THROTTLE_PAUSE)
+            self._tokens[self.host_bucket.key] = 0
+
+    async def throttled_async(self, code: int):
+        """То же, что throttled, для сессий asyncio: пауза записывается в кэш в отдельном потоке."""
+        if code in THROTTLE_CODES and self.host_bucket is not None:
+            await asyncio.to_thread(self.throttled, code)
+
+
+def build_rate_limiter(mailing) -> RateLimiter:
+    """Собирает ограничитель скорости для рассылки по настройкам. Лимит, равный 0, отключает корзину."""
+    buckets = []
+    host_bucket = None
+
+    if settings.MAILING_RATE_PER_HOST > 0:
+        host_bucket = TokenBucket(
+            f"postpilot:ratelimit:host:{settings.EMAIL_HOST}",
+            settings.MAILING_RATE_PER_HOST,
+            settings.MAILING_BURST_PER_HOST,
+        )
+        buckets.append(host_bucket)
+
+    if settings.MAILING_RATE_PER_OWNER > 0:
+        buckets.append(
+            TokenBucket(
+                f"postpilot:ratelimit:owner:{mailing.owner_id}",
+                settings.MAILING_RATE_PER_OWNER,
+                settings.MAILING_BURST_PER_OWNER,
+            )
+        )
+
+    return RateLimiter(buckets, host_bucket=host_bucket)
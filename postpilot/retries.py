@@ -0,0 +1,40 @@
+"""
+Политика повторной отправки писем.
+Ошибки делятся на временные (ответ сервера 4xx, обрыв или таймаут соединения) и постоянные (ответ 5xx).
+Письмо, не ушедшее из-за временной ошибки, откладывается и повторяется с экспоненциально растущей паузой
+со случайным разбросом, чтобы повторы разных получателей не приходили на сервер одновременно.
+После MAILING_RETRY_MAX_ATTEMPTS попыток письмо считается неотправленным.
+"""
+
+import random
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.utils.timezone import now
+
+
+def is_transient(code: int | None) -> bool:
+    """Временная ли ошибка с кодом ответа SMTP-сервера code: при ответах 4xx отправку стоит повторить позже."""
+    return code is not None and 400 <= code < 500
+
+
+def failure_status(code: int | None) -> str:
+    """Статус результата отправки по коду ошибки: 'deferred' - повторить позже, 'failed' - не повторять."""
+    return "deferred" if is_transient(code) else "failed"
+
+
+def retry_delay(attempts: int) -> float:
+    """
+    Пауза в секундах перед следующей попыткой после attempts неудачных попыток: базовая пауза удваивается
+    с каждой попыткой (не больше MAILING_RETRY_MAX_DELAY), фактическая пауза выбирается случайно
+    в диапазоне от половины до полной величины.
+    """
+    delay = min(settings.MAILING_RETRY_MAX_DELAY, settings.MAILING_RETRY_BASE_DELAY * 2 ** max(0, attempts - 1))
+    return random.uniform(delay / 2, delay)
+
+
+def next_attempt_at(attempts: int) -> datetime | None:
+    """Время следующей попытки после attempts неудачных попыток или None, если попытки исчерпаны."""
+    if attempts >= settings.MAILING_RETRY_MAX_ATTEMPTS:
+        return None
+    return now() + timedelta(seconds=retry_delay(attempts))
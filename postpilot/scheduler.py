@@ -0,0 +1,109 @@
+"""
+Планировщик отложенных рассылок.
+Держит в памяти кучу (heapq) рассылок, время отправки которых (scheduled_at) наступит в ближайшие
+MAILING_SCHEDULER_LOOKAHEAD секунд, и ставит каждую рассылку в очередь (enqueue_mailing) в момент её отправки.
+Куча обновляется раз в MAILING_SCHEDULER_REFRESH секунд запросом по индексу (status, scheduled_at), который
+читает только рассылки из окна упреждения, а не всю таблицу рассылок.
+"""
+
+import heapq
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils.timezone import now
+
+from core.cache import invalidate_owner
+from postpilot.jobs import enqueue_mailing
+from postpilot.models import Mailing
+from postpilot.services import resume_mailing
+
+logger = logging.getLogger(__name__)
+
+# Статусы, в которых рассылку можно запланировать: начатую рассылку планировщик не трогает
+SCHEDULABLE_STATUSES = ("created", "completed", "broken")
+
+
+class MailingScheduler:
+    """
+    Куча пар (время отправки, id рассылки). Если время отправки рассылки изменили, в кучу добавляется новая пара,
+    а старая отбрасывается при извлечении (по словарю known с актуальным временем каждой рассылки).
+    """
+
+    def __init__(self, lookahead: float = None, refresh_interval: float = None):
+        self.lookahead = lookahead if lookahead is not None else settings.MAILING_SCHEDULER_LOOKAHEAD
+        self.refresh_interval = (
+            refresh_interval if refresh_interval is not None else settings.MAILING_SCHEDULER_REFRESH
+        )
+        self.heap = []
+        self.known = {}
+        self.refreshed_at = None
+
+    def refresh(self):
+        """
+        Добавляет в кучу рассылки, запланированные до конца окна упреждения (включая просроченные). Рассылки,
+        которые удалили, начали или перенесли за окно упреждения, забываются: их пары в куче будут отброшены.
+        """
+        horizon = now() + timedelta(seconds=self.lookahead)
+        scheduled = dict(
+            Mailing.objects.filter(status__in=SCHEDULABLE_STATUSES, scheduled_at__lte=horizon).values_list(
+                "pk", "scheduled_at"
+            )
+        )
+
+        for pk, scheduled_at in scheduled.items():
+            if self.known.get(pk) != scheduled_at:
+                heapq.heappush(self.heap, (scheduled_at, pk))
+        self.known = scheduled
+
+        # Если устаревших пар в куче стало больше, чем актуальных, пересобираем кучу
+        if len(self.heap) > 2 * len(self.known):
+            self.heap = [(scheduled_at, pk) for pk, scheduled_at in self.known.items()]
+            heapq.heapify(self.heap)
+
+        self.refreshed_at = now()
+
+    def dispatch_due(self) -> list:
+        """
+        Ставит в очередь рассылки, время отправки которых наступило. Возвращает id поставленных рассылок.
+        Рассылка захватывается условным UPDATE (scheduled_at сбрасывается, только если его не изменили и
+        рассылку не начали), поэтому несколько планировщиков не поставят одну рассылку в очередь дважды.
+        """
+        dispatched = []
+        current = now()
+
+        while self.heap and self.heap[0][0] <= current:
+            scheduled_at, pk = heapq.heappop(self.heap)
+            if self.known.get(pk) != scheduled_at:
+                continue  # Время отправки изменили после добавления в кучу
+            del self.known[pk]
+
+            claimed = Mailing.objects.filter(pk=pk, status__in=SCHEDULABLE_STATUSES, scheduled_at=scheduled_at).update(
+                scheduled_at=None
+            )
+            if not claimed:
+                continue
+
+            mailing = Mailing.objects.get(pk=pk)
+            invalidate_owner(mailing.owner_id, Mailing)  # UPDATE не отправляет post_save
+            resume_mailing(mailing)  # Отправку по расписанию назначил пользователь - это явный запуск
+            enqueue_mailing(mailing)
+            logger.info(f"Рассылка {pk}, запланированная на {scheduled_at}, поставлена в очередь.")
+            dispatched.append(pk)
+
+        return dispatched
+
+    def seconds_until_next(self) -> float:
+        """Сколько секунд можно ждать до ближайшего события: отправки рассылки из кучи или обновления кучи."""
+        wait = self.refresh_interval
+        if self.refreshed_at is not None:
+            wait -= (now() - self.refreshed_at).total_seconds()
+        if self.heap:
+            wait = min(wait, (self.heap[0][0] - now()).total_seconds())
+        return max(0.0, wait)
+
+    def tick(self) -> list:
+        """Один шаг планировщика: при необходимости обновляет кучу и ставит в очередь наступившие рассылки."""
+        if self.refreshed_at is None or (now() - self.refreshed_at).total_seconds() >= self.refresh_interval:
+            self.refresh()
+        return self.dispatch_due()
@@ -2,185 +2,731 @@
 Сервис по отправке писем через SMTP.
 """
 
+import asyncio
 import logging
-import os
+import smtplib
+import threading
+import time
+from datetime import timedelta
 
-from django.core.mail import send_mail
+from django.conf import settings
+from django.core.cache import cache
+from django.core.mail import EmailMessage, get_connection
+from django.core.mail.backends.smtp import EmailBackend as SMTPEmailBackend
+from django.core.mail.message import make_msgid, sanitize_address
+from django.core.mail.utils import DNS_NAME
+from django.db import transaction
+from django.db.models import Count, F
 from django.utils.timezone import now
-from dotenv import load_dotenv
 
-from postpilot.models import Mailing, SendAttempt
+from postpilot.attempts import AttemptWriter, create_attempt
+from postpilot.breaker import RelayUnavailable, build_circuit_breaker
+from postpilot.concurrency import build_concurrency_controller
+from postpilot.leases import MailingBusy, MailingLease
+from postpilot.models import Delivery, Mailing
+from postpilot.progress import publish_status, record_progress, retry_progress, start_progress
+from postpilot.ratelimit import RateLimiter, build_rate_limiter
+from postpilot.retries import failure_status, next_attempt_at
+from postpilot.smtp_async import AsyncSMTPPool
 
 logger = logging.getLogger(__name__)
 
-load_dotenv()
-
-
-# def send_mailing(mailing: Mailing):
-#     """
-#     Отправляет письма всем получателям указанной рассылки.
-#     Обновляет статус рассылки и фиксирует попытки отправки.
-#     Чтобы от сервера SMTP получить индивидуальные ответы для каждого получателя, используется smtplib
-#     """
-#
-#     # Переводим статус рассылки в состояние 'started'
-#     mailing.status = "started"
-#     mailing.first_sent_at = now()
-#     mailing.save(update_fields=["status", "first_sent_at"])
-#
-#     # Генерим список получателей
-#     recipients = mailing.recipients.all()
-#     recipient_list = [recipient.email for recipient in recipients]
-#
-#     # Если список получателей пуст, то пишем предупреждение в лог и в БД
-#     if not recipient_list:
-#         logger.warning(f"Рассылка {mailing.id} не имеет получателей!")
-#         SendAttempt.objects.create(
-#             mailing=mailing,
-#             status="failed",
-#             response="Рассылка не имеет получателей.",
-#         )
-#         return
-#
-#     # Настройки SMTP
-#     smtp_host = os.getenv("EMAIL_HOST")
-#     smtp_port = int(os.getenv("EMAIL_PORT", 587))
-#     smtp_user = os.getenv("EMAIL_HOST_USER")
-#     smtp_password = os.getenv("EMAIL_HOST_PASSWORD")
-#
-#     try:
-#         # Используем контекстный менеджер для автоматического закрытия соединения
-#         with smtplib.SMTP(smtp_host, smtp_port) as server:
-#             server.connect(smtp_host, smtp_port)
-#             server.starttls()
-#             server.login(smtp_user, smtp_password)
-#
-#             responses = []
-#
-#             # Для каждого получателя из списка:
-#             for recipient in recipient_list:
-#                 try:
-#                     # Формируем письмо
-#                     msg = MIMEMultipart()
-#                     msg["Subject"] = mailing.message.subject
-#                     msg["From"] = smtp_user
-#                     msg["To"] = recipient  # ОДИН получатель в письме
-#                     msg.attach(MIMEText(mailing.message.body_text, "plain"))
-#
-#                     response = server.sendmail(smtp_user, recipient, msg.as_string())
-#
-#                     # Если `response` пустой, значит, письмо отправлено успешно
-#                     if not response:
-#                         response_text = "Успешно отправлено"
-#                         status = "successfully"
-#                     else:
-#                         response_text = f"Ошибка отправки: {response}"
-#                         status = "failed"
-#
-#                 # Если ошибка соединения или отправки
-#                 except smtplib.SMTPException as e:
-#                     response_text = f"Ошибка SMTP: {str(e)}"
-#                     status = "failed"
-#
-#                 # Логируем и сохраняем попытку отправки
-#                 logger.info(f"Письмо на {recipient}: {response_text}")
-#                 SendAttempt.objects.create(
-#                     mailing=mailing,
-#                     status=status,
-#                     response=f"{recipient}: {response_text}",
-#                 )
-#
-#                 responses.append(f"{recipient}: {response_text}")
-#
-#         # Если сервер отработал без исключений, помечаем рассылку как завершённую
-#         mailing.status = "completed"
-#         mailing.sent_completed_at = now()
-#         logger.info(f"Рассылка {mailing.id} завершена.")
-#
-#     # Если сервер упал, логируем и записываем ошибку в БД
-#     except Exception as e:
-#         mailing.status = "broken"
-#         # logger.debug(f"Ошибка при отправке рассылки {mailing.id}: {e}")
-#         logger.exception(f"Ошибка при отправке рассылки {mailing.id}: {e}")
-#
-#         SendAttempt.objects.create(
-#             mailing=mailing,
-#             status="failed",
-#             response=f"Общая ошибка: {e}",
-#         )
-#
-#     # Если всё норм, обновляем статус и время окончания рассылки
-#     finally:
-#         mailing.save(update_fields=["status", "sent_completed_at"])
-
-
-def send_mailing(mailing: Mailing):
-    """
-    Отправляет письма всем получателям указанной рассылки.
-    Использует django.core.mail.send_mail для отправки.
-    Обновляет статус рассылки и фиксирует попытки отправки.
-    """
-
-    # Переводим статус рассылки в состояние 'started'
+# Запрос остановки процесса (устанавливается обработчиком SIGTERM): отправка прерывается после текущей пачки
+shutdown_requested = threading.Event()
+
+# Ключ кэша с запросом остановки рассылки пользователем и время его хранения, с
+CANCEL_KEY = "postpilot:cancel:{}"
+CANCEL_TIMEOUT = 24 * 3600
+
+
+class DeliveryInterrupted(Exception):
+    """Отправка рассылки остановлена между пачками по запросу остановки процесса."""
+
+
+class DeliveryCancelled(Exception):
+    """Отправка рассылки остановлена между пачками по запросу пользователя."""
+
+
+def start_mailing(mailing: Mailing):
+    """
+    Переводит рассылку в состояние 'started' и фиксирует время первой отправки. Запрос остановки не снимается:
+    задание, вернувшееся в очередь, не должно возобновлять остановленную рассылку (см. resume_mailing).
+    """
     mailing.status = "started"
     mailing.first_sent_at = now()
     mailing.save(update_fields=["status", "first_sent_at"])
 
-    # Генерируем список получателей
-    recipients = mailing.recipients.all()
-    recipient_list = [recipient.email for recipient in recipients]
+
+def resume_mailing(mailing: Mailing):
+    """
+    Снимает запрос остановки рассылки. Вызывается только при явном запуске рассылки пользователем (кнопка отправки,
+    наступившее время отправки по расписанию, ./manage.py send_mailing --mailing-id).
+    """
+    cache.delete(CANCEL_KEY.format(mailing.pk))
+
+
+def cancel_requested(mailing: Mailing) -> bool:
+    """Остановил ли пользователь рассылку (cancel_mailing) после последнего явного запуска."""
+    return bool(cache.get(CANCEL_KEY.format(mailing.pk)))
+
+
+def cancel_mailing(mailing: Mailing):
+    """
+    Останавливает рассылку по запросу пользователя: переводит её в состояние 'broken' и выставляет флаг остановки
+    в кэше. Процесс, который отправляет рассылку, проверяет флаг после каждой пачки и прекращает отправку.
+    Неотправленные письма остаются в журнале доставки, и повторный запуск продолжит рассылку с места остановки.
+    """
+    mailing.status = "broken"
+    mailing.save(update_fields=["status"])
+    cache.set(CANCEL_KEY.format(mailing.pk), True, CANCEL_TIMEOUT)
+    publish_status(mailing)
+
+
+def prepare_deliveries(mailing: Mailing):
+    """
+    Готовит журнал доставки рассылки перед отправкой. Вызывается до start_mailing.
+    Если рассылка была прервана (статус 'started' после падения процесса или 'broken'), журнал сохраняется и
+    отправка продолжится с первого получателя, которому письмо ещё не ушло, а отложенные письма будут повторены
+    в свой срок. Иначе (новая или повторная отправка) все записи журнала сбрасываются в 'pending'.
+    В журнал добавляются получатели, включённые в рассылку после прошлой отправки, и удаляются исключённые из неё.
+    """
+    if mailing.status not in ("started", "broken"):
+        mailing.deliveries.exclude(status="pending").update(
+            status="pending", attempts=0, next_attempt_at=None, last_error="", updated_at=now()
+        )
+
+    mailing.deliveries.exclude(recipient__in=mailing.recipients.all()).delete()
+
+    # id получателей читаются потоком и вносятся в журнал пачками, память не зависит от размера рассылки
+    fetch_size = settings.MAILING_FETCH_SIZE
+    recipient_ids = mailing.recipients.values_list("pk", flat=True).iterator(chunk_size=fetch_size)
+    for batch in _batches(recipient_ids, fetch_size):
+        Delivery.objects.bulk_create(
+            [Delivery(mailing=mailing, recipient_id=recipient_id) for recipient_id in batch],
+            ignore_conflicts=True,  # Уже внесённые в журнал получатели сохраняют свой статус
+        )
+
+
+def delivery_totals(mailing: Mailing) -> dict:
+    """
+    Возвращает количество отправленных, неудачных, ожидающих отправки и ожидающих повтора писем рассылки
+    по журналу доставки.
+    """
+    totals = {"sent": 0, "failed": 0, "pending": 0, "deferred": 0}
+    for status, count in mailing.deliveries.values_list("status").annotate(count=Count("pk")).order_by():
+        totals[status] = count
+    return totals
+
+
+def finish_mailing(mailing: Mailing, sent_count: int, failed_count: int):
+    """
+    Завершает рассылку по итогам отправки: если хотя бы одно письмо ушло, рассылка считается завершённой,
+    иначе - прерванной.
+    """
+    if sent_count > 0:
+        mailing.status = "completed"
+    else:
+        mailing.status = "broken"  # Если не отправлено ни одного письма, это считается прерыванием
+
+    logger.info(f"Рассылка {mailing.id}: отправлено {sent_count}, ошибок {failed_count}")
+    mailing.save(update_fields=["status", "sent_completed_at"])
+    publish_status(mailing)
+
+
+def complete_mailing(mailing: Mailing) -> dict:
+    """
+    Завершает рассылку по журналу доставки, если в нём не осталось писем, ожидающих отправки или повторной
+    отправки. Пока такие письма есть, рассылка остаётся в состоянии 'started' и завершится после последнего
+    повтора (или продолжится при следующем запуске, если часть получателей не обработана).
+    Возвращает итоги журнала доставки.
+    """
+    totals = delivery_totals(mailing)
+    if totals["pending"] or totals["deferred"]:
+        logger.info(
+            f"Рассылка {mailing.id}: {totals['pending']} писем ожидают отправки, "
+            f"{totals['deferred']} - повторной отправки."
+        )
+        return totals
+
+    finish_mailing(mailing, totals["sent"], totals["failed"])
+    return totals
+
+
+def record_cancellation(mailing: Mailing, totals: dict) -> dict:
+    """
+    Фиксирует остановку рассылки пользователем: записывает место остановки в SendAttempt. Рассылка уже в состоянии
+    'broken', неотправленные письма остаются в журнале доставки. totals - итоги журнала доставки до начала отправки.
+    Возвращает счётчики писем, отправленных с начала отправки, включая пачки прерванной части.
+    """
+    stopped = delivery_totals(mailing)
+    left = stopped["pending"] + stopped["deferred"]
+    logger.info(f"Отправка рассылки {mailing.id} остановлена пользователем, не отправлено {left} писем.")
+    create_attempt(
+        mailing=mailing,
+        status="broken",
+        response=(
+            f"Рассылка остановлена пользователем: отправлено {stopped['sent']}, ошибок {stopped['failed']}, "
+            f"не отправлено {left} писем."
+        ),
+        owner_id=mailing.owner_id,
+    )
+    return {"sent": stopped["sent"] - totals["sent"], "failed": stopped["failed"] - totals["failed"]}
+
+
+def build_message(mailing: Mailing, email: str, connection=None) -> EmailMessage:
+    """Формирует письмо рассылки для одного получателя (в поле To только его адрес)."""
+    return EmailMessage(
+        subject=mailing.message.subject,
+        body=mailing.message.body_text,
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=[email],
+        connection=connection,
+    )
+
+
+class PreparedMessage:
+    """
+    Письмо рассылки, сериализованное один раз на всю рассылку.
+    Заголовки и закодированное тело письма собираются пакетом email и переводятся в байты один раз, а для
+    каждого получателя к ним дописываются только его заголовки To и Message-ID. Так на каждое письмо не тратится
+    время на сборку MIME-объекта и его сериализацию.
+    """
+
+    def __init__(self, mailing: Mailing):
+        message = build_message(mailing, settings.DEFAULT_FROM_EMAIL).message()
+        del message["To"]
+        del message["Message-ID"]
+
+        self.mailing = mailing
+        self.encoding = settings.DEFAULT_CHARSET
+        self.from_email = sanitize_address(settings.DEFAULT_FROM_EMAIL, self.encoding)
+        self.data = message.as_bytes(linesep="\r\n")
+
+    def recipient_address(self, email: str) -> str:
+        """Адрес получателя в виде, пригодном для заголовка To и команды RCPT TO."""
+        return sanitize_address(email, self.encoding)
+
+    def render(self, email: str) -> bytes:
+        """Возвращает письмо для одного получателя в байтах (с переводами строк CRLF)."""
+        return (
+            f"To: {self.recipient_address(email)}\r\nMessage-ID: {make_msgid(domain=DNS_NAME)}\r\n".encode()
+            + self.data
+        )
+
+    def render_shared(self) -> bytes:
+        """
+        Возвращает письмо для отправки нескольким получателям одной транзакцией. Адреса получателей передаются
+        только в командах RCPT TO, а в заголовке To указано 'undisclosed-recipients:;', чтобы получатели
+        не видели адресов друг друга.
+        """
+        return f"To: undisclosed-recipients:;\r\nMessage-ID: {make_msgid(domain=DNS_NAME)}\r\n".encode() + self.data
+
+    def build(self, email: str, connection=None) -> EmailMessage:
+        """Возвращает письмо для одного получателя объектом EmailMessage (для бэкендов, отличных от SMTP)."""
+        return build_message(self.mailing, email, connection)
+
+
+def smtp_error_code(error: smtplib.SMTPException) -> int | None:
+    """Возвращает код ответа SMTP-сервера из исключения smtplib (для отказа в получателе - код по получателю)."""
+    if isinstance(error, smtplib.SMTPRecipientsRefused) and error.recipients:
+        return next(iter(error.recipients.values()))[0]
+    return getattr(error, "smtp_code", None)
+
+
+def send_batch(connection, prepared: PreparedMessage, emails: list, limiter: RateLimiter = None) -> list:
+    """
+    Отправляет пачку писем через уже открытое соединение бэкенда.
+    Для SMTP-бэкенда готовые байты письма передаются прямо в открытую SMTP-сессию бэкенда; для остальных бэкендов
+    каждое письмо передаётся в send_messages отдельно. Письма отправляются по одному, чтобы получить результат по
+    каждому получателю: SMTP-бэкенд Django при ошибке прерывает всю пачку и не сообщает, какие письма успели уйти.
+    Если передан limiter, перед каждым письмом ожидается токен ограничителя скорости.
+    Возвращает список троек (статус, ответ сервера, время отправки в секундах) в порядке писем. Статус
+    'successfully' - письмо принято сервером, 'deferred' - временная ошибка (повторить позже), 'failed' - постоянная.
+    """
+    results = []
+    raw = isinstance(connection, SMTPEmailBackend)
+
+    for email in emails:
+        if limiter is not None:
+            limiter.wait()
+
+        started_at = time.perf_counter()
+        try:
+            if raw:
+                connection.connection.sendmail(
+                    prepared.from_email, [prepared.recipient_address(email)], prepared.render(email)
+                )
+            else:
+                connection.send_messages([prepared.build(email, connection)])
+            results.append(("successfully", "Успешно отправлено", time.perf_counter() - started_at))
+
+        except smtplib.SMTPServerDisconnected as e:
+            # Сервер закрыл соединение - переоткрываем его, чтобы не потерять остаток пачки
+            results.append(("deferred", f"Ошибка SMTP: {e}", time.perf_counter() - started_at))
+            if not _reopen(connection, emails, results):
+                break
+
+        except smtplib.SMTPException as e:
+            code = smtp_error_code(e)
+            results.append((failure_status(code), f"Ошибка SMTP: {e}", time.perf_counter() - started_at))
+            if limiter is not None:
+                limiter.throttled(code)
+
+        except OSError as e:
+            # Таймаут или обрыв сокета - временная ошибка, соединение переоткрывается
+            results.append(("deferred", f"Ошибка соединения: {e!r}", time.perf_counter() - started_at))
+            if not _reopen(connection, emails, results):
+                break
+
+    return results
+
+
+def open_connection(connection):
+    """
+    Открывает соединение бэкенда через выключатель SMTP-сервера (если сервер недоступен - RelayUnavailable).
+    Уже открытое SMTP-соединение не трогает.
+    """
+    if isinstance(connection, SMTPEmailBackend) and connection.connection is not None:
+        return
+    with build_circuit_breaker().guard():
+        connection.open()
+
+
+def _reopen(connection, emails: list, results: list) -> bool:
+    """
+    Переоткрывает оборвавшееся соединение посреди пачки. Если сервер недоступен, оставшиеся письма пачки
+    откладываются, а соединение остаётся закрытым (следующая пачка не начнётся). Возвращает True, если соединение
+    открыто.
+    """
+    connection.close()
+    try:
+        open_connection(connection)
+    except RelayUnavailable as e:
+        results.extend(("deferred", str(e), 0.0) for _ in emails[len(results) :])
+        return False
+    return True
+
+
+def deliver(mailing: Mailing, recipients, connection=None, latencies: list = None, lease: MailingLease = None) -> dict:
+    """
+    Отправляет письма рассылки по одному на каждого получателя.
+    recipients - итерируемый набор пар (id получателя, email).
+    Движок отправки выбирается настройкой MAILING_ENGINE: "sync" - одно соединение бэкенда Django,
+    "async" - пул асинхронных SMTP-сессий (connection в этом случае не используется).
+    Результат по каждому получателю фиксируется в SendAttempt (записи копятся в AttemptWriter и сохраняются
+    пачками). Если передан список latencies,
+    в него добавляется время отправки каждого письма (используется при замерах скорости).
+    lease - захват рассылки процессом (postpilot.leases): продлевается после каждой пачки, а если его перехватил
+    другой процесс, отправка прекращается (MailingBusy).
+    Возвращает словарь со счётчиками отправленных и неудачных писем.
+    """
+    _check_shutdown(mailing)
+    if settings.MAILING_ENGINE == "async":
+        return deliver_async(mailing, recipients, latencies=latencies, lease=lease)
+
+    counters = {"sent": 0, "failed": 0}
+
+    own_connection = connection is None
+    if own_connection:
+        connection = get_connection(fail_silently=False)
+
+    open_connection(connection)
+    try:
+        prepared = PreparedMessage(mailing)
+        limiter = build_rate_limiter(mailing)
+        with AttemptWriter() as attempts:
+            for batch in _batches(recipients, settings.MAILING_BATCH_SIZE):
+                open_connection(connection)
+                results = send_batch(connection, prepared, [email for _, email in batch], limiter)
+                _record_results(mailing, batch, results, counters, attempts, latencies)
+                _check_shutdown(mailing, lease)
+
+    finally:
+        if own_connection:
+            connection.close()
+
+    return counters
+
+
+def deliver_async(mailing: Mailing, recipients, latencies: list = None, lease: MailingLease = None) -> dict:
+    """
+    Отправляет письма рассылки через пул асинхронных SMTP-сессий (MAILING_ASYNC_CONNECTIONS сессий).
+    Сессии открываются один раз и живут, пока не будут отправлены все пачки; между пачками результаты
+    записываются в БД синхронно, вне цикла событий.
+    Получатели каждой пачки раскладываются по доменам (plan_transactions), и корзины доменов обслуживаются
+    сессиями по кругу. Число одновременных транзакций подбирает регулятор AIMD (MAILING_CONCURRENCY_ADAPTIVE),
+    его метрики публикуются в кэш после каждой пачки.
+    """
+    counters = {"sent": 0, "failed": 0}
+    controller = build_concurrency_controller()
+    pool = AsyncSMTPPool(
+        settings.MAILING_ASYNC_CONNECTIONS,
+        controller=controller,
+        host=settings.EMAIL_HOST,
+        port=settings.EMAIL_PORT,
+        username=settings.EMAIL_HOST_USER,
+        password=settings.EMAIL_HOST_PASSWORD,
+        use_tls=settings.EMAIL_USE_TLS,
+        use_ssl=settings.EMAIL_USE_SSL,
+        timeout=settings.EMAIL_TIMEOUT,
+    )
+
+    prepared = PreparedMessage(mailing)
+    limiter = build_rate_limiter(mailing)
+
+    with asyncio.Runner() as runner, AttemptWriter() as attempts:
+        with build_circuit_breaker().guard():
+            runner.run(pool.open())
+        try:
+            rcpt_limit = pool.rcpt_limit(settings.MAILING_RCPT_PER_TRANSACTION)
+            for batch in _batches(recipients, settings.MAILING_BATCH_SIZE):
+                buckets = plan_transactions(prepared, batch, rcpt_limit)
+                results = runner.run(
+                    pool.send_planned(
+                        prepared.from_email, buckets, len(batch), limiter, settings.MAILING_DOMAIN_CONNECTIONS
+                    )
+                )
+                _record_results(mailing, batch, results, counters, attempts, latencies)
+                if controller is not None:
+                    controller.publish()
+                _check_shutdown(mailing, lease)
+
+        finally:
+            runner.run(pool.close())
+
+    return counters
+
+
+def plan_domain_buckets(batch: list) -> list:
+    """
+    Раскладывает пачку пар (id получателя, email) по доменам адресов. Возвращает список корзин - списков индексов
+    пачки - в порядке первого появления домена.
+    """
+    buckets = {}
+    for index, (_, email) in enumerate(batch):
+        buckets.setdefault(email.rpartition("@")[2].lower(), []).append(index)
+    return list(buckets.values())
+
+
+def plan_transactions(prepared: PreparedMessage, batch: list, rcpt_limit: int = 1) -> list:
+    """
+    План отправки пачки: получатели раскладываются по доменам, и в каждой корзине домена формируются транзакции
+    не более чем на rcpt_limit получателей. Письмо транзакции на одного получателя содержит его адрес в To,
+    на нескольких - общее (PreparedMessage.render_shared).
+    Возвращает список корзин для AsyncSMTPPool.send_planned: корзина - список транзакций
+    (индексы в пачке, адреса получателей, письмо в байтах).
+    """
+    plan = []
+    for indexes in plan_domain_buckets(batch):
+        transactions = []
+        for chunk in _batches(indexes, rcpt_limit):
+            to_addrs = [prepared.recipient_address(batch[index][1]) for index in chunk]
+            data = prepared.render(batch[chunk[0]][1]) if len(chunk) == 1 else prepared.render_shared()
+            transactions.append((chunk, to_addrs, data))
+        plan.append(transactions)
+    return plan
+
+
+def _check_shutdown(mailing: Mailing, lease: MailingLease = None):
+    """
+    Прерывает отправку, если запрошена остановка процесса (DeliveryInterrupted) или пользователь остановил
+    рассылку (DeliveryCancelled). Результаты отправленных пачек уже в журнале. Продлевает захват рассылки lease
+    (MailingBusy, если его перехватил другой процесс).
+    """
+    if shutdown_requested.is_set():
+        raise DeliveryInterrupted(f"Отправка рассылки {mailing.id} остановлена вместе с процессом.")
+    if cancel_requested(mailing):
+        raise DeliveryCancelled(f"Отправка рассылки {mailing.id} остановлена пользователем.")
+    if lease is not None:
+        lease.renew()
+
+
+def _batches(iterable, size: int):
+    """Разбивает итерируемый набор на списки по size элементов."""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+def _record_results(
+    mailing: Mailing, batch: list, results: list, counters: dict, attempts: AttemptWriter, latencies: list = None
+):
+    """
+    Сохраняет результат отправки по каждому получателю пачки и обновляет счётчики. В лог пишутся итоги пачки,
+    результат по каждому получателю - на уровне DEBUG (он и так сохраняется в SendAttempt).
+    Письма с временной ошибкой (статус 'deferred') в журнале доставки откладываются на повтор, в SendAttempt
+    такая попытка записывается как неудачная.
+    """
+    sent = []
+    failures = {}
+
+    for (recipient_id, email), (status, response_text, elapsed) in zip(batch, results):
+        if status == "successfully":
+            counters["sent"] += 1
+            sent.append(recipient_id)
+        else:
+            counters["failed"] += 1
+            failures[recipient_id] = (status, response_text)
+        if latencies is not None:
+            latencies.append(elapsed)
+        logger.debug(f"Письмо на {email}: {response_text}")
+        attempts.add(
+            mailing=mailing,
+            recipient_id=recipient_id,
+            status="successfully" if status == "successfully" else "failed",
+            response=f"{email}: {response_text}",
+            owner_id=mailing.owner_id,
+        )
+
+    # Отмечаем пачку в журнале доставки: после падения процесса повторно уйдёт не больше одной пачки
+    if sent:
+        mailing.deliveries.filter(recipient_id__in=sent).update(
+            status="sent", attempts=F("attempts") + 1, next_attempt_at=None, last_error="", updated_at=now()
+        )
+    deferred = _record_failures(mailing, failures) if failures else 0
+    logger.info(
+        f"Рассылка {mailing.id}: пачка из {len(batch)} писем - отправлено {len(sent)}, "
+        f"отложено {deferred}, ошибок {len(failures) - deferred}."
+    )
+
+    record_progress(mailing.id, sent=len(sent), failed=len(failures) - deferred, deferred=deferred)
+
+
+def _record_failures(mailing: Mailing, failures: dict) -> int:
+    """
+    Отмечает в журнале доставки письма, не ушедшие из-за ошибки. failures - словарь
+    {id получателя: (статус, текст ошибки)}. Письмо с временной ошибкой откладывается до следующей попытки,
+    если попытки не исчерпаны, иначе (и при постоянной ошибке) помечается как неотправленное.
+    Возвращает количество отложенных писем.
+    """
+    deliveries = list(mailing.deliveries.filter(recipient_id__in=failures).only("pk", "recipient_id", "attempts"))
+    updated_at = now()
+
+    for delivery in deliveries:
+        status, error = failures[delivery.recipient_id]
+        delivery.attempts += 1
+        delivery.last_error = error
+        delivery.updated_at = updated_at
+        delivery.next_attempt_at = next_attempt_at(delivery.attempts) if status == "deferred" else None
+        delivery.status = "deferred" if delivery.next_attempt_at else "failed"
+
+    Delivery.objects.bulk_update(deliveries, ["status", "attempts", "next_attempt_at", "last_error", "updated_at"])
+    return sum(delivery.status == "deferred" for delivery in deliveries)
+
+
+def iter_pending_recipients(mailing: Mailing, first_pk: int = None, last_pk: int = None):
+    """
+    Генератор пар (id получателя, email) тех, кому письмо рассылки ещё не отправлено, в порядке id.
+    Получатели читаются порциями по MAILING_FETCH_SIZE с keyset-пагинацией (recipient_id > последнего
+    прочитанного), поэтому в памяти одновременно находится только одна порция, а каждая следующая порция
+    выбирается по индексу так же быстро, как первая.
+    first_pk и last_pk ограничивают диапазон id получателей (границы включительно).
+    Чтобы письма не ушли дважды, вызывающий держит захват рассылки (postpilot.leases).
+    """
+    fetch_size = settings.MAILING_FETCH_SIZE
+    queryset = mailing.deliveries.filter(status="pending").order_by("recipient_id")
+    if last_pk is not None:
+        queryset = queryset.filter(recipient_id__lte=last_pk)
+
+    last_seen = first_pk - 1 if first_pk is not None else None
+    while True:
+        page = queryset if last_seen is None else queryset.filter(recipient_id__gt=last_seen)
+        rows = list(page.values_list("recipient_id", "recipient__email")[:fetch_size])
+        yield from rows
+
+        if len(rows) < fetch_size:
+            return
+        last_seen = rows[-1][0]
+
+
+def recipient_chunks(mailing: Mailing, chunk_size: int) -> list:
+    """
+    Делит ожидающих отправки получателей рассылки на диапазоны id по chunk_size получателей в каждом.
+    Возвращает список пар (первый id, последний id) - границы включительно.
+    """
+    chunks = []
+    chunk = []
+
+    pending_ids = (
+        mailing.deliveries.filter(status="pending")
+        .order_by("recipient_id")
+        .values_list("recipient_id", flat=True)
+        .iterator(chunk_size=settings.MAILING_FETCH_SIZE)
+    )
+    for pk in pending_ids:
+        chunk.append(pk)
+        if len(chunk) >= chunk_size:
+            chunks.append((chunk[0], chunk[-1]))
+            chunk = []
+
+    if chunk:
+        chunks.append((chunk[0], chunk[-1]))
+
+    return chunks
+
+
+def deliver_range(mailing: Mailing, first_pk: int, last_pk: int, connection=None, lease: MailingLease = None) -> dict:
+    """Отправляет письма ожидающим отправки получателям рассылки с id в диапазоне [first_pk, last_pk]."""
+    recipients = iter_pending_recipients(mailing, first_pk, last_pk)
+    return deliver(mailing, recipients, connection=connection, lease=lease)
+
+
+def send_mailing(mailing: Mailing, connection=None, latencies: list = None, holder: str = None) -> dict:
+    """
+    Отправляет письма всем получателям указанной рассылки - каждому отдельное письмо.
+    Все письма идут через одно соединение бэкенда (get_connection), поэтому TCP/TLS-рукопожатие
+    выполняется один раз на рассылку, а не на каждое письмо.
+    Обновляет статус рассылки и фиксирует попытки отправки по каждому получателю.
+    Прерванная рассылка продолжается с первого получателя, которому письмо ещё не отправлено.
+    Письма, не ушедшие из-за временной ошибки, откладываются и повторяются позже (retry_deliveries) - до этого
+    рассылка остаётся в состоянии 'started'.
+    Если SMTP-сервер недоступен (RelayUnavailable), рассылка не прерывается: исключение передаётся вызывающему,
+    чтобы тот отложил отправку, а рассылка продолжится при следующем запуске.
+    Если пользователь остановил рассылку (cancel_mailing), отправка прекращается после текущей пачки, а место
+    остановки записывается в SendAttempt. Если рассылка остановлена до начала отправки (например, задание вернулось
+    в очередь после остановки), выбрасывается DeliveryCancelled, и журнал доставки не изменяется.
+    На время отправки рассылка захватывается процессом holder (по умолчанию - текущим, postpilot.leases). Если её
+    уже отправляет другой процесс, выбрасывается MailingBusy, и журнал доставки не изменяется.
+    Возвращает счётчики писем, отправленных за этот запуск.
+    """
+
+    # Пока выключатель SMTP-сервера разомкнут, рассылку не начинаем
+    build_circuit_breaker().check()
+
+    with MailingLease(mailing.pk, holder) as lease:
+        # Статус мог измениться, пока рассылку отправлял другой процесс
+        mailing.refresh_from_db(fields=["status"])
+        if cancel_requested(mailing):
+            raise DeliveryCancelled(f"Рассылка {mailing.id} остановлена пользователем, отправка не возобновляется.")
+        return _send_leased(mailing, lease, connection, latencies)
+
+
+def _send_leased(mailing: Mailing, lease: MailingLease, connection=None, latencies: list = None) -> dict:
+    """Отправка рассылки, захваченной процессом (lease), - см. send_mailing."""
+    prepare_deliveries(mailing)
+    start_mailing(mailing)
 
     # Если список получателей пуст, фиксируем это в БД и логах
-    if not recipient_list:
+    if not mailing.deliveries.exists():
         logger.warning(f"Рассылка {mailing.id} не имеет получателей!")
-        SendAttempt.objects.create(
+        create_attempt(
             mailing=mailing,
             status="broken",  # Прерываем рассылку, так как отправлять некуда
             response="Рассылка не имеет получателей.",
+            owner_id=mailing.owner_id,
         )
         mailing.status = "broken"
         mailing.save(update_fields=["status"])
-        return
+        return {"sent": 0, "failed": 0}
+
+    totals = delivery_totals(mailing)
+    start_progress(mailing, totals)
+    if totals["sent"] or totals["failed"]:
+        logger.info(f"Рассылка {mailing.id} продолжена: осталось отправить {totals['pending']} писем.")
 
     try:
-        # Отправка писем
-        sent_count = send_mail(
-            subject=mailing.message.subject,
-            message=mailing.message.body_text,
-            from_email=os.getenv("EMAIL_HOST_USER"),
-            recipient_list=recipient_list,
-            fail_silently=False,  # Ошибки не игнорируем (не уверен, что так надо)
+        # Получатели читаются потоком, без загрузки объектов Recipient и всего списка адресов в память
+        counters = deliver(
+            mailing, iter_pending_recipients(mailing), connection=connection, latencies=latencies, lease=lease
         )
 
-        # Если хотя бы одно письмо отправлено успешно
-        if sent_count > 0:
-            status = "completed"
-            response_text = f"Отправлено {sent_count} писем"
-        else:
-            status = "broken"  # Если не отправлено ни одного письма, это считается прерыванием
-            response_text = "Не удалось отправить письма"
+    except DeliveryInterrupted:
+        # Рассылка остаётся в состоянии 'started' и продолжится со следующего получателя при следующем запуске
+        logger.info(f"Отправка рассылки {mailing.id} остановлена, продолжится при следующем запуске.")
+        raise
 
-        # Логируем и сохраняем попытку отправки
-        logger.info(f"Рассылка {mailing.id}: {response_text}")
-        SendAttempt.objects.create(
-            mailing=mailing,
-            status=status,
-            response=response_text,
-        )
+    except RelayUnavailable as e:
+        logger.warning(f"Отправка рассылки {mailing.id} отложена: {e}")
+        raise
+
+    except MailingBusy as e:
+        # Захват истёк и рассылку продолжает другой процесс: этот процесс отправку прекращает
+        logger.warning(str(e))
+        raise
 
-        # Обновляем статус рассылки
-        mailing.status = status
+    except DeliveryCancelled:
+        return record_cancellation(mailing, totals)
 
     except Exception as e:
-        # Логируем и записываем ошибку в БД
+        # Ошибка уровня соединения: логируем и записываем ошибку в БД
         mailing.status = "broken"
         logger.exception(f"Ошибка при отправке рассылки {mailing.id}: {e}")
 
-        SendAttempt.objects.create(
+        create_attempt(
             mailing=mailing,
             status="broken",
             response=f"Ошибка отправки: {e}",
+            owner_id=mailing.owner_id,
         )
-
-    finally:
         mailing.save(update_fields=["status", "sent_completed_at"])
+        publish_status(mailing)
+        return {"sent": 0, "failed": totals["pending"]}
+
+    complete_mailing(mailing)
+    return counters
+
+
+def claim_due_retries(limit: int) -> dict:
+    """
+    Захватывает до limit отложенных писем, срок повтора которых наступил, у рассылок в состоянии 'started'.
+    Строки, заблокированные другими обработчиками, пропускаются (SKIP LOCKED), а у захваченных срок повтора
+    сдвигается на MAILING_RETRY_LEASE секунд, чтобы их не взял другой обработчик. Если обработчик упадёт,
+    не отправив письма, они будут повторены по истечении этого срока.
+    Возвращает словарь {id рассылки: [(id получателя, email), ...]}.
+    """
+    due = {}
+    with transaction.atomic():
+        rows = list(
+            Delivery.objects.select_for_update(skip_locked=True, of=("self",))
+            .filter(status="deferred", next_attempt_at__lte=now(), mailing__status="started")
+            .order_by("next_attempt_at")
+            .values_list("pk", "mailing_id", "recipient_id", "recipient__email")[:limit]
+        )
+        Delivery.objects.filter(pk__in=[row[0] for row in rows]).update(
+            next_attempt_at=now() + timedelta(seconds=settings.MAILING_RETRY_LEASE)
+        )
+
+    for _, mailing_id, recipient_id, email in rows:
+        due.setdefault(mailing_id, []).append((recipient_id, email))
+    return due
+
+
+def retry_deliveries(limit: int = None, connection=None) -> dict:
+    """
+    Повторяет отправку отложенных писем, срок повтора которых наступил (не больше limit писем за вызов,
+    по умолчанию MAILING_FETCH_SIZE). Повторяются только письма, не ушедшие из-за временной ошибки, - остальные
+    получатели рассылки писем повторно не получают. Каждая попытка записывается в SendAttempt.
+    Рассылка завершается, когда по ней не остаётся отложенных писем. connection - необязательное открытое
+    соединение бэкенда, через которое отправлять письма.
+    Возвращает счётчики писем, отправленных за этот вызов.
+    """
+    counters = {"sent": 0, "failed": 0}
+    due = claim_due_retries(limit or settings.MAILING_FETCH_SIZE)
+
+    for mailing in Mailing.objects.filter(pk__in=due).select_related("message"):
+        retry_progress(mailing.pk, len(due[mailing.pk]))
+        try:
+            result = deliver(mailing, due[mailing.pk], connection=connection)
+        except (DeliveryInterrupted, RelayUnavailable):
+            raise
+        except DeliveryCancelled as e:
+            # Рассылка остановлена: оставшиеся письма остаются отложенными до её повторного запуска
+            logger.info(str(e))
+            continue
+        except Exception as e:
+            # Письма остаются отложенными и будут повторены по истечении срока захвата
+            logger.exception(f"Ошибка при повторной отправке рассылки {mailing.id}: {e}")
+            continue
+
+        logger.info(f"Рассылка {mailing.id}: повторно отправлено {result['sent']}, ошибок {result['failed']}.")
+        counters["sent"] += result["sent"]
+        counters["failed"] += result["failed"]
+        complete_mailing(mailing)
+
+    return counters
@@ -0,0 +1,405 @@
+"""
+Асинхронный SMTP-клиент на потоках asyncio из стандартной библиотеки.
+Держит пул из нескольких SMTP-сессий и отправляет письма через все сессии одновременно, поэтому время ожидания
+ответов сервера одного письма перекрывается отправкой остальных. Если сервер поддерживает PIPELINING, команды
+MAIL/RCPT/DATA одной транзакции отправляются одним пакетом.
+Письма раздаются сессиям по корзинам (например, по домену получателя) по кругу, так что медленная корзина
+не задерживает остальные.
+"""
+
+import asyncio
+import base64
+from collections import deque
+import logging
+import re
+import ssl
+import time
+from email.utils import parseaddr
+
+from django.core.mail.utils import DNS_NAME
+
+from postpilot.retries import failure_status
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncSMTPError(Exception):
+    """Ошибка SMTP: сервер вернул код ответа, отличный от ожидаемого."""
+
+    def __init__(self, code: int, message: str):
+        super().__init__(f"({code}) {message}")
+        self.code = code
+        self.message = message
+
+
+class AsyncSMTPProtocolError(AsyncSMTPError):
+    """Ответ сервера не удалось разобрать. Сессия после такого ответа непригодна и закрывается."""
+
+    def __init__(self, line: str):
+        super().__init__(-1, f"Неверный ответ сервера: {line!r}")
+
+
+class AsyncSMTPConnection:
+    """Одна SMTP-сессия поверх asyncio.open_connection с поддержкой STARTTLS и AUTH."""
+
+    def __init__(self, host, port, username=None, password=None, use_tls=False, use_ssl=False, timeout=None):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.use_ssl = use_ssl
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+        self.extensions = {}
+
+    @property
+    def is_connected(self) -> bool:
+        """Открыто ли соединение с сервером."""
+        return self.writer is not None and not self.writer.is_closing()
+
+    async def connect(self):
+        """
+        Открывает соединение: приветствие сервера, EHLO, при необходимости STARTTLS и авторизация. Если что-то
+        из этого не удалось, соединение закрывается, чтобы наполовину открытая сессия не считалась рабочей.
+        """
+        ssl_context = ssl.create_default_context() if self.use_tls or self.use_ssl else None
+
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=ssl_context if self.use_ssl else None),
+            self.timeout,
+        )
+
+        try:
+            await self._handshake(ssl_context)
+        except BaseException:
+            await self.close()
+            raise
+
+    async def _handshake(self, ssl_context):
+        """Приветствие сервера, EHLO, STARTTLS и авторизация в только что открытом соединении."""
+        code, message = await self._read_reply()
+        if code != 220:
+            raise AsyncSMTPError(code, message)
+
+        await self._ehlo()
+
+        if self.use_tls:
+            if "starttls" not in self.extensions:
+                raise AsyncSMTPError(-1, "Сервер не поддерживает STARTTLS")
+            await self._command("STARTTLS", 220)
+            await asyncio.wait_for(
+                self.writer.start_tls(ssl_context, server_hostname=self.host),
+                self.timeout,
+            )
+            await self._ehlo()  # После STARTTLS список расширений запрашивается заново
+
+        if self.username and self.password:
+            await self._login()
+
+    async def close(self):
+        """Завершает сессию командой QUIT и закрывает соединение. Ошибки при закрытии игнорируются."""
+        if self.writer is None:
+            return
+
+        try:
+            if not self.writer.is_closing():
+                self.writer.write(b"QUIT\r\n")
+                await asyncio.wait_for(self.writer.drain(), self.timeout)
+            self.writer.close()
+            await asyncio.wait_for(self.writer.wait_closed(), self.timeout)
+        except (OSError, asyncio.TimeoutError):
+            pass
+        finally:
+            self.reader = None
+            self.writer = None
+
+    @property
+    def max_recipients(self) -> int | None:
+        """Сколько получателей сервер принимает в одной транзакции (LIMITS RCPTMAX=, RFC 9422), если объявил."""
+        for param in self.extensions.get("limits", "").split():
+            name, _, value = param.partition("=")
+            if name.upper() == "RCPTMAX" and value.isdigit():
+                return int(value)
+        return None
+
+    async def sendmail(self, from_addr: str, to_addrs: list, data: bytes) -> dict:
+        """
+        Выполняет одну SMTP-транзакцию. data - письмо целиком (заголовки и тело) с переводами строк CRLF.
+        Возвращает словарь отклонённых получателей {адрес: (код, ответ сервера)} - пустой, если письмо принято
+        для всех. Если сервер отклонил всех получателей или само письмо, выбрасывает AsyncSMTPError.
+        Адреса могут содержать отображаемое имя ("PostPilot <noreply@example.com>") - в команды попадает только
+        сам адрес.
+        """
+        commands = (
+            [f"MAIL FROM:<{_addr_spec(from_addr)}>"]
+            + [f"RCPT TO:<{_addr_spec(addr)}>" for addr in to_addrs]
+            + ["DATA"]
+        )
+
+        if "pipelining" in self.extensions:
+            # Все команды транзакции уходят одним пакетом, ответы читаются следом в том же порядке
+            self.writer.write("".join(f"{command}\r\n" for command in commands).encode())
+            await asyncio.wait_for(self.writer.drain(), self.timeout)
+            replies = [await self._read_reply() for _ in commands]
+        else:
+            replies = [await self._send_line(commands[0])]
+            if replies[0][0] == 250:
+                replies.extend([await self._send_line(command) for command in commands[1:-1]])
+                if any(code in (250, 251) for code, _ in replies[1:]):
+                    replies.append(await self._send_line("DATA"))
+
+        if replies[0][0] != 250:
+            await self._reset()
+            raise AsyncSMTPError(*replies[0])
+
+        rcpt_replies = replies[1 : len(to_addrs) + 1]
+        refused = {addr: reply for addr, reply in zip(to_addrs, rcpt_replies) if reply[0] not in (250, 251)}
+        if len(refused) == len(to_addrs):
+            await self._reset()
+            raise AsyncSMTPError(*rcpt_replies[0])
+
+        data_reply = replies[len(to_addrs) + 1]
+        if data_reply[0] != 354:
+            await self._reset()
+            raise AsyncSMTPError(*data_reply)
+
+        self.writer.write(_dot_stuff(data))
+        await asyncio.wait_for(self.writer.drain(), self.timeout)
+
+        code, message = await self._read_reply()
+        if code != 250:
+            raise AsyncSMTPError(code, message)
+        return refused
+
+    async def _ehlo(self):
+        """Отправляет EHLO и запоминает расширения, объявленные сервером."""
+        code, message = await self._send_line(f"EHLO {DNS_NAME}")
+        if code != 250:
+            await self._command(f"HELO {DNS_NAME}", 250)
+            self.extensions = {}
+            return
+
+        self.extensions = {}
+        for line in message.splitlines()[1:]:
+            keyword, _, params = line.partition(" ")
+            self.extensions[keyword.lower()] = params
+
+    async def _login(self):
+        """Авторизация на сервере: AUTH PLAIN, если сервер её объявил, иначе AUTH LOGIN."""
+        mechanisms = self.extensions.get("auth", "").upper().split()
+
+        if "PLAIN" in mechanisms or "LOGIN" not in mechanisms:
+            token = base64.b64encode(f"\0{self.username}\0{self.password}".encode()).decode()
+            await self._command(f"AUTH PLAIN {token}", 235)
+            return
+
+        await self._command("AUTH LOGIN", 334)
+        await self._command(base64.b64encode(self.username.encode()).decode(), 334)
+        await self._command(base64.b64encode(self.password.encode()).decode(), 235)
+
+    async def _reset(self):
+        """Отменяет текущую транзакцию (RSET), чтобы сессию можно было использовать дальше."""
+        await self._send_line("RSET")
+
+    async def _command(self, line: str, expected_code: int) -> str:
+        """Отправляет команду и проверяет код ответа."""
+        code, message = await self._send_line(line)
+        if code != expected_code:
+            raise AsyncSMTPError(code, message)
+        return message
+
+    async def _send_line(self, line: str) -> tuple:
+        """Отправляет одну строку команды и возвращает ответ сервера (код, текст)."""
+        self.writer.write(f"{line}\r\n".encode())
+        await asyncio.wait_for(self.writer.drain(), self.timeout)
+        return await self._read_reply()
+
+    async def _read_reply(self) -> tuple:
+        """Читает (возможно многострочный) ответ сервера. Возвращает код и текст ответа."""
+        lines = []
+        while True:
+            line = await asyncio.wait_for(self.reader.readline(), self.timeout)
+            if not line:
+                raise ConnectionResetError("Сервер закрыл соединение")
+
+            line = line.decode("utf-8", "replace").rstrip("\r\n")
+            try:
+                code = int(line[:3])
+            except ValueError:
+                raise AsyncSMTPProtocolError(line) from None
+            lines.append(line[4:])
+            if len(line) < 4 or line[3] != "-":
+                return code, "\n".join(lines)
+
+
+class AsyncSMTPPool:
+    """
+    Пул из size SMTP-сессий. Письма пачки раздаются свободным сессиям, так что одновременно выполняется до size
+    транзакций. Упавшая сессия переоткрывается при следующем письме.
+    controller - необязательный регулятор числа одновременных транзакций (postpilot.concurrency.AIMDController):
+    тогда одновременно работают не все сессии, а столько, сколько он разрешает.
+    """
+
+    def __init__(self, size: int, controller=None, **connection_kwargs):
+        self.size = size
+        self.controller = controller
+        self.connection_kwargs = connection_kwargs
+        self.connections = []
+
+    async def open(self):
+        """Открывает сессии пула параллельно. Ошибка выбрасывается, только если не открылась ни одна сессия."""
+        connections = [AsyncSMTPConnection(**self.connection_kwargs) for _ in range(self.size)]
+        results = await asyncio.gather(*(connection.connect() for connection in connections), return_exceptions=True)
+
+        errors = [result for result in results if isinstance(result, BaseException)]
+        self.connections = [connection for connection, result in zip(connections, results) if result is None]
+
+        if not self.connections:
+            raise errors[0]
+        if errors:
+            logger.warning(f"Открыто {len(self.connections)} из {self.size} SMTP-сессий: {errors[0]}")
+
+    async def close(self):
+        """Закрывает все сессии пула."""
+        await asyncio.gather(*(connection.close() for connection in self.connections))
+        self.connections = []
+
+    def rcpt_limit(self, requested: int) -> int:
+        """
+        Сколько получателей можно указывать в одной транзакции: requested, но не больше объявленного сервером
+        RCPTMAX. Несколько получателей в транзакции используются, только если все сессии поддерживают PIPELINING -
+        иначе каждая команда RCPT стоила бы отдельного обмена с сервером.
+        """
+        if requested <= 1 or not all("pipelining" in connection.extensions for connection in self.connections):
+            return 1
+        limits = [connection.max_recipients for connection in self.connections if connection.max_recipients]
+        return max(1, min([requested, *limits]))
+
+    async def send_many(self, from_addr: str, items: list, limiter=None) -> list:
+        """
+        Отправляет письма items - список пар (адрес получателя, письмо в байтах) - через все сессии пула,
+        каждое письмо отдельной транзакцией. Возвращает то же, что send_planned.
+        """
+        buckets = [[([index], [to_addr], data)] for index, (to_addr, data) in enumerate(items)]
+        return await self.send_planned(from_addr, buckets, len(items), limiter)
+
+    async def send_planned(self, from_addr: str, buckets: list, total: int, limiter=None, per_bucket: int = 0) -> list:
+        """
+        Отправляет письма, разложенные по корзинам. buckets - список корзин, корзина - список транзакций
+        (индексы писем, адреса получателей, письмо в байтах); индексы нумеруют письма от 0 до total - 1.
+        Свободная сессия берёт очередную транзакцию из корзины в начале очереди, а корзина уходит в конец
+        очереди, так что корзины обслуживаются по кругу и медленная корзина не задерживает остальные.
+        per_bucket ограничивает число сессий, одновременно работающих с одной корзиной (0 - без ограничения).
+        limiter - необязательный ограничитель скорости (postpilot.ratelimit.RateLimiter): перед каждым письмом
+        ожидается его токен, а ответы 421/451 передаются ему, чтобы все сессии сделали паузу.
+        Возвращает список троек (статус, ответ сервера, время отправки в секундах) в порядке индексов. Статус
+        'successfully' - письмо принято, 'deferred' - временная ошибка (повторить позже), 'failed' - постоянная.
+        """
+        results = [None] * total
+        positions = [0] * len(buckets)
+        active = [0] * len(buckets)
+        ready = deque(number for number, bucket in enumerate(buckets) if bucket)
+        changed = asyncio.Condition()
+
+        def has_work(number: int) -> bool:
+            return positions[number] < len(buckets[number])
+
+        def available(number: int) -> bool:
+            return has_work(number) and (not per_bucket or active[number] < per_bucket)
+
+        async def worker(connection):
+            while True:
+                acquired_at = await self.controller.acquire() if self.controller is not None else None
+
+                async with changed:
+                    await changed.wait_for(lambda: ready or not any(map(has_work, range(len(buckets)))))
+                    if not ready:
+                        if self.controller is not None:
+                            await self.controller.release(acquired_at)
+                        return
+                    number = ready.popleft()
+                    indexes, to_addrs, data = buckets[number][positions[number]]
+                    positions[number] += 1
+                    active[number] += 1
+                    if available(number):
+                        ready.append(number)  # Корзину может взять и другая сессия, но после остальных корзин
+
+                if limiter is not None:
+                    for _ in to_addrs:
+                        await limiter.wait_async()
+                replies = await self._send_transaction(connection, from_addr, to_addrs, data, limiter)
+                for index, reply in zip(indexes, replies):
+                    results[index] = reply
+                if self.controller is not None:
+                    deferred = any(status == "deferred" for status, _, _ in replies)
+                    await self.controller.release(acquired_at, replies[0][2], deferred)
+
+                async with changed:
+                    active[number] -= 1
+                    if available(number) and number not in ready:
+                        ready.append(number)
+                    changed.notify_all()
+
+        await asyncio.gather(*(worker(connection) for connection in self.connections))
+        return results
+
+    @staticmethod
+    async def _send_transaction(
+        connection: AsyncSMTPConnection, from_addr: str, to_addrs: list, data: bytes, limiter=None
+    ) -> list:
+        """
+        Отправляет одно письмо одному или нескольким получателям через сессию. Возвращает результат по каждому
+        получателю. При обрыве сессия переоткрывается для следующих писем. Если сессию не удалось переоткрыть
+        (в том числе из-за ответа сервера, например 535 при авторизации), письмо откладывается: ошибка относится
+        к сессии, а не к получателям.
+        """
+        started_at = time.perf_counter()
+        if not connection.is_connected:
+            try:
+                await connection.connect()
+            except (AsyncSMTPError, OSError, asyncio.TimeoutError) as e:
+                return [("deferred", f"Ошибка соединения: {e!r}", time.perf_counter() - started_at)] * len(to_addrs)
+
+        try:
+            refused = await connection.sendmail(from_addr, to_addrs, data)
+
+        except AsyncSMTPProtocolError as e:
+            await connection.close()
+            return [("deferred", f"Ошибка SMTP: {e}", time.perf_counter() - started_at)] * len(to_addrs)
+
+        except AsyncSMTPError as e:
+            if limiter is not None:
+                await limiter.throttled_async(e.code)
+            return [(failure_status(e.code), f"Ошибка SMTP: {e}", time.perf_counter() - started_at)] * len(to_addrs)
+
+        except (OSError, asyncio.TimeoutError) as e:
+            await connection.close()
+            return [("deferred", f"Ошибка соединения: {e!r}", time.perf_counter() - started_at)] * len(to_addrs)
+
+        elapsed = time.perf_counter() - started_at
+        results = []
+        for to_addr in to_addrs:
+            if to_addr in refused:
+                code, message = refused[to_addr]
+                if limiter is not None:
+                    await limiter.throttled_async(code)
+                results.append((failure_status(code), f"Ошибка SMTP: ({code}) {message}", elapsed))
+            else:
+                results.append(("successfully", "Успешно отправлено", elapsed))
+        return results
+
+
+def _addr_spec(address: str) -> str:
+    """Адрес без отображаемого имени для команд MAIL FROM и RCPT TO (как smtplib.quoteaddr)."""
+    _, addr = parseaddr(address)
+    return addr or address
+
+
+def _dot_stuff(data: bytes) -> bytes:
+    """Подготавливает письмо к передаче после DATA: удваивает точки в начале строк и добавляет завершающую точку."""
+    data = re.sub(rb"(?m)^\.", b"..", data)
+    if not data.endswith(b"\r\n"):
+        data += b"\r\n"
+    return data + b".\r\n"
@@ -0,0 +1,151 @@
+"""
+Локальный SMTP-сервер-заглушка для измерения скорости отправки рассылок.
+Принимает письма и никуда их не пересылает. Умеет добавлять задержку ответа и отклонять часть писем,
+чтобы имитировать медленный или перегруженный SMTP-сервер. Работает без доступа к сети (только localhost).
+"""
+
+import asyncio
+import random
+import threading
+
+
+class SMTPSink:
+    """
+    SMTP-сервер-заглушка на asyncio. Запускается в отдельном потоке со своим циклом событий.
+    latency - задержка ответа на письмо (секунды), failure_rate - доля писем, отклоняемых ответом 451.
+    capacity - сколько писем сервер обрабатывает одновременно (0 - без ограничения): остальные ждут в очереди,
+    и время ответа растёт с нагрузкой, как у перегруженного сервера.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, failure_rate=0.0, seed=None, capacity=0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.capacity = capacity
+        self._slots = None
+        self.received = 0
+        self.rejected = 0
+        self.sessions = 0
+        self.transactions = 0
+        self._random = random.Random(seed)
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._started = threading.Event()
+
+    def start(self):
+        """Запускает сервер в фоновом потоке. Если port=0, порт выбирается системой и сохраняется в self.port."""
+        self._thread = threading.Thread(target=self._run, name="smtp-sink", daemon=True)
+        self._thread.start()
+        self._started.wait()
+        return self
+
+    def stop(self):
+        """Останавливает сервер и дожидается завершения потока."""
+        if self._loop is None:
+            return
+        self._loop.call_soon_threadsafe(self._server.close)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def serve_forever(self):
+        """Запускает сервер в текущем потоке (для ручного запуска из командной строки)."""
+        asyncio.run(self._serve_forever())
+
+    def _run(self):
+        """Цикл событий фонового потока."""
+        self._loop = asyncio.new_event_loop()
+        self._server = self._loop.run_until_complete(asyncio.start_server(self._handle, self.host, self.port))
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._started.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._loop.close()
+
+    async def _serve_forever(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def _handle(self, reader, writer):
+        """Обслуживает одну SMTP-сессию."""
+        self.sessions += 1
+        recipients = 0
+        writer.write(b"220 postpilot-sink ESMTP\r\n")
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+
+                command = line.decode("utf-8", "replace").strip()
+                verb = command[:4].upper()
+
+                if verb == "EHLO":
+                    writer.write(
+                        (
+                            b"250-postpilot-sink\r\n250-PIPELINING\r\n250-8BITMIME\r\n250-LIMITS RCPTMAX=100\r\n"
+                            b"250 SIZE 10485760\r\n"
+                        )
+                    )
+                elif verb == "RCPT":
+                    recipients += 1
+                    writer.write(b"250 2.1.5 Ok\r\n")
+                elif verb == "DATA":
+                    if not recipients:
+                        writer.write(b"554 5.5.1 No valid recipients\r\n")
+                    else:
+                        writer.write(b"354 End data with <CR><LF>.<CR><LF>\r\n")
+                        await writer.drain()
+                        while await reader.readline() not in (b".\r\n", b""):
+                            pass
+                        self.transactions += 1
+                        writer.write(await self._data_reply(recipients))
+                        recipients = 0
+                elif verb == "RSET":
+                    recipients = 0
+                    writer.write(b"250 2.0.0 Ok\r\n")
+                elif verb == "QUIT":
+                    writer.write(b"221 2.0.0 Bye\r\n")
+                    await writer.drain()
+                    break
+                else:  # HELO, MAIL, NOOP, AUTH и прочее - просто соглашаемся
+                    writer.write(b"250 2.0.0 Ok\r\n" if verb != "AUTH" else b"235 2.7.0 Authentication successful\r\n")
+
+                await writer.drain()
+
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _data_reply(self, recipients: int) -> bytes:
+        """
+        Ответ на конец письма для recipients получателей: с задержкой latency и с вероятностью failure_rate -
+        временный отказ. Счётчики received и rejected считают получателей.
+        """
+        if self.capacity:
+            if self._slots is None:
+                self._slots = asyncio.Semaphore(self.capacity)
+            async with self._slots:
+                await asyncio.sleep(self.latency)
+        elif self.latency:
+            await asyncio.sleep(self.latency)
+
+        if self.failure_rate and self._random.random() < self.failure_rate:
+            self.rejected += recipients
+            return b"451 4.3.0 Temporary failure (injected)\r\n"
+
+        self.received += recipients
+        return b"250 2.0.0 Ok: queued\r\n"
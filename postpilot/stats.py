@@ -0,0 +1,90 @@
+"""
+Счётчики для главной страницы и страницы приветствия.
+Все счётчики считаются одним запросом: условная агрегация по попыткам отправки (самая большая таблица читается
+один раз) и скалярные подзапросы с количеством рассылок, сообщений, получателей и архивных попыток (итоги из
+postpilot.archive). Результат кэшируется на STATS_TIMEOUT секунд отдельно для каждого владельца и для всех объектов
+(менеджеры). Странице приветствия нужны только количество рассылок и получателей - их считает welcome_stats,
+не читая попытки отправки.
+"""
+
+from django.core.cache import cache
+from django.db.models import Count, IntegerField, Q, Subquery
+
+from postpilot.models import Mailing, Message, Recipient, SendAttempt, SendAttemptSummary
+
+# Ключ кэша со счётчиками (владелец или "all") и время их хранения, с
+STATS_KEY = "postpilot:stats:{}"
+STATS_TIMEOUT = 30
+
+
+class SubqueryCount(Subquery):
+    """
+    Скалярный подзапрос с количеством строк queryset. Помечен как агрегат, чтобы его можно было передать
+    в aggregate() вместе с условными Count.
+    """
+
+    template = "(SELECT COUNT(*) FROM (%(subquery)s) _count)"
+    output_field = IntegerField()
+    contains_aggregate = True
+
+    def __init__(self, queryset, **kwargs):
+        super().__init__(queryset.order_by().values("pk"), **kwargs)
+
+
+class SubquerySum(Subquery):
+    """Скалярный подзапрос с суммой поля field по строкам queryset (0, если строк нет). Помечен как агрегат."""
+
+    template = "(SELECT COALESCE(SUM(_sum.%(column)s), 0) FROM (%(subquery)s) _sum)"
+    output_field = IntegerField()
+    contains_aggregate = True
+
+    def __init__(self, queryset, field: str, **kwargs):
+        column = queryset.model._meta.get_field(field).column
+        super().__init__(queryset.order_by().values(field), column=column, **kwargs)
+
+
+def dashboard_stats(owner=None) -> dict:
+    """
+    Возвращает счётчики рассылок (всего, активных), сообщений, получателей и попыток отправки (всего, успешных,
+    неудачных).
+    owner - пользователь, объекты которого считать; None - считать все объекты.
+    """
+    key = STATS_KEY.format(owner.pk if owner is not None else "all")
+    stats = cache.get(key)
+    if stats is not None:
+        return stats
+
+    scope = {"owner": owner} if owner is not None else {}
+    archived = SendAttemptSummary.objects.filter(**scope)  # Попытки, перенесённые в архив (postpilot.archive)
+    stats = SendAttempt.objects.filter(**scope).aggregate(
+        send_attempts=Count("pk") + SubquerySum(archived, "attempts"),
+        send_attempts_successful=Count("pk", filter=Q(status="successfully")) + SubquerySum(archived, "successful"),
+        send_attempts_failed=Count("pk", filter=~Q(status="successfully")) + SubquerySum(archived, "failed"),
+        mailings=SubqueryCount(Mailing.objects.filter(**scope)),
+        mailings_started=SubqueryCount(Mailing.objects.filter(status="started", **scope)),
+        messages=SubqueryCount(Message.objects.filter(**scope)),
+        recipients=SubqueryCount(Recipient.objects.filter(**scope)),
+    )
+
+    cache.set(key, stats, STATS_TIMEOUT)
+    return stats
+
+
+def welcome_stats() -> dict:
+    """
+    Возвращает счётчики страницы приветствия: рассылки (всего, активных) и получатели по всем владельцам.
+    Один запрос по таблице рассылок со скалярным подзапросом к получателям; попытки отправки не читаются.
+    """
+    key = STATS_KEY.format("welcome")
+    stats = cache.get(key)
+    if stats is not None:
+        return stats
+
+    stats = Mailing.objects.aggregate(
+        mailings=Count("pk"),
+        mailings_started=Count("pk", filter=Q(status="started")),
+        recipients=SubqueryCount(Recipient.objects.all()),
+    )
+
+    cache.set(key, stats, STATS_TIMEOUT)
+    return stats
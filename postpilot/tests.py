@@ -1,3 +1,1206 @@
-# from django.test import TestCase
+import asyncio
+import base64
+import json
+import multiprocessing
+import os
+import pickle
+import signal
+import smtplib
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+from datetime import timezone as dt_timezone
+from email import message_from_bytes
+from email import policy as email_policy
+from io import StringIO
+from itertools import count
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import Group
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.management import call_command
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.db.models import F
+from django.http import Http404
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.timezone import now
+
+from core.cache import cached_objects, cached_pks
+from core.pagination import KeysetPaginationMixin
+from core.testing import QueryBudgetMixin
+from postpilot import services
+from postpilot.archive import ARCHIVE_FIELDS, archive_attempts, archived_attempts, pack, unpack
+from postpilot.attempts import AttemptWriter
+from postpilot.breaker import CircuitBreaker, RelayUnavailable
+from postpilot.concurrency import AIMDController
+from postpilot.jobs import enqueue_mailing, requeue_stale_jobs, run_job
+from postpilot.leases import MailingBusy, MailingLease
+from postpilot.models import Delivery, Mailing, MailingJob, Message, Recipient, SendAttempt, SendAttemptArchive
+from postpilot.ratelimit import RateLimiter, TokenBucket
+from postpilot.retries import failure_status, next_attempt_at, retry_delay
+from postpilot.scheduler import MailingScheduler
+from postpilot.services import retry_deliveries, send_mailing
+from postpilot.smtp_async import AsyncSMTPConnection, AsyncSMTPError, AsyncSMTPPool, AsyncSMTPProtocolError
+from postpilot.stats import dashboard_stats
+from users.models import CustomUser
+from users.roles import MANAGERS_GROUP
+
+# Кэш отключён: бюджеты считаются для холодного кэша, кэшированные слои не должны скрывать запросы
+NO_CACHE = {"default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}}
+# Локальный кэш процесса: состояние корзин, выключателя и флагов хранится в кэше
+LOCMEM_CACHE = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+_numbers = count(1)
+
+
+def make_owner_data(owner: CustomUser, size: int = 3):
+    """Создаёт владельцу size получателей, сообщений, рассылок (по всем получателям) и попыток отправки."""
+    recipients = []
+    for _ in range(size):
+        number = next(_numbers)
+        recipients.append(Recipient.objects.create(email=f"recipient{number}@example.com", owner=owner))
+
+    for _ in range(size):
+        number = next(_numbers)
+        message = Message.objects.create(subject=f"Тема {number}", body_text="Текст", owner=owner)
+        mailing = Mailing.objects.create(message=message, owner=owner)
+        mailing.recipients.set(recipients)
+        for recipient in recipients:
+            SendAttempt.objects.create(mailing=mailing, recipient=recipient, status="successfully", owner=owner)
+
+
+@override_settings(CACHES=NO_CACHE)
+class ViewQueryBudgetTest(QueryBudgetMixin, TestCase):
+    """
+    Бюджеты запросов к БД страниц приложения. Число запросов страницы не должно зависеть от количества объектов
+    (нет N+1) и не должно превышать бюджета.
+    """
+
+    # Страница и её бюджет запросов: 3 запроса любой страницы (сессия, пользователь, роли) и запросы самой страницы
+    budgets = {
+        "postpilot:welcome": 3 + 1,  # Счётчики
+        "postpilot:home": 3 + 5,  # Счётчики, рассылки, активные рассылки, получатели, попытки
+        "postpilot:mailing_list": 3 + 2,  # Страница объектов и счётчики
+        "postpilot:message_list": 3 + 2,
+        "postpilot:recipient_list": 3 + 2,
+        "postpilot:sendattempt_list": 3 + 2,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = CustomUser.objects.create_user(email="owner@example.com", username="owner", password="x")
+        cls.manager = CustomUser.objects.create_user(email="manager@example.com", username="manager", password="x")
+        Group.objects.get_or_create(name=MANAGERS_GROUP)[0].user_set.add(cls.manager)
+        make_owner_data(cls.owner)
+        make_owner_data(cls.manager)
+
+    def assertPages(self, user):
+        for name, budget in self.budgets.items():
+            with self.subTest(page=name, user=user.username):
+                self.client.force_login(user)
+                self.assertPageBudget(reverse(name), budget)
+
+    def assertPagesConstant(self, user):
+        # Данные растут понемногу, чтобы списки всех страниц оставались короче размера страницы (иначе на обеих
+        # страницах окажется одинаковое число объектов и N+1 не будет заметен)
+        for name in self.budgets:
+            with self.subTest(page=name, user=user.username):
+                self.client.force_login(user)
+                self.assertConstantQueries(reverse(name), lambda: make_owner_data(self.owner, 2))
+
+    def test_owner_budgets(self):
+        self.assertPages(self.owner)
+
+    def test_manager_budgets(self):
+        self.assertPages(self.manager)
+
+    def test_owner_queries_do_not_grow_with_data(self):
+        self.assertPagesConstant(self.owner)
+
+    def test_manager_queries_do_not_grow_with_data(self):
+        self.assertPagesConstant(self.manager)
+
+
+class MailingLeaseTest(TestCase):
+    """Захват рассылки процессом отправки: второй процесс не берёт рассылку, пока захват не истёк."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = CustomUser.objects.create_user(email="lease@example.com", username="lease", password="x")
+        message = Message.objects.create(subject="Тема", body_text="Текст", owner=cls.owner)
+        cls.mailing = Mailing.objects.create(message=message, owner=cls.owner, status="started")
+
+    def test_second_runner_is_refused(self):
+        with MailingLease(self.mailing.pk, "worker:1"):
+            with self.assertRaises(MailingBusy):
+                MailingLease(self.mailing.pk, "cron:2").acquire()
+        MailingLease(self.mailing.pk, "cron:2").acquire()  # Отпущенную рассылку берёт другой процесс
+
+    def test_expired_lease_is_taken_over(self):
+        MailingLease(self.mailing.pk, "worker:1", timeout=-1).acquire()  # Процесс упал, не отпустив рассылку
+        MailingLease(self.mailing.pk, "cron:2").acquire()
+
+        with self.assertRaises(MailingBusy):
+            MailingLease(self.mailing.pk, "worker:1").renew()
+
+    def test_send_mailing_leaves_journal_of_busy_mailing(self):
+        Delivery.objects.create(
+            mailing=self.mailing, recipient=Recipient.objects.create(email="r@example.com", owner=self.owner)
+        )
+        with MailingLease(self.mailing.pk, "worker:1"):
+            with self.assertRaises(MailingBusy):
+                send_mailing(self.mailing, holder="cron:2")
+        self.assertEqual(self.mailing.deliveries.get().status, "pending")
+
+
+class MailingJobQueueTest(TestCase):
+    """Очередь заданий: одно незавершённое задание на рассылку, задания пропавших обработчиков возвращаются."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = CustomUser.objects.create_user(email="jobs@example.com", username="jobs", password="x")
+        message = Message.objects.create(subject="Тема", body_text="Текст", owner=cls.owner)
+        cls.mailing = Mailing.objects.create(message=message, owner=cls.owner)
+
+    def test_one_active_job_per_mailing(self):
+        job = enqueue_mailing(self.mailing)
+        self.assertEqual(enqueue_mailing(self.mailing), job)
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            MailingJob.objects.create(mailing=self.mailing, status="running")
+
+    def test_stale_running_job_is_requeued(self):
+        job = enqueue_mailing(self.mailing)
+        MailingJob.objects.filter(pk=job.pk).update(
+            status="running",
+            worker="killed:1",
+            started_at=now() - timedelta(seconds=settings.MAILING_LEASE_TIMEOUT + 1),
+        )
+
+        self.assertEqual(enqueue_mailing(self.mailing), job)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.worker), ("queued", ""))
+
+    @override_settings(CACHES=LOCMEM_CACHE)
+    def test_successful_run_clears_previous_error(self):
+        cache.clear()  # Флаги остановки рассылок из других тестов
+        job = MailingJob.objects.create(
+            mailing=self.mailing, status="running", worker="worker:1", error="Обработчик задания пропал."
+        )
+        run_job(job)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.error), ("done", ""))
+
+    def test_job_with_live_lease_is_not_requeued(self):
+        job = enqueue_mailing(self.mailing)
+        MailingJob.objects.filter(pk=job.pk).update(
+            status="running", worker="worker:1", started_at=now() - timedelta(days=1)
+        )
+        MailingLease(self.mailing.pk, "worker:1").acquire()  # Обработчик продлевает захват после каждой пачки
+
+        self.assertEqual(requeue_stale_jobs(), 0)
+
+
+@override_settings(CACHES=LOCMEM_CACHE, MAILING_ENGINE="sync")
+class MailingCancelTest(TestCase):
+    """Остановка рассылки: задание, вернувшееся в очередь, её не возобновляет, явный запуск - возобновляет."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = CustomUser.objects.create_user(email="cancel@example.com", username="cancel", password="x")
+        message = Message.objects.create(subject="Тема", body_text="Текст", owner=cls.owner)
+        cls.mailing = Mailing.objects.create(message=message, owner=cls.owner)
+        cls.mailing.recipients.add(Recipient.objects.create(email="cancelled@example.com", owner=cls.owner))
+
+    def setUp(self):
+        cache.clear()
+        services.cancel_mailing(self.mailing)
+
+    def run_requeued_job(self) -> MailingJob:
+        """Выполняет задание рассылки, которое вернулось в очередь и снова захвачено обработчиком."""
+        job = MailingJob.objects.create(mailing=self.mailing, status="running", worker="worker:1", started_at=now())
+        run_job(job)
+        return job
+
+    def test_requeued_job_does_not_resume_cancelled_mailing(self):
+        job = self.run_requeued_job()
+
+        self.assertEqual(job.status, "done")
+        self.assertIn("остановлена пользователем", job.error)
+        self.mailing.refresh_from_db()
+        self.assertEqual(self.mailing.status, "broken")
+        self.assertEqual(mail.outbox, [])
+        self.assertFalse(self.mailing.deliveries.exists())  # Журнал доставки не тронут
+
+    def test_explicit_resend_resumes_mailing(self):
+        self.client.force_login(self.owner)
+        self.client.post(reverse("postpilot:sendattempt", args=[self.mailing.pk]))
+        job = MailingJob.objects.get(mailing=self.mailing)
+        job.status, job.worker = "running", "worker:1"
+
+        run_job(job)
+        self.assertEqual((job.status, job.error), ("done", ""))
+        self.assertEqual([message.to for message in mail.outbox], [["cancelled@example.com"]])
+
+
+class PreparedMessageTest(SimpleTestCase):
+    """Готовое письмо рассылки: заголовки получателя, кодировка и переводы строк совпадают с письмом EmailMessage."""
+
+    def setUp(self):
+        message = Message(subject="Скидки недели: до 50%", body_text="Здравствуйте!\nНовые предложения.")
+        self.mailing = Mailing(message=message)
+        self.prepared = services.PreparedMessage(self.mailing)
+
+    def parse(self, data: bytes):
+        return message_from_bytes(data, policy=email_policy.default)
+
+    def test_to_and_message_id_per_recipient(self):
+        first = self.parse(self.prepared.render("first@example.com"))
+        second = self.parse(self.prepared.render("second@example.com"))
+
+        self.assertEqual(first.get_all("To"), ["first@example.com"])
+        self.assertEqual(second.get_all("To"), ["second@example.com"])
+        self.assertEqual(len(first.get_all("Message-ID")), 1)
+        self.assertNotEqual(first["Message-ID"], second["Message-ID"])
+
+        shared = self.parse(self.prepared.render_shared())
+        self.assertEqual(shared.get_all("To"), ["undisclosed-recipients:;"])
+
+    def test_non_ascii_subject_is_encoded(self):
+        data = self.prepared.render("client@example.com")
+        headers = data.split(b"\r\n\r\n", 1)[0]
+        self.assertTrue(headers.isascii())  # Тема кодируется по RFC 2047, тело Django передаёт как 8bit
+        self.assertEqual(self.parse(data)["Subject"], "Скидки недели: до 50%")
+
+    def test_idn_address_is_punycoded(self):
+        address = self.prepared.recipient_address("client@пример.рф")
+        self.assertEqual(address, "client@xn--e1afmkfd.xn--p1ai")
+        self.assertEqual(self.parse(self.prepared.render("client@пример.рф"))["To"], address)
+
+    def test_crlf_line_endings(self):
+        for data in (self.prepared.render("client@example.com"), self.prepared.render_shared()):
+            self.assertNotRegex(data, rb"(?<!\r)\n")
+            self.assertIn(b"\r\n\r\n", data)  # Пустая строка между заголовками и телом
+
+    def test_matches_email_message(self):
+        expected = services.build_message(self.mailing, "client@пример.рф").message()
+        actual = self.parse(self.prepared.render("client@пример.рф"))
+        expected = self.parse(expected.as_bytes(linesep="\r\n"))
+
+        for header in ("Subject", "From", "To", "Content-Type", "Content-Transfer-Encoding", "MIME-Version"):
+            with self.subTest(header=header):
+                self.assertEqual(actual[header], expected[header])
+        self.assertEqual(actual.get_content(), expected.get_content())
+
+
+@override_settings(MAILING_ENGINE="sync", MAILING_BATCH_SIZE=2)
+class SendMailingCommandTest(TestCase):
+    """Команда send_mailing: остановка рассылки пользователем во время отправки части."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = CustomUser.objects.create_user(email="command@example.com", username="command", password="x")
+        message = Message.objects.create(subject="Тема", body_text="Текст", owner=cls.owner)
+        cls.mailing = Mailing.objects.create(message=message, owner=cls.owner)
+        cls.mailing.recipients.set(
+            [Recipient.objects.create(email=f"command{i}@example.com", owner=cls.owner) for i in range(5)]
+        )
+
+    def test_cancelled_chunk_is_counted_and_stays_broken(self):
+        send_batch = services.send_batch
+
+        def send_and_cancel(*args, **kwargs):
+            results = send_batch(*args, **kwargs)
+            services.cancel_mailing(Mailing.objects.get(pk=self.mailing.pk))
+            return results
+
+        out = StringIO()
+        with mock.patch("postpilot.services.send_batch", side_effect=send_and_cancel, autospec=True):
+            call_command("send_mailing", self.mailing.pk, stdout=out)
+
+        self.mailing.refresh_from_db()
+        self.assertEqual(self.mailing.status, "broken")
+        self.assertIn(f"Рассылка {self.mailing.pk}: отправлено 2, ошибок 0.", out.getvalue())
+        stopped = SendAttempt.objects.get(mailing=self.mailing, status="broken")
+        self.assertEqual(
+            stopped.response, "Рассылка остановлена пользователем: отправлено 2, ошибок 0, не отправлено 3 писем."
+        )
+
+
+class FakeSMTPServer:
+    """SMTP-сервер для тестов асинхронного клиента: отвечает по словарю replies {команда или её глагол: ответ}
+    и запоминает полученные команды."""
+
+    def __init__(self, replies: dict = None, greeting: bytes = b"220 fake\r\n"):
+        self.replies = {"EHLO": b"250-fake\r\n250 AUTH PLAIN\r\n", **(replies or {})}
+        self.greeting = greeting
+        self.commands = []
+
+    async def handle(self, reader, writer):
+        writer.write(self.greeting)
+        while line := await reader.readline():
+            command = line.decode().rstrip("\r\n")
+            self.commands.append(command)
+            if command == "DATA":
+                writer.write(self.replies.get("DATA", b"354 go\r\n"))
+                while (await reader.readline()) != b".\r\n":
+                    pass
+                writer.write(b"250 queued\r\n")
+                continue
+            # Ответ на команду целиком (например, RCPT TO:<адрес>) или на её глагол
+            verb = command.split(" ")[0].split(":")[0]
+            writer.write(self.replies.get(command, self.replies.get(verb, b"250 ok\r\n")))
+            if command == "QUIT":
+                break
+        writer.close()
+
+    async def connection(self, **kwargs) -> AsyncSMTPConnection:
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        port = self.server.sockets[0].getsockname()[1]
+        return AsyncSMTPConnection("127.0.0.1", port, timeout=5, **kwargs)
+
+
+class AsyncSMTPConnectionTest(SimpleTestCase):
+    """Асинхронный SMTP-клиент: команды конверта, неудачное подключение и неверные ответы сервера."""
+
+    def test_envelope_uses_bare_addresses(self):
+        async def scenario():
+            server = FakeSMTPServer()
+            connection = await server.connection()
+            await connection.connect()
+            await connection.sendmail("PostPilot <noreply@example.com>", ["r@example.com"], b"Subject: x\r\n\r\nx")
+            await connection.close()
+            return server.commands
+
+        commands = asyncio.run(scenario())
+        self.assertIn("MAIL FROM:<noreply@example.com>", commands)
+        self.assertIn("RCPT TO:<r@example.com>", commands)
+
+    def test_failed_auth_closes_session(self):
+        async def scenario():
+            server = FakeSMTPServer({"AUTH": b"535 bad credentials\r\n"})
+            connection = await server.connection(username="user", password="wrong")
+            with self.assertRaises(AsyncSMTPError):
+                await connection.connect()
+            return connection.is_connected
+
+        self.assertFalse(asyncio.run(scenario()))
+
+    def test_malformed_reply_is_protocol_error(self):
+        async def scenario():
+            server = FakeSMTPServer(greeting=b"hello there\r\n")
+            connection = await server.connection()
+            with self.assertRaises(AsyncSMTPProtocolError):
+                await connection.connect()
+            return connection.is_connected
+
+        self.assertFalse(asyncio.run(scenario()))
+
+
+class RecordingSMTPConnection:
+    """Сессия пула для тестов планирования: запоминает порядок транзакций и число одновременных транзакций."""
+
+    def __init__(self, log: list, running: list):
+        self.log = log
+        self.running = running
+        self.is_connected = True
+
+    async def sendmail(self, from_addr: str, to_addrs: list, data: bytes) -> dict:
+        self.running[0] += 1
+        self.running[1] = max(self.running[1], self.running[0])
+        self.log.append(to_addrs)
+        await asyncio.sleep(0.001)
+        self.running[0] -= 1
+        return {}
+
+    async def close(self):
+        self.is_connected = False
+
+
+class AsyncSMTPPoolTest(SimpleTestCase):
+    """План отправки пачки: корзины по доменам, обход корзин по кругу, предел сессий на корзину, отказы RCPT."""
+
+    def setUp(self):
+        self.prepared = services.PreparedMessage(Mailing(message=Message(subject="Тема", body_text="Текст")))
+
+    def pool(self, size: int) -> tuple:
+        """Пул из size записывающих сессий, журнал их транзакций и [текущее, наибольшее] число транзакций."""
+        log, running = [], [0, 0]
+        pool = AsyncSMTPPool(size)
+        pool.connections = [RecordingSMTPConnection(log, running) for _ in range(size)]
+        return pool, log, running
+
+    def transactions(self, domain: str, number: int, start: int = 0) -> list:
+        """Корзина из number транзакций на одного получателя домена domain; индексы писем - с start."""
+        return [([index], [f"r{index}@{domain}"], b"x") for index in range(start, start + number)]
+
+    def test_plan_groups_by_domain_and_rcpt_limit(self):
+        batch = [(1, "a@x.com"), (2, "b@y.com"), (3, "c@X.com"), (4, "d@x.com"), (5, "e@y.com")]
+        plan = services.plan_transactions(self.prepared, batch, rcpt_limit=2)
+
+        self.assertEqual([[chunk for chunk, _, _ in bucket] for bucket in plan], [[[0, 2], [3]], [[1, 4]]])
+        self.assertEqual(plan[0][0][1], ["a@x.com", "c@X.com"])
+        shared, single = plan[0][0][2], plan[0][1][2]
+        self.assertIn(b"To: undisclosed-recipients:;\r\n", shared)
+        self.assertIn(b"To: d@x.com\r\n", single)
+
+    def test_buckets_are_served_round_robin(self):
+        pool, log, _ = self.pool(1)
+        buckets = [self.transactions("x.com", 3), self.transactions("y.com", 3, start=3)]
+        asyncio.run(pool.send_planned("noreply@example.com", buckets, total=6))
+
+        domains = [to_addrs[0].rpartition("@")[2] for to_addrs in log]
+        self.assertEqual(domains, ["x.com", "y.com"] * 3)
+
+    def test_per_bucket_limits_sessions(self):
+        pool, log, running = self.pool(4)
+        results = asyncio.run(
+            pool.send_planned("noreply@example.com", [self.transactions("x.com", 6)], total=6, per_bucket=2)
+        )
+
+        self.assertEqual(len(log), 6)
+        self.assertEqual(running[1], 2)
+        self.assertEqual([status for status, _, _ in results], ["successfully"] * 6)
+
+    def test_multi_rcpt_with_refused_recipients(self):
+        async def scenario():
+            server = FakeSMTPServer(
+                {"RCPT TO:<gone@x.com>": b"550 no such user\r\n", "RCPT TO:<busy@x.com>": b"451 try later\r\n"}
+            )
+            connection = await server.connection()
+            pool = AsyncSMTPPool(1)
+            pool.connections = [connection]
+            to_addrs = ["ok@x.com", "gone@x.com", "busy@x.com"]
+            results = await pool.send_planned("noreply@example.com", [[([0, 1, 2], to_addrs, b"x")]], total=3)
+            await pool.close()
+            return results, server.commands
+
+        results, commands = asyncio.run(scenario())
+        self.assertEqual([status for status, _, _ in results], ["successfully", "failed", "deferred"])
+        self.assertIn("550", results[1][1])
+        self.assertEqual(commands.count("DATA"), 1)  # Письмо передано один раз - принятому получателю
+
+
+class FakeClock:
+    """Часы для тестов: time.time() возвращает now, время сдвигается вручную (advance)."""
+
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class TokenBucketTest(SimpleTestCase):
+    """Ограничение скорости: запас burst токенов, пополнение со скоростью rate, пауза по ответу 421/451."""
+
+    def setUp(self):
+        cache.clear()
+        self.clock = FakeClock()
+        patcher = mock.patch("time.time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_burst_then_refill_at_rate(self):
+        bucket = TokenBucket("test:bucket", rate=4, burst=5)
+        self.assertEqual(bucket.take(5), 0)
+        self.assertEqual(bucket.take(1), 0.25)
+
+        self.clock.advance(0.75)
+        self.assertEqual(bucket.take(3), 0)
+        self.assertEqual(bucket.take(1), 0.25)
+
+    def test_refill_is_capped_by_burst(self):
+        bucket = TokenBucket("test:bucket", rate=4, burst=5)
+        bucket.take(5)
+        self.clock.advance(60)
+        self.assertEqual(bucket.take(5), 0)
+        self.assertEqual(bucket.take(1), 0.25)
+
+    def test_pause_delays_next_token(self):
+        bucket = TokenBucket("test:bucket", rate=4, burst=5)
+        bucket.pause(2)
+        self.assertEqual(bucket.take(1), 2.25)
+        self.clock.advance(2.25)
+        self.assertEqual(bucket.take(1), 0)
+
+    def test_limiter_reserves_tokens_in_portions(self):
+        bucket = TokenBucket("test:bucket", rate=4, burst=5)
+        limiter = RateLimiter([bucket], host_bucket=bucket, reserve=3)
+        with mock.patch.object(bucket, "take", wraps=bucket.take) as take:
+            for _ in range(3):
+                self.assertEqual(limiter.reserve_one(), 0)
+        self.assertEqual(take.call_count, 1)
+
+    def test_limiter_falls_back_to_single_token(self):
+        bucket = TokenBucket("test:bucket", rate=4, burst=5)
+        limiter = RateLimiter([bucket], host_bucket=bucket, reserve=3)
+        bucket.take(4)  # Остался один токен - порцию не дают, но письмо уходит
+        self.assertEqual(limiter.reserve_one(), 0)
+        self.assertEqual(limiter.reserve_one(), 0.25)
+
+    def test_throttled_pauses_host_and_drops_reserve(self):
+        bucket = TokenBucket("test:bucket", rate=4, burst=5)
+        limiter = RateLimiter([bucket], host_bucket=bucket, reserve=3)
+        limiter.reserve_one()
+
+        asyncio.run(limiter.throttled_async(421))
+        self.assertGreater(limiter.reserve_one(), 0)
+
+        limiter.throttled(550)  # Постоянная ошибка - не повод тормозить
+        self.clock.advance(settings.MAILING_RATE_THROTTLE_PAUSE + 1)
+        self.assertEqual(limiter.reserve_one(), 0)
+
+    def test_wait_async_sleeps_until_token(self):
+        bucket = TokenBucket("test:bucket", rate=4, burst=1)
+        limiter = RateLimiter([bucket], reserve=1)
+        sleeps = []
+
+        async def fake_sleep(seconds):
+            sleeps.append(seconds)
+            self.clock.advance(seconds)
+
+        async def scenario():
+            with mock.patch("asyncio.sleep", fake_sleep):
+                for _ in range(3):
+                    await limiter.wait_async()
+
+        asyncio.run(scenario())
+        self.assertEqual(sleeps, [0.25, 0.25])
+
+
+class RefusingBackend(BaseEmailBackend):
+    """Почтовый бэкенд для тестов: письма на адреса из refused отклоняются с заданным кодом ответа SMTP."""
+
+    def __init__(self, refused: dict = None, **kwargs):
+        super().__init__(**kwargs)
+        self.refused = refused or {}
+        self.sent = []
+
+    def send_messages(self, email_messages):
+        for message in email_messages:
+            code = self.refused.get(message.to[0])
+            if code is not None:
+                raise smtplib.SMTPResponseException(code, b"refused")
+            self.sent.append(message.to[0])
+        return len(email_messages)
+
+
+@override_settings(CACHES=LOCMEM_CACHE, MAILING_ENGINE="sync", MAILING_BATCH_SIZE=2, MAILING_FETCH_SIZE=2)
+class DeliverTest(TestCase):
+    """Отправка пачками: получатели читаются порциями по ключу, попытки записываются буфером, журнал доставки
+    отмечается по каждой пачке."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = CustomUser.objects.create_user(email="deliver@example.com", username="deliver", password="x")
+        message = Message.objects.create(subject="Тема", body_text="Текст", owner=cls.owner)
+        cls.mailing = Mailing.objects.create(message=message, owner=cls.owner)
+        cls.recipients = [Recipient.objects.create(email=f"d{i}@example.com", owner=cls.owner) for i in range(7)]
+        cls.mailing.recipients.set(cls.recipients)
+
+    def setUp(self):
+        cache.clear()
+        services.prepare_deliveries(self.mailing)
+
+    def test_pending_recipients_are_streamed_by_key(self):
+        done = self.recipients[1]
+        self.mailing.deliveries.filter(recipient=done).update(status="sent")
+
+        with CaptureQueriesContext(connection) as queries:
+            rows = list(services.iter_pending_recipients(self.mailing))
+        expected = [(recipient.pk, recipient.email) for recipient in self.recipients if recipient != done]
+        self.assertEqual(rows, expected)
+        self.assertEqual(len(queries), 4)  # 6 получателей порциями по 2 и пустая порция после полной последней
+        for query in queries:
+            self.assertIn("LIMIT 2", query["sql"])
+            self.assertNotIn("OFFSET", query["sql"])
+
+        first, last = self.recipients[2].pk, self.recipients[4].pk
+        self.assertEqual(
+            [pk for pk, _ in services.iter_pending_recipients(self.mailing, first, last)],
+            [recipient.pk for recipient in self.recipients[2:5]],
+        )
+
+    def test_attempt_writer_flushes_at_size_and_on_exit(self):
+        fields = {"mailing": self.mailing, "recipient": self.recipients[0], "owner": self.owner}
+
+        with self.assertRaises(RuntimeError), AttemptWriter(flush_size=2, flush_interval=3600) as writer:
+            writer.add(status="successfully", **fields)
+            self.assertEqual(SendAttempt.objects.count(), 0)
+            writer.add(status="successfully", **fields)
+            self.assertEqual(SendAttempt.objects.count(), 2)
+            writer.add(status="failed", **fields)
+            self.assertEqual(SendAttempt.objects.count(), 2)
+            raise RuntimeError  # Остаток буфера сохраняется и при выходе по ошибке
+
+        self.assertEqual(SendAttempt.objects.count(), 3)
+        self.assertEqual(writer.written, 3)
+
+    def test_deliver_records_every_recipient(self):
+        refused = {"d1@example.com": 451, "d4@example.com": 550}
+        backend = RefusingBackend(refused)
+
+        with mock.patch("postpilot.services.AttemptWriter", wraps=AttemptWriter) as writer:
+            counters = services.deliver(self.mailing, services.iter_pending_recipients(self.mailing), backend)
+        writer.assert_called_once()  # Один буфер попыток на всю отправку
+
+        self.assertEqual(counters, {"sent": 5, "failed": 2})
+        self.assertEqual(backend.sent, [r.email for r in self.recipients if r.email not in refused])
+        statuses = dict(self.mailing.deliveries.values_list("recipient__email", "status"))
+        self.assertEqual(
+            statuses,
+            {r.email: "sent" for r in self.recipients} | {"d1@example.com": "deferred", "d4@example.com": "failed"},
+        )
+        attempts = dict(SendAttempt.objects.filter(mailing=self.mailing).values_list("recipient__email", "status"))
+        self.assertEqual(
+            attempts, {r.email: "successfully" for r in self.recipients} | {email: "failed" for email in refused}
+        )
+
+
+class RetryPolicyTest(SimpleTestCase):
+    """Политика повторов: классификация ошибок и экспоненциальная пауза с разбросом."""
+
+    def test_classification(self):
+        self.assertEqual(failure_status(421), "deferred")
+        self.assertEqual(failure_status(451), "deferred")
+        self.assertEqual(failure_status(550), "failed")
+        self.assertEqual(failure_status(None), "failed")  # Ответа сервера нет - повторять нечего
+
+    @override_settings(MAILING_RETRY_BASE_DELAY=60, MAILING_RETRY_MAX_DELAY=300)
+    def test_delay_doubles_up_to_max(self):
+        with mock.patch("random.uniform", lambda low, high: high):
+            self.assertEqual([retry_delay(attempts) for attempts in range(1, 6)], [60, 120, 240, 300, 300])
+        with mock.patch("random.uniform", lambda low, high: low):
+            self.assertEqual(retry_delay(2), 60)
+
+    @override_settings(MAILING_RETRY_MAX_ATTEMPTS=3)
+    def test_attempts_are_limited(self):
+        self.assertIsNotNone(next_attempt_at(2))
+        self.assertIsNone(next_attempt_at(3))
+
+
+@override_settings(CACHES=LOCMEM_CACHE, MAILING_ENGINE="sync", MAILING_RETRY_MAX_ATTEMPTS=2)
+class RetryDeliveriesTest(TestCase):
+    """Повторная отправка: повторяются только отложенные письма, после исчерпания попыток письмо не повторяется."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = CustomUser.objects.create_user(email="retry@example.com", username="retry", password="x")
+        message = Message.objects.create(subject="Тема", body_text="Текст", owner=cls.owner)
+        cls.mailing = Mailing.objects.create(message=message, owner=cls.owner)
+        cls.mailing.recipients.set(
+            [
+                Recipient.objects.create(email=email, owner=cls.owner)
+                for email in ("ok@example.com", "busy@example.com", "gone@example.com")
+            ]
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def make_due(self):
+        """Сдвигает срок повтора отложенных писем в прошлое."""
+        self.mailing.deliveries.filter(status="deferred").update(next_attempt_at=now() - timedelta(seconds=1))
+
+    def statuses(self) -> dict:
+        return dict(self.mailing.deliveries.values_list("recipient__email", "status"))
+
+    def test_only_deferred_recipients_are_retried(self):
+        backend = RefusingBackend({"busy@example.com": 451, "gone@example.com": 550})
+        self.assertEqual(send_mailing(self.mailing, connection=backend), {"sent": 1, "failed": 2})
+        self.assertEqual(
+            self.statuses(), {"ok@example.com": "sent", "busy@example.com": "deferred", "gone@example.com": "failed"}
+        )
+        self.mailing.refresh_from_db()
+        self.assertEqual(self.mailing.status, "started")  # Ждёт повтора
+
+        self.assertEqual(retry_deliveries(connection=RefusingBackend()), {"sent": 0, "failed": 0})  # Срок не наступил
+
+        self.make_due()
+        retry_backend = RefusingBackend()
+        self.assertEqual(retry_deliveries(connection=retry_backend), {"sent": 1, "failed": 0})
+        self.assertEqual(retry_backend.sent, ["busy@example.com"])
+        self.assertEqual(self.statuses()["busy@example.com"], "sent")
+        self.mailing.refresh_from_db()
+        self.assertEqual(self.mailing.status, "completed")
+
+    def test_exhausted_attempts_fail(self):
+        backend = RefusingBackend({"busy@example.com": 451})
+        send_mailing(self.mailing, connection=backend)
+        self.make_due()
+        retry_deliveries(connection=backend)
+
+        delivery = self.mailing.deliveries.get(recipient__email="busy@example.com")
+        self.assertEqual((delivery.status, delivery.attempts, delivery.next_attempt_at), ("failed", 2, None))
+        self.mailing.refresh_from_db()
+        self.assertEqual(self.mailing.status, "completed")
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class MailingSchedulerTest(TestCase):
+    """Планировщик: наступившие рассылки ставятся в очередь один раз, перенесённые и удалённые - забываются."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = CustomUser.objects.create_user(email="schedule@example.com", username="schedule", password="x")
+        cls.message = Message.objects.create(subject="Тема", body_text="Текст", owner=cls.owner)
+
+    def make_mailing(self, seconds: float) -> Mailing:
+        """Рассылка, запланированная через seconds секунд (отрицательное - уже просрочена)."""
+        return Mailing.objects.create(
+            message=self.message, owner=self.owner, scheduled_at=now() + timedelta(seconds=seconds)
+        )
+
+    def test_due_mailing_is_enqueued_once(self):
+        due = self.make_mailing(-1)
+        later = self.make_mailing(30)
+        scheduler = MailingScheduler(lookahead=60, refresh_interval=10)
+
+        self.assertEqual(scheduler.tick(), [due.pk])
+        self.assertEqual(scheduler.tick(), [])
+        due.refresh_from_db()
+        self.assertIsNone(due.scheduled_at)
+        self.assertEqual(MailingJob.objects.get().mailing_id, due.pk)
+        self.assertEqual(scheduler.known, {later.pk: later.scheduled_at})
+        self.assertLessEqual(scheduler.seconds_until_next(), 30)
+
+    def test_second_scheduler_does_not_claim_again(self):
+        due = self.make_mailing(-1)
+        first = MailingScheduler(lookahead=60)
+        second = MailingScheduler(lookahead=60)
+        first.refresh()
+        second.refresh()
+
+        self.assertEqual(first.dispatch_due(), [due.pk])
+        self.assertEqual(second.dispatch_due(), [])
+        self.assertEqual(MailingJob.objects.count(), 1)
+
+    def test_rescheduled_mailing_waits_for_new_time(self):
+        mailing = self.make_mailing(-1)
+        scheduler = MailingScheduler(lookahead=60)
+        scheduler.refresh()
+
+        Mailing.objects.filter(pk=mailing.pk).update(scheduled_at=now() + timedelta(seconds=30))
+        self.assertEqual(scheduler.dispatch_due(), [])  # Захват по старому времени не проходит
+        self.assertFalse(MailingJob.objects.exists())
+
+    def test_refresh_forgets_deleted_and_postponed_mailings(self):
+        deleted = self.make_mailing(30)
+        postponed = self.make_mailing(30)
+        scheduler = MailingScheduler(lookahead=60)
+        scheduler.refresh()
+
+        deleted.delete()
+        Mailing.objects.filter(pk=postponed.pk).update(scheduled_at=now() + timedelta(days=1))
+        scheduler.refresh()
+        self.assertEqual(scheduler.known, {})
+        self.assertEqual(scheduler.heap, [])
+
+    def test_command_survives_database_error(self):
+        due = self.make_mailing(-1)
+        tick = MailingScheduler.tick
+        calls = count()
+
+        def flaky_tick(scheduler):
+            if next(calls) == 0:
+                raise OperationalError("server closed the connection unexpectedly")
+            dispatched = tick(scheduler)
+            os.kill(os.getpid(), signal.SIGTERM)  # Команда завершается после этого шага
+            return dispatched
+
+        out = StringIO()
+        with mock.patch.object(MailingScheduler, "tick", flaky_tick), self.assertLogs(
+            "postpilot.management.commands.run_scheduler", "ERROR"
+        ):
+            call_command("run_scheduler", refresh_interval=0.01, stdout=out)
+        self.assertIn(f"Рассылка {due.pk} поставлена в очередь.", out.getvalue())
+        self.assertEqual(MailingJob.objects.get().mailing_id, due.pk)
+
+
+@override_settings(
+    MAILING_CONCURRENCY_DEFERRAL_TOLERANCE=0.1,
+    MAILING_CONCURRENCY_LATENCY_TOLERANCE=2,
+    MAILING_CONCURRENCY_DECREASE=0.5,
+)
+class AIMDControllerTest(SimpleTestCase):
+    """Регулятор одновременных отправок: рост без перегрузки, однократное снижение при перегрузке."""
+
+    def test_slow_start_then_additive_increase(self):
+        controller = AIMDController(1, 10)
+        for _ in range(3):
+            controller._observe(time.monotonic(), 0.01, deferred=False)
+        self.assertEqual(controller.limit, 4)  # До первой перегрузки - на единицу за транзакцию
+
+        controller._observe(time.monotonic(), 1.0, deferred=False)
+        self.assertEqual((controller.limit, controller.decreases), (2, 1))
+
+        controller.latency = controller.baseline  # Сервер снова отвечает быстро
+        controller._observe(time.monotonic(), controller.baseline, deferred=False)
+        self.assertEqual(controller.limit, 2.5)  # После перегрузки - на единицу за окно из limit транзакций
+
+    def test_limit_stays_within_bounds(self):
+        controller = AIMDController(2, 3)
+        for _ in range(5):
+            controller._observe(time.monotonic(), 0.01, deferred=False)
+        self.assertEqual(controller.limit, 3)
+
+        for _ in range(5):
+            controller._observe(time.monotonic(), 1.0, deferred=False)
+        self.assertEqual(controller.limit, 2)
+
+    def test_congestion_is_counted_once(self):
+        controller = AIMDController(1, 16)
+        controller.limit = 16
+        controller._observe(time.monotonic(), 0.01, deferred=False)
+
+        started = [time.monotonic() for _ in range(3)]  # Транзакции, начатые до перегрузки
+        for acquired_at in started:
+            controller._observe(acquired_at, 1.0, deferred=False)
+        self.assertEqual((controller.limit, controller.decreases), (8, 1))
+
+    def test_repeated_deferrals_decrease_limit(self):
+        controller = AIMDController(1, 16)
+        controller.limit = 16
+        controller._observe(time.monotonic(), 0.01, deferred=False)
+        controller._observe(time.monotonic(), 0.01, deferred=True)
+        self.assertEqual(controller.limit, 16)  # Единичный отказ предел не снижает
+
+        for _ in range(10):
+            controller._observe(time.monotonic(), 0.01, deferred=True)
+        self.assertLess(controller.limit, 16)
+
+    def test_acquire_waits_for_free_slot(self):
+        controller = AIMDController(1, 1)
+        order = []
+
+        async def transaction_(name):
+            acquired_at = await controller.acquire()
+            order.append(f"{name}+")
+            await asyncio.sleep(0)
+            order.append(f"{name}-")
+            await controller.release(acquired_at, 0.01)
+
+        async def scenario():
+            await asyncio.gather(transaction_("a"), transaction_("b"))
+
+        asyncio.run(scenario())
+        self.assertEqual(order, ["a+", "a-", "b+", "b-"])
+
+
+def _raise_relay_unavailable():
+    """Выбрасывает RelayUnavailable в процессе пула (функция модуля - её можно передать процессу)."""
+    raise RelayUnavailable("SMTP-сервер недоступен.", 30)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class CircuitBreakerTest(SimpleTestCase):
+    """Выключатель SMTP-сервера: размыкание после threshold ошибок, одно пробное подключение, замыкание."""
+
+    def setUp(self):
+        cache.clear()
+        self.clock = FakeClock()
+        patcher = mock.patch("time.time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker("test:breaker", threshold=2, cooldown=30)
+
+    def fail_connect(self):
+        with self.assertRaises(RelayUnavailable), self.breaker.guard():
+            raise ConnectionRefusedError
+
+    def test_opens_after_threshold(self):
+        self.fail_connect()
+        self.breaker.check()  # Одна ошибка - выключатель ещё замкнут
+        self.fail_connect()
+
+        with self.assertRaises(RelayUnavailable) as raised:
+            self.breaker.check()
+        self.assertEqual(raised.exception.retry_after, 30)
+
+    def test_single_probe_after_cooldown(self):
+        self.fail_connect()
+        self.fail_connect()
+        self.clock.advance(31)
+
+        with self.breaker.guard():
+            with self.assertRaises(RelayUnavailable), self.breaker.guard():
+                pass  # Второй процесс ждёт результата пробного подключения
+        self.breaker.check()
+        with self.breaker.guard():
+            pass  # Выключатель замкнут - подключения больше не пробные
+
+    def test_failed_probe_opens_again(self):
+        self.fail_connect()
+        self.fail_connect()
+        self.clock.advance(31)
+
+        self.fail_connect()
+        with self.assertRaises(RelayUnavailable):
+            self.breaker.check()
+
+    def test_success_resets_failures(self):
+        self.fail_connect()
+        with self.breaker.guard():
+            pass
+        self.fail_connect()
+        self.breaker.check()
+
+    def test_relay_unavailable_survives_pickle(self):
+        error = pickle.loads(pickle.dumps(RelayUnavailable("SMTP-сервер недоступен.", 30)))
+        self.assertEqual((str(error), error.retry_after), ("SMTP-сервер недоступен.", 30))
+
+    def test_relay_unavailable_crosses_process_pool(self):
+        # Исключение процесса пула доходит до родителя, а не ломает пул (BrokenProcessPool)
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("fork")) as executor:
+            with self.assertRaises(RelayUnavailable) as raised:
+                executor.submit(_raise_relay_unavailable).result()
+        self.assertEqual(raised.exception.retry_after, 30)
+
+    def test_server_replies_are_not_connection_errors(self):
+        for _ in range(3):
+            with self.assertRaises(smtplib.SMTPAuthenticationError), self.breaker.guard():
+                raise smtplib.SMTPAuthenticationError(535, b"bad credentials")
+        self.breaker.check()
+
+
+class KeysetPaginationTest(TestCase):
+    """Keyset-пагинация: обход страниц по курсору проходит все объекты ровно один раз, включая пустые и равные
+    значения поля сортировки."""
+
+    @classmethod
+    def setUpTestData(cls):
+        owner = CustomUser.objects.create_user(email="pages@example.com", username="pages", password="x")
+        message = Message.objects.create(subject="Тема", body_text="Текст", owner=owner)
+        moment = now()
+        values = [None, None, moment, moment, moment, moment - timedelta(seconds=1), None]
+        for value in values:
+            mailing = Mailing.objects.create(message=message, owner=owner)
+            Mailing.objects.filter(pk=mailing.pk).update(sent_completed_at=value)  # auto_now не даёт задать значение
+
+    def pager(self, keyset_field: str = None) -> KeysetPaginationMixin:
+        pager = KeysetPaginationMixin()
+        pager.keyset_field = keyset_field
+        return pager
+
+    def walk(self, pager: KeysetPaginationMixin, page_size: int) -> list:
+        """Обходит рассылки страницами по page_size, возвращает pk в порядке обхода."""
+        if pager.keyset_field:
+            ordered = Mailing.objects.order_by(F(pager.keyset_field).desc(nulls_first=True), "-pk")
+        else:
+            ordered = Mailing.objects.order_by("-pk")
+
+        seen = []
+        cursor = None
+        while True:
+            queryset = ordered.filter(pager.after_cursor(Mailing, cursor)) if cursor else ordered
+            page = list(queryset[:page_size])
+            if not page:
+                return seen
+            seen.extend(mailing.pk for mailing in page)
+            cursor = pager.make_cursor(page[-1])
+
+    def test_walk_with_nulls_and_ties(self):
+        expected = list(
+            Mailing.objects.order_by(F("sent_completed_at").desc(nulls_first=True), "-pk").values_list("pk", flat=True)
+        )
+        for page_size in (1, 2, 3, 10):
+            self.assertEqual(self.walk(self.pager("sent_completed_at"), page_size), expected)
+
+    def test_walk_by_pk(self):
+        expected = list(Mailing.objects.order_by("-pk").values_list("pk", flat=True))
+        self.assertEqual(self.walk(self.pager(), 3), expected)
+
+    def test_cursor_condition_bounds_index_range(self):
+        pager = self.pager("sent_completed_at")
+        mailing = Mailing.objects.exclude(sent_completed_at=None).first()
+        sql = str(Mailing.objects.filter(pager.after_cursor(Mailing, pager.make_cursor(mailing))).query)
+        # Верхняя граница поля сортировки стоит отдельным условием через AND, а не только внутри OR
+        self.assertRegex(sql, r'WHERE \("mailings"\."sent_completed_at" <= [^()]+ AND \(')
+
+    def test_cursor_round_trip(self):
+        pager = self.pager("sent_completed_at")
+        mailing = Mailing.objects.exclude(sent_completed_at=None).first()
+        cursor = pager.make_cursor(mailing)
+        value, pk = json.loads(base64.urlsafe_b64decode(cursor))
+        self.assertEqual((value, pk), (mailing.sent_completed_at.isoformat(), mailing.pk))
+
+    def test_invalid_cursor_is_not_found(self):
+        pager = self.pager("sent_completed_at")
+        for cursor in ("garbage", base64.urlsafe_b64encode(b"[1]").decode(), pager.make_cursor(Mailing(pk=1))[:-4]):
+            with self.subTest(cursor=cursor), self.assertRaises(Http404):
+                pager.after_cursor(Mailing, cursor)
+
+        bad_date = base64.urlsafe_b64encode(json.dumps(["not a date", 1]).encode()).decode()
+        with self.assertRaises(Http404):
+            pager.after_cursor(Mailing, bad_date)
+
+
+@override_settings(CACHES=NO_CACHE)
+class ArchiveTest(TestCase):
+    """Архив попыток: перенос пачками в части по рассылке и месяцу, итоги в сводке, чтение в порядке времени."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = CustomUser.objects.create_user(email="archive@example.com", username="archive", password="x")
+        message = Message.objects.create(subject="Тема", body_text="Текст", owner=cls.owner)
+        cls.mailing = Mailing.objects.create(message=message, owner=cls.owner)
+        cls.recipient = Recipient.objects.create(email="archived@example.com", owner=cls.owner)
+
+        # Пять попыток в январе (одна неудачная), две - в феврале, одна свежая
+        cls.times = [datetime(2025, 1, day, 12, tzinfo=dt_timezone.utc) for day in range(1, 6)]
+        cls.times += [datetime(2025, 2, day, 12, tzinfo=dt_timezone.utc) for day in (1, 2)]
+        for number, attempt_at in enumerate(cls.times + [now()]):
+            attempt = SendAttempt.objects.create(
+                mailing=cls.mailing,
+                recipient=cls.recipient,
+                status="failed" if number == 2 else "successfully",
+                response=f"Ответ {number}",
+                owner=cls.owner,
+            )
+            SendAttempt.objects.filter(pk=attempt.pk).update(attempt_at=attempt_at)  # auto_now_add
+
+    def test_pack_round_trip(self):
+        rows = list(SendAttempt.objects.order_by("attempt_at").values(*ARCHIVE_FIELDS)[:3])
+        self.assertEqual(unpack(pack(rows)), rows)
+
+    def test_batches_append_chunks(self):
+        archived = archive_attempts(datetime(2025, 3, 1, tzinfo=dt_timezone.utc), batch_size=2)
+        self.assertEqual(archived, 7)
+        self.assertEqual(SendAttempt.objects.count(), 1)  # Свежая попытка осталась в рабочей таблице
+
+        # Пачки по 2 попытки: январь - части 2 + 2 + 1, февраль - 1 + 1 (пачка на стыке месяцев делится)
+        chunks = list(self.mailing.attempt_archives.order_by("month", "seq"))
+        self.assertEqual(
+            [(chunk.month, chunk.attempts) for chunk in chunks],
+            [
+                (date(2025, 1, 1), 2),
+                (date(2025, 1, 1), 2),
+                (date(2025, 1, 1), 1),
+                (date(2025, 2, 1), 1),
+                (date(2025, 2, 1), 1),
+            ],
+        )
+        self.assertEqual(
+            [(chunk.first_attempt_at, chunk.last_attempt_at) for chunk in chunks[:2]],
+            [(self.times[0], self.times[1]), (self.times[2], self.times[3])],
+        )
+
+        summary = self.mailing.attempt_summary
+        self.assertEqual((summary.attempts, summary.successful, summary.failed), (7, 6, 1))
+        self.assertEqual((summary.first_attempt_at, summary.last_attempt_at), (self.times[0], self.times[-1]))
+
+    def test_written_chunks_are_not_rewritten(self):
+        archive_attempts(datetime(2025, 1, 3, tzinfo=dt_timezone.utc), batch_size=10)
+        first = self.mailing.attempt_archives.get()
+
+        with CaptureQueriesContext(connection) as queries:
+            archive_attempts(datetime(2025, 3, 1, tzinfo=dt_timezone.utc), batch_size=10)
+        archive_queries = [q["sql"] for q in queries if "send_attempt_archives" in q["sql"]]
+        self.assertTrue(all(sql.startswith("INSERT") for sql in archive_queries), archive_queries)
+
+        self.assertEqual(self.mailing.attempt_archives.get(pk=first.pk).data, first.data)
+        self.assertEqual(self.mailing.attempt_archives.count(), 3)  # Январь: 2 + 3, февраль: 2
+
+    def test_overlapping_chunks_are_merged_in_order(self):
+        # Параллельные переносы могут записать части одного месяца, перекрывающиеся по времени
+        rows = list(
+            SendAttempt.objects.filter(attempt_at__lt=self.times[5])
+            .order_by("attempt_at")
+            .values("owner_id", *ARCHIVE_FIELDS)
+        )
+        for part in (rows[::2], rows[1::2]):
+            SendAttemptArchive.objects.create(
+                mailing=self.mailing,
+                owner=self.owner,
+                month=date(2025, 1, 1),
+                seq=part[0]["id"],
+                first_attempt_at=part[0]["attempt_at"],
+                last_attempt_at=part[-1]["attempt_at"],
+                attempts=len(part),
+                data=pack(part),
+            )
+        self.assertEqual([row["attempt_at"] for row in archived_attempts(self.mailing)], self.times[:5])
+
+    def test_archived_attempts_are_read_in_order(self):
+        archive_attempts(datetime(2025, 3, 1, tzinfo=dt_timezone.utc), batch_size=3)
+        self.assertEqual([row["attempt_at"] for row in archived_attempts(self.mailing)], self.times)
+        self.assertEqual(
+            [row["response"] for row in archived_attempts(self.mailing, month=date(2025, 2, 14))],
+            ["Ответ 5", "Ответ 6"],
+        )
+
+    def test_stats_include_archive(self):
+        before = dashboard_stats(self.owner)
+        archive_attempts(datetime(2025, 3, 1, tzinfo=dt_timezone.utc), batch_size=4)
+        self.assertEqual(dashboard_stats(self.owner), before)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ResultCacheTest(TestCase):
+    """Кэш результатов: прочитанное из кэша не устаревает после записи, запись попыток не сбрасывает чужие модели."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = CustomUser.objects.create_user(email="cache@example.com", username="cache", password="x")
+        cls.message = Message.objects.create(subject="Тема", body_text="Текст", owner=cls.owner)
+        cls.mailing = Mailing.objects.create(message=cls.message, owner=cls.owner)
+        cls.recipient = Recipient.objects.create(email="cached@example.com", owner=cls.owner)
+
+    def setUp(self):
+        cache.clear()
+
+    def mailings(self) -> list:
+        return cached_objects(Mailing.objects.filter(owner=self.owner).select_related("message"), self.owner.pk)
+
+    def attempts(self) -> list:
+        return cached_pks(SendAttempt.objects.filter(owner=self.owner).order_by("pk"), self.owner.pk)
+
+    def test_cached_read_is_fresh_after_write(self):
+        self.assertEqual(self.mailings()[0].message.subject, "Тема")
+        with self.assertNumQueries(0):
+            self.mailings()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.objects.filter(pk=self.message.pk).update(subject="Новая тема")  # Без сигнала - кэш не знает
+            self.message.subject = "Новая тема"
+            self.message.save()  # Сообщение читается через select_related
+        self.assertEqual(self.mailings()[0].message.subject, "Новая тема")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.mailing.recipients.add(self.recipient)
+        self.assertEqual(
+            cached_pks(Mailing.objects.filter(recipients=self.recipient), self.owner.pk), [self.mailing.pk]
+        )
+
+    def test_attempt_writes_keep_other_models_cached(self):
+        self.mailings()
+        self.assertEqual(self.attempts(), [])
+
+        with self.captureOnCommitCallbacks(execute=True), AttemptWriter(flush_size=10) as writer:
+            writer.add(mailing=self.mailing, recipient=self.recipient, status="successfully", owner=self.owner)
+        with self.assertNumQueries(0):
+            self.mailings()
+        self.assertEqual(len(self.attempts()), 1)
+
+    def test_mailing_delete_is_fast_and_resets_attempts(self):
+        with AttemptWriter(flush_size=10) as writer:
+            for _ in range(3):
+                writer.add(mailing=self.mailing, recipient=self.recipient, status="successfully", owner=self.owner)
+        self.assertEqual(len(self.attempts()), 3)
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks, CaptureQueriesContext(connection) as queries:
+            self.mailing.delete()
+        self.assertEqual(len(callbacks), 1)  # Один сброс на рассылку, а не на каждую попытку
+        attempt_selects = [q["sql"] for q in queries if q["sql"].startswith("SELECT") and "send_attempts" in q["sql"]]
+        self.assertEqual(attempt_selects, [])  # Попытки удаляются одним DELETE, без чтения строк
+        self.assertEqual(self.attempts(), [])
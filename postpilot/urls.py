@@ -6,6 +6,7 @@ from .views import (
     HomeView,
     MailingCreateView,
     MailingListView,
+    MailingProgressView,
     MailingUpdateView,
     MailingDeleteView,
     RecipientCreateView,
@@ -18,6 +19,7 @@ from .views import (
     MessageDeleteView,
     SendAttemptCreateView,
     SendAttemptView,
+    SendAttemptListView,
     StopAttemptView,
 )
 
@@ -40,6 +42,9 @@ urlpatterns = [
         MailingDeleteView.as_view(),
         name="mailing_delete",
     ),  # Форма удаления рассылки
+    path(
+        "mailing/<int:pk>/progress/", MailingProgressView.as_view(), name="mailing_progress"
+    ),  # Прогресс отправки рассылки (JSON)
     #
     # -- recipient section --
     path("recipient_form/", RecipientCreateView.as_view(), name="recipient_create"),  # Форма для создания пользователя
@@ -71,6 +76,7 @@ urlpatterns = [
     path(
         "sendattempt_form/", SendAttemptCreateView.as_view(), name="sendattempt_create"
     ),  # Форма создания попытки рассылки
+    path("sendattempt_list/", SendAttemptListView.as_view(), name="sendattempt_list"),  # Список попыток рассылки
     path(
         "sendattempt/<int:pk>/send/", SendAttemptView.as_view(), name="sendattempt"
     ),  # Форма запуска попытки рассылки
@@ -3,6 +3,7 @@ import logging
 from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.mixins import UserPassesTestMixin
+from django.http import Http404, JsonResponse
 from django.shortcuts import get_object_or_404, redirect
 from django.urls import reverse_lazy
 from django.views import View
@@ -14,14 +15,30 @@ from django.views.generic import (
     TemplateView,
 )
 
+from core.cache import invalidate_owner
 from core.mixins import OwnerRequiredMixin, IsManagerOrOwnerListMixin
+from core.pagination import KeysetPaginationMixin
 from .forms import RecipientForm, MessageForm, MailingForm, SendAttemptForm
+from .jobs import enqueue_mailing
 from .models import Recipient, Message, Mailing, SendAttempt
-from .services import send_mailing
+from .progress import get_progress
+from .stats import dashboard_stats, welcome_stats
+from users.roles import is_manager
+from .services import cancel_mailing, resume_mailing
 
 logger = logging.getLogger(__name__)
 
 
+# -- Mixins --
+class StatsMixin:
+    """Добавляет в контекст счётчики объектов (postpilot.stats): все для менеджера, свои для владельца."""
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["stats"] = dashboard_stats(None if is_manager(self.request) else self.request.user)
+        return context
+
+
 # -- Welcome view --
 class WelcomeView(TemplateView):
     """
@@ -31,11 +48,9 @@ class WelcomeView(TemplateView):
     template_name = "welcome.html"
 
     def get_context_data(self, **kwargs):
-        """Добавляем переменную в контекст для отображения количества рассылок."""
+        """Добавляем в контекст счётчики рассылок и получателей (один запрос, результат кэшируется)."""
         context = super().get_context_data(**kwargs)
-        context["mailings"] = Mailing.objects.all()  # Все рассылки
-        context["mailings_started"] = Mailing.objects.filter(status="started")  # Только активные рассылки
-        context["recipients"] = Recipient.objects.all()  # Получатели
+        context["stats"] = welcome_stats()
 
         return context
 
@@ -47,34 +62,39 @@ class HomeView(UserPassesTestMixin, OwnerRequiredMixin, TemplateView):
     """
 
     template_name = "home.html"
+    list_size = 20  # Сколько последних объектов показывать в каждом списке страницы
 
     def test_func(self):
         """Метод для проверки прав доступа."""
-        user = self.request.user
-        return user.groups.filter(name="Менеджеры").exists() or user.is_authenticated
+        return is_manager(self.request) or self.request.user.is_authenticated
 
     def get_context_data(self, **kwargs):
-        """Добавляем переменную в контекст для отображения количества рассылок со статусом "started"."""
+        """
+        Добавляем в контекст счётчики (один запрос, результат кэшируется) и последние рассылки, получателей
+        и попытки отправки.
+        """
         context = super().get_context_data(**kwargs)
         user = self.request.user
 
-        if user.groups.filter(name="Менеджеры").exists():  # Фильтруем объекты только для менеджера
-            context["mailings"] = Mailing.objects.all()
-            context["mailings_started"] = Mailing.objects.filter(status="started")
-            context["recipients"] = Recipient.objects.all()
-            context["send_attempts"] = SendAttempt.objects.all()
+        if is_manager(self.request):  # Менеджер видит все объекты
+            context["stats"] = dashboard_stats()
+            scope = {}
 
         elif user.is_authenticated:  # Фильтруем объекты только для владельца
-            context["mailings"] = Mailing.objects.filter(owner=user)
-            context["mailings_started"] = Mailing.objects.filter(owner=user, status="started")
-            context["recipients"] = Recipient.objects.filter(owner=user)
-            context["send_attempts"] = SendAttempt.objects.filter(owner=user)
+            context["stats"] = dashboard_stats(user)
+            scope = {"owner": user}
 
         else:  # Остальные не видят ничего
-            context["mailings"] = Mailing.objects.none()
-            context["mailings_started"] = Mailing.objects.none()
-            context["recipients"] = Recipient.objects.none()
-            context["send_attempts"] = SendAttempt.objects.none()
+            context["stats"] = {}
+            scope = {"pk__in": []}
+
+        mailings = Mailing.objects.filter(**scope).select_related("message")
+        context["mailings"] = mailings[: self.list_size]
+        context["mailings_started"] = mailings.filter(status="started")[: self.list_size]
+        context["recipients"] = Recipient.objects.filter(**scope).order_by("-pk")[: self.list_size]
+        context["send_attempts"] = SendAttempt.objects.filter(**scope).select_related(
+            "mailing__message", "recipient", "owner"
+        )[: self.list_size]
 
         return context
 
@@ -98,7 +118,9 @@ class RecipientCreateView(OwnerRequiredMixin, CreateView):
         )
         form.instance.owner = self.request.user  # Устанавливаем текущего пользователя владельцем
         logger.info(f"Владелец рассылки - {self.request.user}")
-        return super().form_valid(form)
+        response = super().form_valid(form)
+        invalidate_owner(self.object.owner_id, SendAttempt)  # Сигналы сброса кэша у попыток не подключены
+        return response
 
     def form_invalid(self, form):
         """Обработка в случае неверной формы."""
@@ -106,9 +128,9 @@ class RecipientCreateView(OwnerRequiredMixin, CreateView):
         return super().form_invalid(form)
 
 
-class RecipientListView(IsManagerOrOwnerListMixin, ListView):
+class RecipientListView(StatsMixin, KeysetPaginationMixin, IsManagerOrOwnerListMixin, ListView):
     """
-    View для отображения списка получателей.
+    View для отображения списка получателей (постранично, от новых к старым).
     """
 
     model = Recipient
@@ -188,14 +210,15 @@ class MessageCreateView(OwnerRequiredMixin, CreateView):
         return super().form_invalid(form)
 
 
-class MessageListView(IsManagerOrOwnerListMixin, ListView):
+class MessageListView(StatsMixin, KeysetPaginationMixin, IsManagerOrOwnerListMixin, ListView):
     """
-    View для отображения списка сообщений.
+    View для отображения списка сообщений (постранично, по дате создания).
     """
 
     model = Message
     form_class = MessageForm
     context_object_name = "messages"
+    keyset_field = "created_at"
 
 
 class MessageUpdateView(OwnerRequiredMixin, UpdateView):
@@ -268,14 +291,37 @@ class MailingCreateView(OwnerRequiredMixin, CreateView):
         return super().form_invalid(form)
 
 
-class MailingListView(IsManagerOrOwnerListMixin, ListView):
+class MailingListView(StatsMixin, KeysetPaginationMixin, IsManagerOrOwnerListMixin, ListView):
     """
-    View для отображения списка рассылок.
+    View для отображения списка рассылок (постранично, по дате завершения отправки).
     """
 
     model = Mailing
+    queryset = Mailing.objects.select_related("message")  # Название рассылки - тема сообщения
     form_class = MailingForm
     context_object_name = "mailings"
+    keyset_field = "sent_completed_at"
+
+
+class MailingProgressView(LoginRequiredMixin, View):
+    """
+    View с прогрессом отправки рассылки в формате JSON. Читает только кэш (postpilot.progress), без запросов к БД
+    для владельца рассылки. Список рассылок опрашивает его раз в несколько секунд, пока рассылка отправляется:
+    каждый опрос - короткий запрос, который не занимает процесс сервера между обновлениями.
+    """
+
+    def get_progress(self, pk):
+        """Возвращает прогресс рассылки, если он есть и пользователь - владелец рассылки или менеджер."""
+        progress = get_progress(pk)
+        if progress is None:
+            raise Http404("Прогресс рассылки не найден.")
+
+        if progress.pop("owner") != self.request.user.pk and not is_manager(self.request):
+            raise Http404("Прогресс рассылки не найден.")
+        return progress
+
+    def get(self, request, pk):
+        return JsonResponse(self.get_progress(pk))
 
 
 class MailingUpdateView(OwnerRequiredMixin, UpdateView):
@@ -354,26 +400,30 @@ class SendAttemptView(OwnerRequiredMixin, View):
     """
 
     def post(self, request, pk):
-        """Переопределение метода POST для запуска попытки рассылки."""
+        """Переопределение метода POST для запуска попытки рассылки. Рассылка только ставится в очередь,
+        отправку выполняет обработчик очереди (./manage.py run_mailing_worker)."""
         mailing = get_object_or_404(Mailing, pk=pk)
 
         try:
-            send_mailing(mailing)  # Вызов сервисной функции
-            messages.success(request, f"Рассылка '{mailing}' успешно отправлена!")
+            resume_mailing(mailing)  # Явный запуск пользователем снимает прежний запрос остановки
+            enqueue_mailing(mailing)  # Вызов сервисной функции
+            messages.success(request, f"Рассылка '{mailing}' поставлена в очередь на отправку!")
         except Exception as e:
-            messages.error(request, f"Ошибка при отправке рассылки: {e}")
+            messages.error(request, f"Ошибка при постановке рассылки в очередь: {e}")
 
         return redirect("postpilot:mailing_list")
 
 
-class SendAttemptListView(IsManagerOrOwnerListMixin, ListView):
+class SendAttemptListView(StatsMixin, KeysetPaginationMixin, IsManagerOrOwnerListMixin, ListView):
     """
-    View для отображения списка попыток рассылки.
+    View для отображения списка попыток рассылки (постранично, по дате попытки).
     """
 
     model = SendAttempt
+    queryset = SendAttempt.objects.select_related("mailing__message")  # Название рассылки - тема сообщения
     form_class = SendAttemptForm
     context_object_name = "send_attempts"
+    keyset_field = "attempt_at"
 
 
 class SendAttemptUpdateView(OwnerRequiredMixin, UpdateView):
@@ -390,7 +440,9 @@ class SendAttemptUpdateView(OwnerRequiredMixin, UpdateView):
         self.object = form.save()  # Сохраняем объект формы в базу
         logger.info("Попытка рассылки успешно обновлена.")
         logger.info(f"Владелец рассылки - {self.request.user}")
-        return super().form_valid(form)
+        response = super().form_valid(form)
+        invalidate_owner(self.object.owner_id, SendAttempt)  # Сигналы сброса кэша у попыток не подключены
+        return response
 
     def form_invalid(self, form):
         """Обработка в случае неверной формы."""
@@ -417,7 +469,9 @@ class SendAttemptDeleteView(OwnerRequiredMixin, DeleteView):
         send_attempt = self.get_object()
         logger.info(f"Попытка рассылки успешно удалена. Статус: '{send_attempt.status}'")
         logger.info(f"Владелец рассылки - {self.request.user}")
-        return super().delete(request, *args, **kwargs)
+        response = super().delete(request, *args, **kwargs)
+        invalidate_owner(send_attempt.owner_id, SendAttempt)  # Сигналы сброса кэша у попыток не подключены
+        return response
 
 
 class StopAttemptView(LoginRequiredMixin, View):
@@ -440,9 +494,8 @@ class StopAttemptView(LoginRequiredMixin, View):
             logger.warning("Рассылка не находится в активном состоянии.")
             return redirect("postpilot:mailing_list")
 
-        # Останавливаем рассылку
-        mailing.status = "broken"
-        mailing.save()
+        # Останавливаем рассылку: процесс, который её отправляет, прекратит отправку после текущей пачки писем
+        cancel_mailing(mailing)
 
         messages.success(request, "Рассылка успешно остановлена.")
         logger.info("Рассылка успешно остановлена.")
@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class UsersConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "users"
+
+    def ready(self):
+        """Подключает сброс кэша результатов (core.cache) при изменении пользователей и сброс кэша ролей."""
+        from core.cache import connect_invalidation
+        from users import roles
+        from users.models import CustomUser
+
+        connect_invalidation(CustomUser)
+        roles.connect_invalidation()
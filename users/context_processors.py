@@ -0,0 +1,6 @@
+from users.roles import is_manager
+
+
+def roles(request):
+    """Добавляет в контекст шаблонов признак, является ли пользователь менеджером."""
+    return {"is_manager": is_manager(request)}
@@ -0,0 +1,17 @@
+from django.utils.functional import SimpleLazyObject
+
+from users.roles import get_roles
+
+
+class RolesMiddleware:
+    """
+    Добавляет к запросу роли пользователя (request.roles). Роли вычисляются при первом обращении, один раз
+    за запрос. Подключается после AuthenticationMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.roles = SimpleLazyObject(lambda: get_roles(request.user))
+        return self.get_response(request)
@@ -0,0 +1,90 @@
+"""
+Роли пользователей.
+Роли пользователя - названия его групп - вычисляются один раз за запрос (RolesMiddleware) и кэшируются между
+запросами. В ключ кэша входит версия ролей, которая увеличивается при любом изменении состава групп
+(m2m_changed) и самих групп (post_save, post_delete), поэтому устаревшие роли не читаются.
+"""
+
+import time
+
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+from users.models import CustomUser
+
+MANAGERS_GROUP = "Менеджеры"
+
+# Ключ версии ролей, ключ ролей пользователя (версия, id пользователя) и время их хранения, с
+VERSION_KEY = "users:roles:version"
+ROLES_KEY = "users:roles:{}:{}"
+ROLES_TIMEOUT = 3600
+
+
+def get_version() -> int:
+    """Текущая версия ролей."""
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Начальная версия - текущее время: если ключ версии вытеснен из кэша, прежние роли не оживут
+        cache.add(VERSION_KEY, time.time_ns(), None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def invalidate_roles(sender=None, action: str = "post_save", **kwargs):
+    """
+    Обработчик изменения групп и их состава: делает устаревшими роли всех пользователей после фиксации транзакции.
+    """
+    if action.startswith("pre_"):
+        return
+    transaction.on_commit(_bump_version)
+
+
+def _bump_version():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, time.time_ns(), None)
+
+
+def get_roles(user) -> frozenset:
+    """Роли пользователя: из кэша или из БД (с сохранением в кэш). У анонимного пользователя ролей нет."""
+    if not user.is_authenticated:
+        return frozenset()
+
+    key = ROLES_KEY.format(get_version(), user.pk)
+    roles = cache.get(key)
+    if roles is None:
+        roles = frozenset(user.groups.values_list("name", flat=True))
+        cache.set(key, roles, ROLES_TIMEOUT)
+    return roles
+
+
+def get_manager_ids() -> frozenset:
+    """id всех менеджеров: из кэша или из БД (с сохранением в кэш)."""
+    key = ROLES_KEY.format(get_version(), "managers")
+    manager_ids = cache.get(key)
+    if manager_ids is None:
+        manager_ids = frozenset(CustomUser.objects.filter(groups__name=MANAGERS_GROUP).values_list("pk", flat=True))
+        cache.set(key, manager_ids, ROLES_TIMEOUT)
+    return manager_ids
+
+
+def request_roles(request) -> frozenset:
+    """Роли пользователя запроса. Вычисляются при первом обращении и хранятся в request.roles до конца запроса."""
+    if not hasattr(request, "roles"):
+        request.roles = get_roles(request.user)
+    return request.roles
+
+
+def is_manager(request) -> bool:
+    """Является ли пользователь запроса менеджером."""
+    return MANAGERS_GROUP in request_roles(request)
+
+
+def connect_invalidation():
+    """Подключает сброс ролей при изменении групп и состава групп пользователей."""
+    m2m_changed.connect(invalidate_roles, sender=CustomUser.groups.through, dispatch_uid="users.roles:m2m")
+    post_save.connect(invalidate_roles, sender=Group, dispatch_uid="users.roles:save")
+    post_delete.connect(invalidate_roles, sender=Group, dispatch_uid="users.roles:delete")
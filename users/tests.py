@@ -1,3 +1,54 @@
-# from django.test import TestCase
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 
-# Create your tests here.
+from users.models import CustomUser
+from users.roles import MANAGERS_GROUP, get_manager_ids, get_roles
+
+LOCMEM_CACHE = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class RolesCacheTest(TestCase):
+    """Кэш ролей: роли читаются из кэша, а изменение состава групп и самих групп делает их устаревшими."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(email="roles@example.com", username="roles", password="x")
+        cls.managers = Group.objects.create(name=MANAGERS_GROUP)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_roles_are_cached(self):
+        self.assertEqual(get_roles(self.user), frozenset())
+        with self.assertNumQueries(0):
+            get_roles(self.user)
+
+    def test_adding_and_removing_user_invalidates_roles(self):
+        self.assertEqual(get_roles(self.user), frozenset())
+        self.assertEqual(get_manager_ids(), frozenset())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.groups.add(self.managers)
+        self.assertEqual(get_roles(self.user), frozenset({MANAGERS_GROUP}))
+        self.assertEqual(get_manager_ids(), frozenset({self.user.pk}))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.managers.user_set.remove(self.user)  # Изменение с другой стороны связи
+        self.assertEqual(get_roles(self.user), frozenset())
+        self.assertEqual(get_manager_ids(), frozenset())
+
+    def test_group_changes_invalidate_roles(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.groups.add(self.managers)
+        self.assertEqual(get_roles(self.user), frozenset({MANAGERS_GROUP}))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.managers.name = "Операторы"
+            self.managers.save()
+        self.assertEqual(get_roles(self.user), frozenset({"Операторы"}))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.managers.delete()
+        self.assertEqual(get_roles(self.user), frozenset())
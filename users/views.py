@@ -14,6 +14,7 @@ from django.views.generic import CreateView, UpdateView, ListView
 from core.mixins import IsManagerOrOwnerListMixin
 from users.forms import CustomUserRegisterForm
 from users.models import CustomUser
+from users.roles import get_manager_ids, is_manager
 
 logger = logging.getLogger(__name__)
 
@@ -91,6 +92,12 @@ class CustomUserListView(IsManagerOrOwnerListMixin, ListView):
     template_name = "users/users_list.html"
     context_object_name = "users"
 
+    def get_context_data(self, **kwargs):
+        """Добавляет в контекст id менеджеров (их нельзя заблокировать из списка)."""
+        context = super().get_context_data(**kwargs)
+        context["manager_ids"] = get_manager_ids()
+        return context
+
 
 class CustomUserBlockView(IsManagerOrOwnerListMixin, View):
     """
@@ -100,7 +107,7 @@ class CustomUserBlockView(IsManagerOrOwnerListMixin, View):
 
     def test_func(self):
         """Проверяет, является ли пользователь менеджером."""
-        return self.request.user.groups.filter(name="Менеджеры").exists()
+        return is_manager(self.request)
 
     def post(self, request, *args, **kwargs):
         """Обрабатывает POST-запрос для блокировки/разблокировки пользователя."""